@@ -1,14 +1,30 @@
+import hashlib
 import json
 import os
+import threading
 import time
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from Auto_process.mail_AutoProcess import VALID_SCORE, CURRENT_DIR, AI_CONFIG
+from Auto_process.mail_AutoProcess import VALID_SCORE, CURRENT_DIR, AI_CONFIG, LOCAL_CLASSIFIER_CONFIG, \
+    NEAR_DUPLICATE_CONFIG, AI_CONCURRENCY_CONFIG, AI_HEDGING_CONFIG, EMBEDDING_INDEX_CONFIG, HIERARCHICAL_SUMMARY_CONFIG, MODEL_CASCADE_CONFIG, \
+    API_KEY
 from Auto_process.mail_AutoProcess import TIMEZONE
-from Utils.util import datetime_to_json
+from Utils.util import datetime_to_json, reduce_email_body, get_email_key, get_sortable_time
+from Utils.pre_classifier import LocalPreClassifier
+from Utils.simhash_index import NearDuplicateIndex
+from Utils.embedding_index import EmbeddingIndex, create_embedder, select_relevant_emails
+from Utils.ai_throttle import AdaptiveConcurrencyController, AIWorkDeferredError, CycleBudget, RequestRateLimiter, \
+    is_retryable_error, get_retry_after
+from Utils.prompt_templates import compile_prompt_templates
+from Utils.hedging import RequestHedger
+from Utils.metrics import METRICS
 
 PROMPT_FILE_PATH = os.path.join(CURRENT_DIR, "../Configs/Prompt_config.json")
 JUDGMENT_RECORD_PATH = os.path.join(CURRENT_DIR, "../Info/mail_judgement_record.json")
+PRE_CLASSIFIER_MODEL_PATH = os.path.join(CURRENT_DIR, "../Info/pre_classifier_model.json")
+NEAR_DUPLICATE_INDEX_PATH = os.path.join(CURRENT_DIR, "../Info/near_duplicate_index.jsonl")
+EMBEDDING_INDEX_DIR = os.path.join(CURRENT_DIR, "../Info/embedding_index")
 
 # ---AI API访问频率限制 ---
 SECONDS_BETWEEN_REQUESTS = AI_CONFIG['SECONDS_BETWEEN_REQUESTS']
@@ -23,28 +39,277 @@ except json.JSONDecodeError:
     print(f"错误：配置文件 {PROMPT_FILE_PATH} 格式不正确。")
     score_list = {}
 
-CLASSIFICATION_PROMPT = prompt_file["CLASSIFICATION"]
-SUMMARY_PROMPT = prompt_file["SUMMARY"]
-CONVO_PROMPT = prompt_file["CONVERSATION"]
-HISTORY_SUMMARY = prompt_file["HISTORY_SUMMARY"]
-HISTORY_UPDATE = prompt_file["HISTORY_UPDATE"]
-CREATE_STYLE_PROMPT = prompt_file["CREATE_STYLE_PROFILE"]
-UPDATE_STYLE_PROMPT = prompt_file["UPDATE_STYLE_PROFILE"]
+# --- 分阶段模型路由: 阶段 -> 路由配置 (FAST_MODEL / STRONG_MODEL / 升级阈值)，未配置的阶段直接使用传入的模型 ---
+MODEL_CASCADE = MODEL_CASCADE_CONFIG.get('STAGES', {}) if MODEL_CASCADE_CONFIG.get('ENABLED', False) else {}
+
+# --- Prompt 模板 (加载时编译一次，静态前缀放在开头以命中隐式前缀缓存) ---
+# (只有启用了模型路由的阶段才要求模型返回 confidence)
+PROMPT_TEMPLATES = compile_prompt_templates(prompt_file, confidence_stages=MODEL_CASCADE)
+CLASSIFICATION_TEMPLATE = PROMPT_TEMPLATES["CLASSIFICATION"]
+SUMMARY_TEMPLATE = PROMPT_TEMPLATES["SUMMARY"]
+CONVO_TEMPLATE = PROMPT_TEMPLATES.get("CONVERSATION")
+HISTORY_SUMMARY_TEMPLATE = PROMPT_TEMPLATES["HISTORY_SUMMARY"]
+HISTORY_UPDATE_TEMPLATE = PROMPT_TEMPLATES["HISTORY_UPDATE"]
+CREATE_STYLE_TEMPLATE = PROMPT_TEMPLATES["CREATE_STYLE_PROFILE"]
+UPDATE_STYLE_TEMPLATE = PROMPT_TEMPLATES["UPDATE_STYLE_PROFILE"]
+# (总体总结与口吻分析合并为一次调用；配置中缺失时退回分别调用)
+CONVERSATION_PROFILE_TEMPLATE = PROMPT_TEMPLATES.get("CONVERSATION_PROFILE")
+HISTORY_CHUNK_TEMPLATE = PROMPT_TEMPLATES.get("HISTORY_CHUNK_SUMMARY")
+HISTORY_REDUCE_TEMPLATE = PROMPT_TEMPLATES.get("HISTORY_REDUCE")
+
+# --- 本地预分类器 (基于历史判断记录训练，用于在调用 AI 前截留高置信度邮件) ---
+LOCAL_CLASSIFIER_ENABLED = LOCAL_CLASSIFIER_CONFIG.get('ENABLED', False)
+LOCAL_CLASSIFIER = LocalPreClassifier(
+    PRE_CLASSIFIER_MODEL_PATH,
+    confidence_threshold=LOCAL_CLASSIFIER_CONFIG.get('CONFIDENCE_THRESHOLD', 0.97),
+    min_samples=LOCAL_CLASSIFIER_CONFIG.get('MIN_TRAINING_SAMPLES', 200)
+) if LOCAL_CLASSIFIER_ENABLED else None
+
+# --- 近似重复索引 (模板化群发邮件直接继承历史判断) ---
+NEAR_DUPLICATE_ENABLED = NEAR_DUPLICATE_CONFIG.get('ENABLED', False)
+NEAR_DUPLICATE_INHERIT_SUMMARY = NEAR_DUPLICATE_CONFIG.get('INHERIT_SUMMARY', False)
+NEAR_DUPLICATE_INDEX = NearDuplicateIndex(
+    NEAR_DUPLICATE_INDEX_PATH,
+    max_distance=NEAR_DUPLICATE_CONFIG.get('MAX_HAMMING_DISTANCE', 3)
+) if NEAR_DUPLICATE_ENABLED else None
+# 可加入近似重复索引的判断类型 (均为 AI 做出的判断)
+NEAR_DUPLICATE_SOURCE_TYPES = ("classification", "get_summary")
+
+# --- 对话记忆向量索引 (在字数预算内按相关性挑选总结/口吻分析的上下文，而不是盲目截断) ---
+EMBEDDING_INDEX_ENABLED = EMBEDDING_INDEX_CONFIG.get('ENABLED', False)
+# (首次使用时由 get_embedding_index 创建，导入本模块时不读写索引目录)
+EMBEDDING_INDEX = None
+EMBEDDING_INDEX_LOCK = threading.Lock()
+CONTEXT_BUDGET_CHARS = EMBEDDING_INDEX_CONFIG.get('CONTEXT_BUDGET_CHARS', 3000)
+RECENT_CONTEXT_EMAILS = EMBEDDING_INDEX_CONFIG.get('RECENT_CONTEXT_EMAILS', 3)
+
+# 单次总结调用发送的对话摘要字数上限
+HISTORY_DIGEST_CHARS = 3000
+
+# --- 长对话分层总结 (按时间分段并行总结，再合并为总体总结；分段结果保存在对话的 chunk_summaries 中) ---
+HIERARCHICAL_SUMMARY_ENABLED = (
+    HIERARCHICAL_SUMMARY_CONFIG.get('ENABLED', False)
+    and HISTORY_CHUNK_TEMPLATE is not None and HISTORY_REDUCE_TEMPLATE is not None
+)
+# 完整对话摘要超过此字数时改用分层总结 (单次总结只能发送前 3000 字)
+HIERARCHICAL_MIN_DIGEST_CHARS = HIERARCHICAL_SUMMARY_CONFIG.get('MIN_DIGEST_CHARS', 3000)
+SUMMARY_CHUNK_EMAILS = HIERARCHICAL_SUMMARY_CONFIG.get('CHUNK_EMAILS', 20)
+SUMMARY_CHUNK_CHARS = HIERARCHICAL_SUMMARY_CONFIG.get('CHUNK_CHARS', 3000)
+SUMMARY_REDUCE_CHARS = HIERARCHICAL_SUMMARY_CONFIG.get('REDUCE_CHARS', 3000)
+
+# --- AI 自适应并发控制与熔断 (所有 AI 阶段共享) ---
+AI_CONTROLLER = (
+    AdaptiveConcurrencyController.from_config(AI_CONCURRENCY_CONFIG)
+    if AI_CONCURRENCY_CONFIG.get('ENABLED', False) else None
+)
+MAX_RETRIES = AI_CONCURRENCY_CONFIG.get('MAX_RETRIES', 3)
+BASE_RETRY_DELAY = AI_CONCURRENCY_CONFIG.get('BASE_RETRY_DELAY_SECONDS', 5)
+
+# --- AI 请求对冲 (超过该阶段耗时的高百分位时发出副本请求，先返回者胜出) ---
+REQUEST_HEDGER = RequestHedger.from_config(AI_HEDGING_CONFIG) if AI_HEDGING_CONFIG.get('ENABLED', False) else None
+
+# --- 本周期的 AI 时间预算 (由 auto_process 在每个周期开始时设置，None 表示不限) ---
+CYCLE_BUDGET = None
+
+
+def start_cycle_budget(seconds):
+    """开始新周期的 AI 时间预算；seconds 为空或不大于 0 时不限制。"""
+    global CYCLE_BUDGET
+    CYCLE_BUDGET = CycleBudget(seconds) if seconds and seconds > 0 else None
+    return CYCLE_BUDGET
+
+
+def end_cycle_budget():
+    global CYCLE_BUDGET
+    CYCLE_BUDGET = None
+
+
+# --- 每分钟请求数上限 (批量回放等长时间任务使用，None 表示不限) ---
+REQUEST_RATE_LIMITER = None
+
+
+def set_request_rate_limit(max_per_minute):
+    """设置所有 AI 调用共享的每分钟请求数上限；max_per_minute 为空或不大于 0 时取消限制。"""
+    global REQUEST_RATE_LIMITER
+    REQUEST_RATE_LIMITER = RequestRateLimiter(max_per_minute) if max_per_minute and max_per_minute > 0 else None
+    return REQUEST_RATE_LIMITER
+
+
+def admit_hedge_request():
+    """对冲副本请求同样计入每分钟请求数上限与并发控制器；没有空闲配额/名额时不对冲 (不等待)。"""
+    if REQUEST_RATE_LIMITER and not REQUEST_RATE_LIMITER.try_acquire():
+        return False
+    if AI_CONTROLLER and not AI_CONTROLLER.try_acquire():
+        return False
+    METRICS.incr("ai.hedges")
+    return True
+
+
+def release_hedge_request(error=None):
+    """副本请求结束: 归还并发名额，429/503 等结果同样用于调整并发上限与熔断状态。"""
+    if AI_CONTROLLER:
+        AI_CONTROLLER.release(error)
+
 
 # --- 辅助函数：重试机制 (用于处理 API 错误) ---
-def retry_gemini_call(func, *args, max_retries=3, delay=5, **kwargs):
-    """为 Gemini API 调用添加指数退避重试机制"""
+def retry_gemini_call(func, *args, max_retries=MAX_RETRIES, delay=BASE_RETRY_DELAY, hedge_key=None, validate=None,
+                      **kwargs):
+    """
+    为 AI API 调用添加指数退避重试机制。
+    - 只重试限流 (429)、服务过载 (503) 与临时性错误；请求本身的错误 (4xx) 直接抛出。
+    - 服务端给出 retry_after/retryDelay 时按其等待，而不是固定的退避时间。
+    - 启用 AI_CONTROLLER 时，每次尝试都占用一个共享的并发名额，结果用于调整并发上限与熔断状态；
+      熔断器打开时抛出 CircuitOpenError，不再重试。
+    - 本周期时间预算耗尽时抛出 CycleBudgetExceededError，不再发出新的调用。
+    - 设置了 REQUEST_RATE_LIMITER 时，每次尝试前按每分钟请求数上限等待。
+    - 启用 REQUEST_HEDGER 且给出 hedge_key (阶段:模型) 时，每次尝试都可能被对冲；
+      副本请求计入并发控制与速率限制，对冲时先通过 validate 校验的结果胜出。
+    - 尝试、重试与最终失败的次数计入 METRICS (ai.attempts / ai.retries / ai.failures)。
+    """
     for attempt in range(max_retries):
+        if CYCLE_BUDGET:
+            CYCLE_BUDGET.check()
+        if REQUEST_RATE_LIMITER:
+            REQUEST_RATE_LIMITER.acquire()
+        if AI_CONTROLLER:
+            AI_CONTROLLER.acquire()  # (熔断时抛出 CircuitOpenError)
+
+        METRICS.incr("ai.attempts")
+        error = None
         try:
+            if REQUEST_HEDGER and hedge_key:
+                return REQUEST_HEDGER.call(hedge_key, func, *args, admit=admit_hedge_request,
+                                           release=release_hedge_request, validate=validate, **kwargs)
             return func(*args, **kwargs)
         except Exception as e:
-            if attempt < max_retries - 1:
-                print(f"警告：Gemini API 调用失败 ({e})，将在 {delay} 秒后重试... (尝试 {attempt + 1}/{max_retries})")
-                time.sleep(delay)
-                delay *= 2
-            else:
-                print(f"FATAL: Gemini API 多次重试失败，跳过此邮件。错误: {e}")
-                raise
+            error = e
+        finally:
+            if AI_CONTROLLER:
+                AI_CONTROLLER.release(error)
+
+        if not is_retryable_error(error):
+            METRICS.incr("ai.failures")
+            print(f"FATAL: AI API 请求错误 (不可重试)，跳过此邮件。错误: {error}")
+            raise error
+
+        if attempt < max_retries - 1:
+            wait = get_retry_after(error) or delay
+            METRICS.incr("ai.retries")
+            print(f"警告：AI API 调用失败 ({error})，将在 {wait} 秒后重试... (尝试 {attempt + 1}/{max_retries})")
+            time.sleep(wait)
+            delay *= 2
+        else:
+            METRICS.incr("ai.failures")
+            print(f"FATAL: AI API 多次重试失败，跳过此邮件。错误: {error}")
+            raise error
+
+
+# --- 辅助函数：批量执行 AI 任务 ---
+def map_ai_tasks(func, items):
+    """
+    对 items 中的每一项执行 func，按输入顺序返回结果列表。
+    启用 AI_CONTROLLER 时使用线程池并发执行 (实际在途请求数由控制器的自适应上限决定)；
+    否则串行执行 (请求间隔由 request_ai_json 中的 SECONDS_BETWEEN_REQUESTS 控制)。
+    """
+    if AI_CONTROLLER and len(items) > 1:
+        with ThreadPoolExecutor(max_workers=min(AI_CONTROLLER.max_limit, len(items))) as executor:
+            return list(executor.map(func, items))
+    return [func(item) for item in items]
+
+
+# --- 统一的 AI 调用入口 ---
+def request_ai_json(ai_client, template, model_name, **fields):
+    """
+    通过 AI 后端发送 prompt 并解析 JSON 响应。所有 AI 阶段都经由此函数调用模型。
+
+    Args:
+        ai_client: 已经初始化的 AI 后端实例 (Utils.ai_backend.AIBackend)。
+        template: 编译后的 Prompt 模板 (Utils.prompt_templates.PromptTemplate)。
+        model_name: 使用的模型名称
+        **fields: 填充模板变化部分的字段。
+
+    Returns:
+        dict: 解析后的 JSON 结果。
+    """
+    try:
+        # (耗时按阶段计入 METRICS: ai.<阶段>，包含重试与等待)
+        with METRICS.timer(f"ai.{template.stage}"):
+            text = retry_gemini_call(ai_client.generate, template.render(**fields), model_name,
+                                     hedge_key=f"{template.stage}:{model_name}", validate=json.loads,
+                                     stage=template.stage,
+                                     prefix=template.prefix)
+    finally:
+        # 未启用自适应并发控制时，沿用固定的请求间隔
+        if not AI_CONTROLLER:
+            time.sleep(SECONDS_BETWEEN_REQUESTS)
+    return json.loads(text)
+
+
+# --- 分阶段模型路由 (cascade) ---
+def get_confidence(result):
+    """AI 返回的置信度 (0~1)；缺失或无法解析时视为 0 (一律升级)。"""
+    try:
+        return max(0.0, min(1.0, float(result.get('confidence', 0))))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def classification_needs_escalation(result, confidence, route):
+    """低置信度，或评分处于有效阈值 (VALID_SCORE) 附近且置信度不够高时升级。"""
+    if confidence < route.get('MIN_CONFIDENCE', 0.6):
+        return True
+    try:
+        score = int(result.get('score'))
+    except (TypeError, ValueError):
+        return True
+    margin = route.get('BORDERLINE_MARGIN', 1)
+    if VALID_SCORE - margin <= score < VALID_SCORE + margin:
+        return confidence < route.get('BORDERLINE_MIN_CONFIDENCE', 0.85)
+    return False
+
+
+def conversation_needs_escalation(result, confidence, route):
+    return confidence < route.get('MIN_CONFIDENCE', 0.75)
+
+
+def request_ai_json_cascade(ai_client, template, model_name, needs_escalation, **fields):
+    """
+    按 MODEL_CASCADE 中该阶段 (template.stage) 的路由调用模型:
+    先用 FAST_MODEL，needs_escalation(result, confidence, route) 为真时再用 STRONG_MODEL (缺省为 model_name)。
+    快速模型调用失败 (非推迟) 时直接改用强模型；强模型调用被推迟时整体推迟 (不使用未经确认的快速结果)。
+
+    Returns:
+        tuple: (最终结果, 路由记录 或 None (该阶段未配置路由))
+            路由记录: {"fast_model", "fast_verdict", "confidence", "escalated", "strong_model"?, ...}，写入判断记录。
+    """
+    route = MODEL_CASCADE.get(template.stage)
+    if not route or not route.get('FAST_MODEL'):
+        return request_ai_json(ai_client, template, model_name, **fields), None
+
+    strong_model = route.get('STRONG_MODEL') or model_name
+    record = {"fast_model": route['FAST_MODEL']}
+    try:
+        fast_result = request_ai_json(ai_client, template, route['FAST_MODEL'], **fields)
+        confidence = get_confidence(fast_result)
+        record.update({"fast_verdict": fast_result, "confidence": confidence, "escalated": False})
+        if not needs_escalation(fast_result, confidence, route):
+            return fast_result, record
+    except AIWorkDeferredError:
+        raise
+    except Exception as e:
+        record["fast_error"] = str(e)
+
+    record.update({"escalated": True, "strong_model": strong_model})
+    return request_ai_json(ai_client, template, strong_model, **fields), record
+
+
+def describe_cascade(record):
+    """日志中显示本次判断由哪个模型做出。"""
+    if not record:
+        return ""
+    if record.get("escalated"):
+        return f" [升级至 {record.get('strong_model')}，快速模型置信度 {record.get('confidence', 0):.2f}]"
+    return f" [{record.get('fast_model')}，置信度 {record.get('confidence', 0):.2f}]"
 
 
 # --- 邮件记录保存 ---
@@ -82,24 +347,203 @@ def save_mail_judgment_record(new_records, judgment_type):
 
     # 3. 写入文件
     try:
-        with open(JUDGMENT_RECORD_PATH, 'w', encoding='utf-8') as f:
+        with METRICS.persist(JUDGMENT_RECORD_PATH), open(JUDGMENT_RECORD_PATH, 'w', encoding='utf-8') as f:
             # ensure_ascii=False 确保中文能正确写入 JSON 文件
             # indent=4 使文件格式更易读
             json.dump(combined_records, f, ensure_ascii=False, indent=4,default=datetime_to_json)
         print(f"信息：成功将 {len(new_records)} 条 AI 判断记录追加并写入文件 {JUDGMENT_RECORD_PATH}。")
     except IOError as e:
         print(f"错误：写入文件 {JUDGMENT_RECORD_PATH} 失败: {e}")
+        return
+
+    # 4. 将 AI 对收信的判断加入近似重复索引
+    if NEAR_DUPLICATE_INDEX and judgment_type in NEAR_DUPLICATE_SOURCE_TYPES:
+        NEAR_DUPLICATE_INDEX.add_records([r for r in new_records if r.get("type") == "received"])
+
+    # 5. 用新增的判断记录增量训练本地预分类器
+    if LOCAL_CLASSIFIER:
+        learned = LOCAL_CLASSIFIER.learn_from_judgment_records(combined_records)
+        if learned:
+            print(f"信息：本地预分类模型增量学习了 {learned} 条新样本。")
+
+
+# --- 对话记忆向量索引 ---
+def get_embedding_text(email):
+    """邮件在向量索引中的文本: 主题 + 单封总结 (总结缺失时使用精简后的正文开头)。"""
+    summary = email.get("summary")
+    if not summary or str(summary).startswith("AI处理失败"):
+        summary = reduce_email_body(email.get("body", ""))[:500]
+    return f"{email.get('subject', '')}\n{summary}"
+
+
+def get_embedding_index():
+    """返回对话记忆向量索引 (首次调用时加载/创建)；未启用时返回 None。"""
+    global EMBEDDING_INDEX
+    if not EMBEDDING_INDEX_ENABLED:
+        return None
+    with EMBEDDING_INDEX_LOCK:
+        if EMBEDDING_INDEX is None:
+            EMBEDDING_INDEX = EmbeddingIndex(
+                EMBEDDING_INDEX_DIR, create_embedder(EMBEDDING_INDEX_CONFIG.get('EMBEDDER', {}), API_KEY)
+            )
+        return EMBEDDING_INDEX
+
+
+def index_conversation_emails(address_email_pairs):
+    """将归档到对话中的邮件增量加入向量索引 (已索引的会被跳过)。"""
+    embedding_index = get_embedding_index()
+    if embedding_index is None or not address_email_pairs:
+        return
+    try:
+        added = embedding_index.add([
+            (address, get_email_key(email), get_embedding_text(email)) for address, email in address_email_pairs
+        ])
+        if added:
+            print(f"信息：向量索引新增 {added} 条 (共 {len(embedding_index)} 条)。")
+    except Exception as e:
+        print(f"警告：更新向量索引失败 ({e})，本次将退回截断方式构造上下文。")
+
+
+def bootstrap_embedding_index(all_memory):
+    """索引为空时，从已有的对话记忆构建向量索引。"""
+    embedding_index = get_embedding_index()
+    if embedding_index is None or len(embedding_index) > 0:
+        return
+    index_conversation_emails([
+        (address, email)
+        for address, conversation in all_memory.items() if isinstance(conversation, dict)
+        for email in conversation.get("emails", [])
+    ])
+
+
+def select_context_emails(address, email_list, text_func, recent_count=RECENT_CONTEXT_EMAILS):
+    """在 CONTEXT_BUDGET_CHARS 预算内按相关性挑选邮件；未启用向量索引时原样返回 (由调用方截断)。"""
+    embedding_index = get_embedding_index()
+    if embedding_index is None:
+        return email_list
+    return select_relevant_emails(embedding_index, address, email_list, get_email_key, text_func,
+                                  CONTEXT_BUDGET_CHARS, recent_count=recent_count)
+
+
+# --- 近似重复匹配 ---
+def bootstrap_near_duplicate_index():
+    """索引为空时，从已有的判断记录文件构建近似重复索引。"""
+    if not NEAR_DUPLICATE_INDEX or NEAR_DUPLICATE_INDEX.entries:
+        return
+    try:
+        if os.path.exists(JUDGMENT_RECORD_PATH) and os.path.getsize(JUDGMENT_RECORD_PATH) > 0:
+            with open(JUDGMENT_RECORD_PATH, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            if isinstance(records, list):
+                added = NEAR_DUPLICATE_INDEX.add_records([
+                    r for r in records
+                    if isinstance(r, dict) and r.get("judgment_type") in NEAR_DUPLICATE_SOURCE_TYPES
+                    and r.get("type") == "received"
+                ])
+                print(f"信息：已从判断记录构建近似重复索引，共 {added} 条。")
+    except Exception as e:
+        print(f"警告：从判断记录构建近似重复索引失败 ({e})。")
+
+
+def match_near_duplicate_emails(uncertain_emails):
+    """
+    在调用 AI 评分前，查找与历史已判断邮件近似重复的邮件，并直接继承其评分
+    (若开启 INHERIT_SUMMARY，有效邮件同时继承其总结)。
+
+    Args:
+        uncertain_emails: 待处理的邮件字典列表。
+
+    Returns:
+        tuple: (matched_emails, remaining_emails)
+    """
+    if not NEAR_DUPLICATE_INDEX or not uncertain_emails:
+        return [], uncertain_emails
+
+    bootstrap_near_duplicate_index()
+
+    matched_emails = []
+    remaining_emails = []
+    judge_list = []
+
+    for email_data in uncertain_emails:
+        entry, distance = NEAR_DUPLICATE_INDEX.lookup(email_data.get('subject', ''), email_data.get('body', ''))
+        if not entry or entry.get('score') is None:
+            remaining_emails.append(email_data)
+            continue
+
+        email_data['score'] = entry['score']
+        if NEAR_DUPLICATE_INHERIT_SUMMARY and entry['score'] >= VALID_SCORE and entry.get('summary'):
+            email_data['summary'] = entry['summary']
+        print(f"  NEAR_DUP SUCCESS -> 地址: {email_data['sender_name']}, 分数: {entry['score']}, 汉明距离: {distance}")
+
+        judge_record = email_data.copy()
+        judge_record['judge_time'] = datetime.now(TIMEZONE).isoformat()
+        judge_record['hamming_distance'] = distance
+        judge_list.append(judge_record)
+        matched_emails.append(email_data)
+
+    if judge_list:
+        save_mail_judgment_record(judge_list, "near_duplicate")
+        print(f"信息：{len(matched_emails)} 封邮件继承了近似重复邮件的判断。")
+
+    return matched_emails, remaining_emails
+
+
+# --- 本地预分类 ---
+def pre_classify_uncertain_emails(uncertain_emails):
+    """
+    在调用 AI 评分前，使用本地预分类器对未分类邮件进行评分。
+    只有置信度达到阈值的邮件会在本地定案，其余邮件交由 AI 处理。
+
+    Args:
+        uncertain_emails: 待处理的邮件字典列表。
+
+    Returns:
+        tuple: (settled_emails, ambiguous_emails)
+            - settled_emails: 已在本地完成评分的邮件列表 (数据结构与 get_score_for_uncertain_emails 的返回一致)
+            - ambiguous_emails: 需要交由 AI 评分的邮件列表
+    """
+    if not LOCAL_CLASSIFIER or not uncertain_emails:
+        return [], uncertain_emails
+
+    LOCAL_CLASSIFIER.catch_up(JUDGMENT_RECORD_PATH)
+
+    settled_emails = []
+    ambiguous_emails = []
+    judge_list = []
+
+    for email_data in uncertain_emails:
+        score, confidence = LOCAL_CLASSIFIER.predict_score(email_data)
+        if score is None:
+            ambiguous_emails.append(email_data)
+            continue
+
+        email_data['score'] = score
+        print(f"  LOCAL SUCCESS -> 地址: {email_data['sender_name']}, 分数: {score}, 置信度: {confidence:.3f}")
+
+        judge_record = email_data.copy()
+        judge_record['judge_time'] = datetime.now(TIMEZONE).isoformat()
+        judge_record['local_confidence'] = round(confidence, 4)
+        judge_list.append(judge_record)
+        settled_emails.append(email_data)
+
+    if judge_list:
+        save_mail_judgment_record(judge_list, "local_classification")
+        print(f"信息：本地预分类器截留 {len(settled_emails)} 封邮件，{len(ambiguous_emails)} 封交由 AI 评分。")
+
+    return settled_emails, ambiguous_emails
 
 
 # --- 邮件分类 ---
-def get_score_for_uncertain_emails(ai_client, uncertain_emails, model_name="gemini-2.5-flash"):
+def get_score_for_uncertain_emails(ai_client, uncertain_emails, model_name="gemini-2.5-flash", deferred_list=None):
     """
     对未分类的邮件进行 AI 评分和总结，分类记录会保存到JSON中。
 
     Args:
-        ai_client: 已经初始化的 genai.Client 实例。
+        ai_client: 已经初始化的 AI 后端实例 (Utils.ai_backend.AIBackend)。
         uncertain_emails: 待处理的邮件字典列表。
         model_name: 使用的模型名称
+        deferred_list: (可选) 因熔断器打开或时间预算耗尽而未处理的邮件会追加到此列表，由调用方推迟到下一周期。
 
     Returns:
         list: 包含 email_data_dict邮件字典的列表。
@@ -108,47 +552,19 @@ def get_score_for_uncertain_emails(ai_client, uncertain_emails, model_name="gemi
     result_list = []
     judge_list = []
 
-    SYSTEM_PROMPT = CLASSIFICATION_PROMPT["SYSTEM_PROMPT"]
-    CLASSIFY_TASK = CLASSIFICATION_PROMPT["CLASSIFY_TASK"]
-    SCORES_MAPPING = CLASSIFICATION_PROMPT["SCORES"]
-    RESPONSE_INSTRUCTION = CLASSIFICATION_PROMPT["RESPONSE_FORMAT_INSTRUCTION"]
-
-    # 将评分映射转换为 AI 可读的字符串格式
-    SCORES_STR = "\n".join([f"- {k}: {v}分" for k, v in SCORES_MAPPING.items()])
-
     print("开始对未分类邮件进行分类")
 
-    for email_data in uncertain_emails:
+    def classify_email(email_data):
         subject = email_data['subject']
         body = email_data['body']
 
-        # --- 1. 构造最终 Prompt ---
-        final_prompt = (
-                SYSTEM_PROMPT + "\n\n" +
-                CLASSIFY_TASK.format(scores=SCORES_STR) + "\n\n" +
-
-                f"邮件主题：{subject}\n" +
-                f"邮件正文（仅前1000字）：{body[:1000]}\n\n" +  # 限制长度以节省 token
-
-                RESPONSE_INSTRUCTION
-        )
-
-
         try:
-            # 2. 调用 Gemini API
-            response = retry_gemini_call(
-                ai_client.models.generate_content,
-                model=model_name,  # 确保 MODEL_NAME 变量可用
-                contents=final_prompt,
-                config={
-                    "response_mime_type": "application/json"
-                    # 这里省略 response_schema，因为 prompt 已经严格要求了 JSON 格式
-                }
+            # 1-2. 填充 Prompt 模板，调用 AI 后端并解析 JSON 结果 (正文限制长度以节省 token)
+            result, cascade_record = request_ai_json_cascade(
+                ai_client, CLASSIFICATION_TEMPLATE, model_name, classification_needs_escalation,
+                subject=subject, body=reduce_email_body(body)[:1000]
             )
 
-            # 3. 解析 JSON 结果
-            result = json.loads(response.text)
-
             # 提取评分
             score = int(result.get('score', 5))
             summary = result.get('summary', '未总结')
@@ -156,8 +572,17 @@ def get_score_for_uncertain_emails(ai_client, uncertain_emails, model_name="gemi
             # 4. 更新邮件数据字典 (用于返回和后续处理)
             email_data['score'] = score
             email_data['summary'] = summary
+            if cascade_record:
+                # (快速模型与强模型的判断都写入判断记录，之后从邮件数据中移除)
+                email_data['model_cascade'] = cascade_record
 
-            print(f"  AI SUCCESS -> 地址: {email_data['sender_name']}, 分数: {score}, 总结: {summary}")
+            print(f"  AI SUCCESS -> 地址: {email_data['sender_name']}, 分数: {score}, 总结: {summary}"
+                  f"{describe_cascade(cascade_record)}")
+
+        except AIWorkDeferredError as e:
+            # 熔断器打开或时间预算耗尽: 不发出请求，推迟到下一周期
+            print(f"  AI DEFER -> 地址: {email_data['sender_name']}, {e}")
+            return False
 
         except Exception as e:
             # 5. 处理 API 失败或 JSON 解析失败
@@ -165,9 +590,18 @@ def get_score_for_uncertain_emails(ai_client, uncertain_emails, model_name="gemi
             email_data['summary'] = f"AI处理失败: {e}"
             print(f"  AI FAIL -> 地址: {email_data['sender_name']}, 错误: {e}")
 
+        return True
+
+    for email_data, processed in zip(uncertain_emails, map_ai_tasks(classify_email, uncertain_emails)):
+        if not processed:
+            if deferred_list is not None:
+                deferred_list.append(email_data)
+            continue
+
         # 6. 将邮件数据和评分添加到结果列表和判断列表中
         email_data['judge_time'] = datetime.now(TIMEZONE).isoformat()
         judge_list.append(email_data.copy())
+        email_data.pop('model_cascade', None)
 
         # 若为无效邮件，则在结果中去除总结部分再输出
         if  email_data['score'] < VALID_SCORE:
@@ -176,8 +610,6 @@ def get_score_for_uncertain_emails(ai_client, uncertain_emails, model_name="gemi
         email_data.pop('judge_time',None)
         result_list.append(email_data)
 
-        time.sleep(SECONDS_BETWEEN_REQUESTS)
-
     # 将数据结构完备的判断记录存储到../Info/mail_judgement_record.json中
     if judge_list:
         save_mail_judgment_record(judge_list, "classification")
@@ -186,14 +618,15 @@ def get_score_for_uncertain_emails(ai_client, uncertain_emails, model_name="gemi
 
 
 # --- 邮件总结 ---
-def get_summary_for_emails(ai_client, emails, model_name="gemini-2.5-flash"):
+def get_summary_for_emails(ai_client, emails, model_name="gemini-2.5-flash", deferred_list=None):
     """
        对已验证的有效邮件内容进行 AI 总结。
 
        Args:
-           ai_client: 已经初始化的 genai.Client 实例。
+           ai_client: 已经初始化的 AI 后端实例 (Utils.ai_backend.AIBackend)。
            emails: 待处理的邮件字典列表。
            model_name: 使用的模型名称
+           deferred_list: (可选) 因熔断器打开或时间预算耗尽而未处理的邮件会追加到此列表 (这些邮件不会被写入 summary)。
 
        Returns:
            list: 包含已更新 summary 字段的邮件字典列表。
@@ -202,13 +635,10 @@ def get_summary_for_emails(ai_client, emails, model_name="gemini-2.5-flash"):
     result_list = []
     judge_list = []
 
-    SYSTEM_PROMPT = SUMMARY_PROMPT.get("SYSTEM_PROMPT", "")
-    SUMMARY_TASK = SUMMARY_PROMPT.get("SUMMARY_TASK", "")
-    RESPONSE_INSTRUCTION = SUMMARY_PROMPT.get("RESPONSE_FORMAT_INSTRUCTION", "")
-
     print("开始生成有效邮件内容总结")
 
-    for email_data in emails:
+    def summarize_email(email_data):
+        """Returns: "ai" (AI 已处理) / "reused" (复用近似重复总结) / "deferred" (推迟)"""
 
         subject = email_data.get('subject', '无主题')
         body = email_data.get('body', '无正文')
@@ -219,31 +649,18 @@ def get_summary_for_emails(ai_client, emails, model_name="gemini-2.5-flash"):
                 f"[Root: {email_data.get('sender_root', '未知根域名')}]"
         )
 
-        # --- 1. 构造最终 Prompt ---
-        final_prompt = (
-                SYSTEM_PROMPT + "\n\n" +
-                SUMMARY_TASK + "\n\n" +
-
-                f"邮件主题：{subject}\n" +
-                f"邮件正文（仅前1000字）：{body[:1000]}\n\n" +  # 限制长度以节省 token
-
-                RESPONSE_INSTRUCTION
-        )
-
+        # --- 0. 近似重复邮件直接复用历史总结 (仅收信) ---
+        if NEAR_DUPLICATE_INDEX and NEAR_DUPLICATE_INHERIT_SUMMARY and email_data.get('type') == 'received':
+            entry, distance = NEAR_DUPLICATE_INDEX.lookup(subject, body)
+            if entry and entry.get('summary'):
+                email_data['summary'] = entry['summary']
+                print(f"  NEAR_DUP SUMMARY -> 地址: {sender_display}, 汉明距离: {distance}, 总结: {entry['summary']}")
+                return "reused"
 
         try:
-            # 2. 调用 Gemini API
-            response = retry_gemini_call(
-                ai_client.models.generate_content,
-                model=model_name,
-                contents=final_prompt,
-                config={
-                    "response_mime_type": "application/json"
-                }
-            )
-
-            # 3. 解析 JSON 结果
-            result = json.loads(response.text)
+            # 1-2. 填充 Prompt 模板，调用 AI 后端并解析 JSON 结果 (正文限制长度以节省 token)
+            result = request_ai_json(ai_client, SUMMARY_TEMPLATE, model_name,
+                                     subject=subject, body=reduce_email_body(body)[:1000])
 
             # 提取总结 (根据 prompt 结构，这里直接提取 'summary' 字段)
             summary = result.get('summary', 'AI未提供总结')
@@ -253,21 +670,32 @@ def get_summary_for_emails(ai_client, emails, model_name="gemini-2.5-flash"):
 
             print(f"  AI SUMMARY SUCCESS -> 地址: {sender_display}, 总结: {summary}")
 
+        except AIWorkDeferredError as e:
+            print(f"  AI SUMMARY DEFER -> 地址: {sender_display}, {e}")
+            return "deferred"
+
         except Exception as e:
             # 5. 处理 API 失败或 JSON 解析失败
             email_data['summary'] = f"AI处理失败: {e}"
             print(f"  AI SUMMARY FAIL -> 地址: {sender_display}, 错误: {e}")
 
-        # 记录总结处理时间
-        email_data['judge_time'] = datetime.now(TIMEZONE).isoformat()
-        judge_list.append(email_data.copy())
+        return "ai"
+
+    for email_data, outcome in zip(emails, map_ai_tasks(summarize_email, emails)):
+        if outcome == "deferred":
+            if deferred_list is not None:
+                deferred_list.append(email_data)
+            continue
+
+        if outcome == "ai":
+            # 记录总结处理时间
+            email_data['judge_time'] = datetime.now(TIMEZONE).isoformat()
+            judge_list.append(email_data.copy())
+            email_data.pop('judge_time',None)
 
         # 6. 将处理后的邮件数据添加到结果列表
-        email_data.pop('judge_time',None)
         result_list.append(email_data)
 
-        time.sleep(SECONDS_BETWEEN_REQUESTS)
-
     # 将数据结构完备的判断记录存储到../Info/mail_judgement_record.json中
     if judge_list:
         save_mail_judgment_record(judge_list,"get_summary")
@@ -276,15 +704,16 @@ def get_summary_for_emails(ai_client, emails, model_name="gemini-2.5-flash"):
 
 
 # --- 对话邮件筛选 ---
-def get_conversation_constitutes_for_emails(ai_client, emails, model_name="gemini-2.5-flash"):
+def get_conversation_constitutes_for_emails(ai_client, emails, model_name="gemini-2.5-flash", deferred_list=None):
     """
     [AI-Powered] 使用 AI 进一步筛选邮件，判断其是否构成真实对话（排除系统通知、报告等）。
     此函数 *不* 依赖 classification 的 score，而是进行独立的、更精确的 AI 判断。
 
     Args:
-        ai_client: 已经初始化的 genai.Client 实例。
+        ai_client: 已经初始化的 AI 后端实例 (Utils.ai_backend.AIBackend)。
         emails: 待处理的邮件字典列表。
         model_name: 使用的模型名称
+        deferred_list: (可选) 因熔断器打开或时间预算耗尽而未判断的邮件会追加到此列表，由调用方推迟到下一周期。
 
     Returns:
         list: 仅包含被 AI 判断为 "对话型" 的邮件字典列表。
@@ -294,23 +723,22 @@ def get_conversation_constitutes_for_emails(ai_client, emails, model_name="gemin
     result_list = []
     # judge_list: 包含所有处理记录的日志（无论是否被过滤）
     judge_list = []
+    # local_judge_list: 由本地预分类器做出的判断记录 (不参与训练)
+    local_judge_list = []
 
-    # --- 1. 加载 Prompts ---
-    try:
-        SYSTEM_PROMPT = CONVO_PROMPT.get("SYSTEM_PROMPT", "")
-        CONVO_TASK = CONVO_PROMPT.get("CONVO_TASK", "")
-        RESPONSE_INSTRUCTION = CONVO_PROMPT.get("RESPONSE_FORMAT_INSTRUCTION", "")
-    except KeyError:
+    # --- 1. 检查 Prompt 模板 ---
+    if CONVO_TEMPLATE is None:
         print(f"FATAL: 配置文件 {PROMPT_FILE_PATH} 中缺少 'CONVERSATION' 键。")
         print("警告：由于 Prompt 缺失，将跳过 AI 对话筛选，保留所有邮件。")
         return emails
-    except Exception as e:
-        print(f"FATAL: 加载 CONVERSATION prompt 失败: {e}")
-        return emails
 
     print("开始进行 AI 对话邮件筛选 (第二阶段)...")
 
-    for email_data in emails:
+    if LOCAL_CLASSIFIER:
+        LOCAL_CLASSIFIER.catch_up(JUDGMENT_RECORD_PATH)
+
+    def check_conversation(email_data):
+        """Returns: (judge_record 或 None (推迟), is_conversation, is_local)"""
         # 创建一个副本用于日志记录
         judge_record = email_data.copy()
 
@@ -321,33 +749,30 @@ def get_conversation_constitutes_for_emails(ai_client, emails, model_name="gemin
                 email_data.get('sender',"未知域名")
         )
 
-        # --- 2. 构造最终 Prompt ---
-        final_prompt = (
-                SYSTEM_PROMPT + "\n\n" +
-                CONVO_TASK + "\n\n" +
-                f"邮件主题：{subject}\n" +
-                f"邮件正文（仅前1000字）：{body[:1000]}\n\n" +
-                RESPONSE_INSTRUCTION
-        )
-
         # 默认为 True
         is_conversation = True
         ai_error_note = None
         judgment_reason = "N/A"
 
+        # --- 2. 本地预分类器优先判断，高置信度时跳过 AI ---
+        local_verdict, local_confidence = (
+            LOCAL_CLASSIFIER.predict_conversation(email_data) if LOCAL_CLASSIFIER else (None, 0.0)
+        )
+        if local_verdict is not None:
+            judge_record['judge_time'] = datetime.now(TIMEZONE).isoformat()
+            judge_record['is_conversation_judgment'] = local_verdict
+            judge_record['judgment_reason'] = f"本地预分类器判断 (置信度 {local_confidence:.3f})"
+            print(f"  LOCAL CONVO_CHECK -> ({'保留' if local_verdict else '过滤'}) 地址: {sender_display}, 置信度: {local_confidence:.3f}")
+            return judge_record, local_verdict, True
+
         try:
-            # --- 3. 调用 Gemini API ---
-            response = retry_gemini_call(
-                ai_client.models.generate_content,
-                model=model_name,
-                contents=final_prompt,
-                config={
-                    "response_mime_type": "application/json"
-                }
+            # --- 3-4. 填充 Prompt 模板，调用 AI 后端并解析 JSON 结果 ---
+            result, cascade_record = request_ai_json_cascade(
+                ai_client, CONVO_TEMPLATE, model_name, conversation_needs_escalation,
+                subject=subject, body=reduce_email_body(body)[:1000]
             )
-
-            # --- 4. 解析 JSON 结果 ---
-            result = json.loads(response.text)
+            if cascade_record:
+                judge_record['model_cascade'] = cascade_record
 
             # (安全地获取布尔值)
             is_conversation_raw = result.get('is_conversation', True)
@@ -356,9 +781,15 @@ def get_conversation_constitutes_for_emails(ai_client, emails, model_name="gemin
             judgment_reason = result.get('reason', 'AI未提供理由')
 
             if is_conversation:
-                print(f"  AI CONVO_CHECK -> (保留) 地址: {sender_display}, 理由: {judgment_reason}")
+                print(f"  AI CONVO_CHECK -> (保留) 地址: {sender_display}, 理由: {judgment_reason}"
+                      f"{describe_cascade(cascade_record)}")
             else:
-                print(f"  AI CONVO_CHECK -> (过滤) 地址: {sender_display}, 理由: {judgment_reason}")
+                print(f"  AI CONVO_CHECK -> (过滤) 地址: {sender_display}, 理由: {judgment_reason}"
+                      f"{describe_cascade(cascade_record)}")
+
+        except AIWorkDeferredError as e:
+            print(f"  AI CONVO_DEFER -> 地址: {sender_display}, {e}")
+            return None, False, False
 
         except Exception as e:
             # --- 5. 处理 API 失败 ---
@@ -374,146 +805,509 @@ def get_conversation_constitutes_for_emails(ai_client, emails, model_name="gemin
         if ai_error_note:
             judge_record['ai_error'] = ai_error_note  # 记录错误
 
+        return judge_record, is_conversation, False
+
+    for email_data, (judge_record, is_conversation, is_local) in zip(emails, map_ai_tasks(check_conversation, emails)):
+        if judge_record is None:
+            if deferred_list is not None:
+                deferred_list.append(email_data)
+            continue
+
         # 将日志副本添加到 judge_list
-        judge_list.append(judge_record)
+        (local_judge_list if is_local else judge_list).append(judge_record)
 
         # --- 7. 构建最终返回列表 ---
         if is_conversation:
             # 添加原始邮件数据
             result_list.append(email_data)
 
-        time.sleep(SECONDS_BETWEEN_REQUESTS)
-
     # --- 8. 保存判断记录 ---
     if judge_list:
         save_mail_judgment_record(judge_list, "conversation_check")
+    if local_judge_list:
+        save_mail_judgment_record(local_judge_list, "local_conversation_check")
 
     print(f"AI 对话筛选完成： {len(emails)} 封邮件中，{len(result_list)} 封被保留为对话邮件。")
 
     return result_list
 
 
+# --- 对话摘要构造 ---
+def format_digest_line(email):
+    speaker = "[我]" if email.get("type") == "sent" else "[对方]"
+    summary = email.get("summary", "无总结")
+    subject = email.get("subject", "无主题")
+    return f"{speaker} (主题: {subject}): {summary}"
+
+
+def build_conversation_digest(email_list):
+    """将 (已排序的) 邮件列表格式化为 [我]/[对方] 的对话摘要文本。"""
+    return "\n".join(format_digest_line(email) for email in email_list)
+
+
+def build_budgeted_digest(email_list, budget_chars=HISTORY_DIGEST_CHARS, newest=True):
+    """
+    在字数预算内按整封邮件构造对话摘要 (不在邮件中间截断)。
+    newest 为 True 时保留最新的邮件 (CREATE)，否则从最早的邮件开始 (UPDATE 的新增部分需按顺序全部覆盖)。
+    至少包含一封邮件 (单封超出预算时截断该封)。
+
+    Returns:
+        tuple: (摘要文本, 摘要中包含的邮件列表 (按时间顺序))
+    """
+    ordered = list(reversed(email_list)) if newest else list(email_list)
+    included, lines, used = [], [], 0
+    for email in ordered:
+        line = format_digest_line(email)
+        if included and used + len(line) + 1 > budget_chars:
+            break
+        included.append(email)
+        lines.append(line)
+        used += len(line) + 1
+    if newest:
+        included.reverse()
+        lines.reverse()
+    return "\n".join(lines)[:budget_chars], included
+
+
+def get_emails_after_watermark(email_list, watermark):
+    """
+    返回上次总结尚未覆盖的新邮件 (按发送时间与水位线比较，而不是按在列表中的位置)。
+
+    延迟送达、被推迟到下一周期处理、或收信与发信分属不同批次的邮件，按 sent_time 排序后可能落在水位线之前；
+    此时水位线之前 (含) 的邮件数会多于上次总结覆盖的邮件数，增量更新无法保持时间顺序，返回 None 由调用方重新生成总结。
+
+    Args:
+        email_list: 已按时间排序的邮件列表。
+        watermark: {"id", "type", "sent_time", "tie_keys", "covered_count"}
+            tie_keys 为与最后一封已总结邮件发送时间相同的已总结邮件键 (get_email_key)，covered_count 为已总结的邮件数。
+            旧版水位线没有 covered_count 时，按水位线邮件在列表中的位置判断
+            (收信与发信的 IMAP 编号可能重复，因此同时比较 id 与 type)。
+
+    Returns:
+        list 或 None: 新邮件列表；水位线无效，或有新邮件排在已总结的邮件之前时返回 None，调用方应重新生成总结。
+    """
+    if not watermark or not watermark.get("id"):
+        return None
+
+    if watermark.get("covered_count") is None:
+        # (旧版水位线) 找到水位线邮件的位置，其之后的邮件为新邮件
+        for index in range(len(email_list) - 1, -1, -1):
+            email = email_list[index]
+            if email.get("id") == watermark["id"] and email.get("type") == watermark.get("type"):
+                return email_list[index + 1:]
+        return None
+
+    watermark_time = get_sortable_time(watermark)
+    tie_keys = set(watermark.get("tie_keys") or [])
+    covered_count = 0
+    new_emails = []
+    for email in email_list:
+        sent_time = get_sortable_time(email)
+        if sent_time < watermark_time or (sent_time == watermark_time and get_email_key(email) in tie_keys):
+            covered_count += 1
+        else:
+            new_emails.append(email)
+
+    if covered_count > watermark["covered_count"]:
+        print(f"    -> 有 {covered_count - watermark['covered_count']} 封新增邮件排在已总结的邮件之前 (迟到的邮件)，"
+              f"需要重新生成总结。")
+        return None
+    return new_emails
+
+
+def make_summary_watermark(covered_emails):
+    """
+    以本次总结覆盖的最后一封邮件生成水位线 (covered_emails 为已排序对话的开头部分)。
+    只记录最后一封邮件、与其发送时间相同的邮件键，以及覆盖的邮件数，大小与对话长度无关。
+    """
+    last_email = covered_emails[-1]
+    last_time = get_sortable_time(last_email)
+    tie_keys = []
+    for email in reversed(covered_emails):
+        if get_sortable_time(email) != last_time:
+            break
+        tie_keys.append(get_email_key(email))
+    return {"id": last_email.get("id"), "type": last_email.get("type"), "sent_time": last_email.get("sent_time"),
+            "tie_keys": tie_keys, "covered_count": len(covered_emails)}
+
+
+# --- 长对话分层总结 (map-reduce) ---
+def split_conversation_chunks(email_list):
+    """
+    按时间顺序切分为固定封数的分段。
+    新邮件只会追加到末尾，已写满的分段边界保持不变，因此更新时通常只需重算最后一段。
+    """
+    return [email_list[i:i + SUMMARY_CHUNK_EMAILS] for i in range(0, len(email_list), SUMMARY_CHUNK_EMAILS)]
+
+
+def get_chunk_fingerprint(chunk):
+    """分段内容的指纹 (由分段内全部邮件的键计算)，用于判断已保存的分段总结是否仍然有效。"""
+    return hashlib.sha256("\n".join(get_email_key(email) for email in chunk).encode('utf-8')).hexdigest()[:16]
+
+
+def format_chunk_time_range(chunk_summary):
+    start = str(chunk_summary.get("start_time") or "")[:10]
+    end = str(chunk_summary.get("end_time") or "")[:10]
+    return f"{start} ~ {end}, 共 {chunk_summary.get('count', 0)} 封"
+
+
+def use_hierarchical_summary(value, email_list):
+    """已经使用分层总结的对话继续使用；否则完整对话摘要超过 HIERARCHICAL_MIN_DIGEST_CHARS 时启用。"""
+    if not HIERARCHICAL_SUMMARY_ENABLED:
+        return False
+    if isinstance(value, dict) and value.get("chunk_summaries"):
+        return True
+    return sum(len(format_digest_line(email)) + 1 for email in email_list) > HIERARCHICAL_MIN_DIGEST_CHARS
+
+
+def summarize_conversation_chunks(ai_client, email_list, old_chunk_summaries, model_name):
+    """
+    (map) 并行为每个过期的分段生成阶段总结；指纹未变化的分段直接沿用已保存的结果。
+
+    Returns:
+        tuple: (chunk_summaries, 是否有分段被推迟)
+            chunk_summaries: [{"fingerprint", "count", "start_time", "end_time", "summary"}, ...]
+            未能生成的分段 summary 为 None。
+    """
+    saved = {entry.get("fingerprint"): entry.get("summary")
+             for entry in old_chunk_summaries or [] if isinstance(entry, dict) and entry.get("summary")}
+    chunks = split_conversation_chunks(email_list)
+    chunk_summaries = []
+    stale = []
+    for index, chunk in enumerate(chunks):
+        fingerprint = get_chunk_fingerprint(chunk)
+        chunk_summaries.append({
+            "fingerprint": fingerprint,
+            "count": len(chunk),
+            "start_time": chunk[0].get("sent_time"),
+            "end_time": chunk[-1].get("sent_time"),
+            "summary": saved.get(fingerprint)
+        })
+        if chunk_summaries[-1]["summary"] is None:
+            stale.append((index, chunk))
+
+    print(f"    -> 分层总结: 共 {len(chunks)} 段，需要重新总结 {len(stale)} 段...")
+
+    def summarize_chunk(item):
+        """Returns: (阶段总结 或 None, 是否推迟)"""
+        index, chunk = item
+        try:
+            result = request_ai_json(ai_client, HISTORY_CHUNK_TEMPLATE, model_name,
+                                     index=index + 1, total=len(chunks),
+                                     time_range=format_chunk_time_range(chunk_summaries[index]),
+                                     digest=build_conversation_digest(chunk)[:SUMMARY_CHUNK_CHARS])
+            return result.get('general_summary') or None, False
+        except AIWorkDeferredError as e:
+            print(f"    AI CHUNK_SUMMARY DEFER -> 第 {index + 1} 段: {e}")
+            return None, True
+        except Exception as e:
+            print(f"    AI CHUNK_SUMMARY FAIL -> 第 {index + 1} 段, 错误: {e}")
+            return None, False
+
+    deferred = False
+    for (index, _), (summary, chunk_deferred) in zip(stale, map_ai_tasks(summarize_chunk, stale)):
+        chunk_summaries[index]["summary"] = summary
+        deferred = deferred or chunk_deferred
+    return chunk_summaries, deferred
+
+
+def reduce_chunk_summaries(ai_client, lines, model_name):
+    """
+    (reduce) 阶段总结合计超过 SUMMARY_REDUCE_CHARS 时，按时间顺序分组并行合并为更上一层的总结，
+    直到能放入一次调用；返回最终合并调用的输入文本。中间层结果不保存 (每层的调用数随层数指数减少)。
+    """
+    while len("\n".join(lines)) > SUMMARY_REDUCE_CHARS and len(lines) > 1:
+        groups = [[]]
+        for line in lines:
+            if groups[-1] and len("\n".join(groups[-1] + [line])) > SUMMARY_REDUCE_CHARS:
+                groups.append([])
+            groups[-1].append(line)
+        if len(groups) == len(lines):
+            # (单条已超出预算，无法继续合并)
+            break
+        print(f"    -> 分层总结: {len(lines)} 条阶段总结超出预算，先合并为 {len(groups)} 组...")
+
+        def reduce_group(group):
+            result = request_ai_json(ai_client, HISTORY_REDUCE_TEMPLATE, model_name, digest="\n".join(group))
+            return result.get('general_summary', '')
+
+        start = 1
+        reduced = []
+        for group, summary in zip(groups, map_ai_tasks(reduce_group, groups)):
+            reduced.append(f"【第 {start}-{start + len(group) - 1} 组】: {summary}")
+            start += len(group)
+        lines = reduced
+    return "\n".join(lines)[:SUMMARY_REDUCE_CHARS]
+
+
+def resolve_history_summary_request(ai_client, conversation, request, model_name):
+    """
+    分层总结的请求需要先完成 map 阶段 (以及必要的中间合并) 才能得到最终合并调用的输入。
+    分段总结写入 conversation["chunk_summaries"] (即使之后的合并失败，下次也只需重算缺失的分段)。
+
+    增量更新的新增部分超出预算时 (request 带有 "delta_emails")，同样先分段总结新增邮件，
+    再将阶段总结合并为 UPDATE 调用的输入 (这些分段总结只用于本次调用，不保存)。
+
+    Returns:
+        Exception 或 None: 无法进入最终合并调用时返回对应的异常 (推迟时为 AIWorkDeferredError)。
+    """
+    if request.get("delta_emails"):
+        return resolve_delta_digest(ai_client, request, model_name)
+    if not request.get("hierarchical"):
+        return None
+
+    chunk_summaries, deferred = summarize_conversation_chunks(
+        ai_client, conversation["emails"], conversation.get("chunk_summaries"), model_name
+    )
+    conversation["chunk_summaries"] = chunk_summaries
+    missing = sum(1 for entry in chunk_summaries if entry["summary"] is None)
+    if deferred:
+        return AIWorkDeferredError(f"{missing} 段阶段总结被推迟")
+    if missing:
+        return Exception(f"{missing} 段阶段总结生成失败")
+
+    try:
+        request["fields"] = {"digest": reduce_chunk_summaries(ai_client, [
+            f"【第 {index} 段】({format_chunk_time_range(entry)}): {entry['summary']}"
+            for index, entry in enumerate(chunk_summaries, start=1)
+        ], model_name)}
+    except Exception as e:
+        return e
+    return None
+
+
+def split_digest_chunks(email_list, budget_chars):
+    """按整封邮件切分为摘要字数不超过 budget_chars 的分段 (按时间顺序)。"""
+    chunks = [[]]
+    used = 0
+    for email in email_list:
+        length = len(format_digest_line(email)) + 1
+        if chunks[-1] and used + length > budget_chars:
+            chunks.append([])
+            used = 0
+        chunks[-1].append(email)
+        used += length
+    return chunks
+
+
+def resolve_delta_digest(ai_client, request, model_name):
+    """
+    (增量更新) 新增部分超出预算: 分段并行总结新增邮件，合并后作为 UPDATE 调用的 digest，保证每封新邮件都进入 Prompt。
+
+    Returns:
+        Exception 或 None
+    """
+    chunks = split_digest_chunks(request["delta_emails"], SUMMARY_CHUNK_CHARS)
+    print(f"    -> 新增部分超出 {HISTORY_DIGEST_CHARS} 字，先分 {len(chunks)} 段总结新增邮件...")
+
+    def summarize_chunk(item):
+        """Returns: (阶段总结 或 None, 异常 或 None)"""
+        index, chunk = item
+        time_range = format_chunk_time_range({"start_time": chunk[0].get("sent_time"),
+                                              "end_time": chunk[-1].get("sent_time"), "count": len(chunk)})
+        try:
+            result = request_ai_json(ai_client, HISTORY_CHUNK_TEMPLATE, model_name,
+                                     index=index + 1, total=len(chunks), time_range=time_range,
+                                     digest=build_conversation_digest(chunk)[:SUMMARY_CHUNK_CHARS])
+            return result.get('general_summary') or None, None
+        except Exception as e:
+            return None, e
+
+    lines = []
+    for index, (summary, error) in enumerate(map_ai_tasks(summarize_chunk, list(enumerate(chunks)))):
+        if error is not None:
+            return error
+        if summary is None:
+            return Exception(f"新增邮件第 {index + 1} 段总结为空")
+        lines.append(f"【新增第 {index + 1} 段】: {summary}")
+
+    try:
+        request["fields"]["digest"] = reduce_chunk_summaries(ai_client, lines, model_name)[:HISTORY_DIGEST_CHARS]
+    except Exception as e:
+        return e
+    return None
+
+
 # --- 对话历史总结 ---
-def get_history_summary_for_conversation(ai_client, memory_dict, model_name="gemini-2.5-flash"):
+def plan_history_summary(address, value):
+    """
+    (格式检测 + 水位线 + 选择 Prompt) 确定一条对话的总结需要怎样的 AI 调用。
+
+    Returns:
+        tuple: (对话结构, 请求)
+            对话结构: 新格式的对话 (general_summary 仍为旧总结)；数据格式无法识别时为 None。
+            请求: {"mode": ..., "template": ..., "fields": ...}；无需调用 AI 时为 None。
+                分层总结的请求带有 "hierarchical": True，fields 需由 resolve_history_summary_request 填充。
+                新增部分超出预算的增量更新带有 "delta_emails"，digest 同样由 resolve_history_summary_request 填充。
+                只覆盖对话开头一部分的请求带有 "covered_emails"，水位线只推进到其中最后一封。
+    """
+    # --- 1. (格式检测) ---
+    email_list = []
+    old_summary = None
+    old_style_profile = None  # <-- (新增) 默认为空
+    old_watermark = None
+
+    if isinstance(value, list):
+        # (检测到旧格式: 来自 init)
+        email_list = value
+        # (old_style_profile 保持 None)
+    elif isinstance(value, dict):
+        # (检测到新格式: 来自 maintain)
+        email_list = value.get("emails", [])
+        old_summary = value.get("general_summary", None)
+        old_style_profile = value.get("style_profile", None)  # <-- (新增) 获取已有的口吻
+        old_watermark = value.get("summary_watermark", None)
+    else:
+        print(f"    -> 警告: {address} 的数据格式无法识别，跳过。")
+        return None, None
+
+    if not email_list:
+        print("    -> 空对话，跳过。")
+        return {
+            "general_summary": "空对话历史。",
+            "style_profile": old_style_profile, # <-- (新增) 保留 (即使是 None)
+            "emails": []
+        }, None
+
+    conversation = {
+        **(value if isinstance(value, dict) else {}),  # (保留 pending_recompute 等其他键)
+        "general_summary": old_summary,
+        "style_profile": old_style_profile, # <-- (新增) 保留传入的口吻
+        "summary_watermark": old_watermark,
+        "emails": email_list  # (email_list 是已排序的列表)
+    }
+
+    # --- 2. (水位线) 确定上次总结尚未覆盖的新增邮件 ---
+    # (假设 email_list 已排序；新增邮件按是否已被覆盖判断，迟到的邮件会触发重新生成)
+    new_emails = None
+    if old_summary and "AI处理失败" not in old_summary:
+        new_emails = get_emails_after_watermark(email_list, old_watermark)
+
+    if new_emails is not None and not new_emails:
+        print("    -> 水位线之后没有新增邮件，保留旧总结。")
+        return conversation, None
+
+    # --- 3. (关键: 智能选择 Prompt) ---
+    if use_hierarchical_summary(value, email_list):
+        # --- (C) 长对话: 分段并行总结后合并 (只重算内容变化的分段，通常只有最后一段) ---
+        print(f"    -> 长对话 ({len(email_list)} 封)，执行[分层总结]操作...")
+        return conversation, {"mode": "分阶段汇总", "template": HISTORY_REDUCE_TEMPLATE, "fields": None,
+                              "hierarchical": True}
+
+    if new_emails:
+        # --- (A) 使用 UPDATE 提示词: 仅发送旧总结 + 水位线之后的新增摘要 ---
+        print(f"    -> 检测到旧总结，执行[增量更新]操作 (新增 {len(new_emails)} 封)...")
+        request = {"mode": "增量更新", "template": HISTORY_UPDATE_TEMPLATE, "fields": {"old_summary": old_summary}}
+        digest = build_conversation_digest(new_emails)
+        if len(digest) <= HISTORY_DIGEST_CHARS:
+            request["fields"]["digest"] = digest
+        elif HIERARCHICAL_SUMMARY_ENABLED:
+            # 新增部分超长: 先分段总结再合并 (见 resolve_delta_digest)，每封新邮件都进入 Prompt
+            request["delta_emails"] = new_emails
+        else:
+            # 新增部分超长且未启用分层总结: 本次只总结预算内最早的新邮件，水位线只推进到其中最后一封，
+            # 其余新邮件留待下一次更新
+            digest, included = build_budgeted_digest(new_emails, newest=False)
+            print(f"    -> 新增部分超出 {HISTORY_DIGEST_CHARS} 字，本次总结最早的 {len(included)} 封，其余留待下次更新。")
+            request["fields"]["digest"] = digest
+            request["covered_emails"] = email_list[:len(email_list) - len(new_emails) + len(included)]
+        return conversation, request
+
+    # --- (B) 使用 CREATE (History) 提示词 ---
+    if old_summary and "AI处理失败" in old_summary:
+        print("    -> 旧总结处理失败，执行[重新生成]操作...")
+    elif old_summary:
+        print("    -> 旧总结缺少有效水位线或有迟到的新增邮件，执行[重新生成]操作...")
+    else:
+        print("    -> 未检测到旧总结，执行[创建]操作...")
+
+    # (超出预算时保留最新的邮件：触发更新的新邮件总在末尾；启用向量索引时先在预算内按相关性挑选)
+    context_emails = select_context_emails(address, email_list, format_digest_line)
+    return conversation, {
+        "mode": "创建",
+        "template": HISTORY_SUMMARY_TEMPLATE,
+        "fields": {"digest": build_budgeted_digest(context_emails, newest=True)[0]}
+    }
+
+
+def apply_history_summary_result(conversation, result=None, error=None, covered_emails=None):
+    """
+    将总结调用的结果 (或异常) 写入对话结构。
+    covered_emails: 本次总结只覆盖了对话开头一部分时传入 (请求的 "covered_emails")，水位线只推进到其中最后一封。
+
+    Returns:
+        bool: 是否被推迟 (熔断器打开或时间预算耗尽)
+    """
+    if error is None:
+        summary = result.get('general_summary', 'AI未提供总体总结')
+        conversation["general_summary"] = summary
+        # 总结成功后，水位线推进到本次覆盖的最后一封邮件
+        conversation["summary_watermark"] = make_summary_watermark(covered_emails or conversation["emails"])
+        print(f"    AI GEN_SUMMARY SUCCESS -> 总结: {summary[:30]}...")
+        return False
+
+    if isinstance(error, AIWorkDeferredError):
+        # 熔断器打开或时间预算耗尽: 保留旧总结与水位线，推迟到下一周期
+        conversation["general_summary"] = conversation.get("general_summary") or f"AI处理失败: {error}"
+        print(f"    AI GEN_SUMMARY DEFER -> {error}")
+        return True
+
+    # (水位线保持不变)
+    conversation["general_summary"] = f"AI处理失败: {error}"
+    print(f"    AI GEN_SUMMARY FAIL -> 错误: {error}")
+    return False
+
+
+def get_history_summary_for_conversation(ai_client, memory_dict, model_name="gemini-2.5-flash", deferred_list=None):
     """
     (最终版) 遍历 *所有* 对话历史，并为 *每一个* 历史生成或更新AI总体总结。
     (修正) 此版本会 *保留* 传入的 "style_profile" 键 (如果存在)。
 
     Args:
-        ai_client: 已经初始化的 genai.Client 实例。
+        ai_client: 已经初始化的 AI 后端实例 (Utils.ai_backend.AIBackend)。
         memory_dict (dict):
             - 旧格式: {"address": [email_list]}
             - 或 新格式: {"address": {"general_summary": "...", "style_profile": ..., "emails": [...]}}
         model_name: 使用的模型名称
+        deferred_list: (可选) 因熔断器打开或时间预算耗尽而未能更新总结的地址会追加到此列表 (旧总结与水位线保持不变)。
 
     Returns:
-        dict: *始终*返回新格式 {"address": {"general_summary": "...", "style_profile": ..., "emails": [...]}}
+        dict: *始终*返回新格式 {"address": {"general_summary": "...", "style_profile": ..., "summary_watermark": ..., "emails": [...]}}
+        summary_watermark 记录总结覆盖到的最后一封邮件，更新时只向 AI 发送旧总结与水位线之后的新增邮件。
     """
 
     print(f"开始为 {len(memory_dict)} 条对话历史生成/更新总体总结...")
 
     new_memory_structure = {}
     total_conversations = len(memory_dict)
-    current_convo_num = 0
 
-    for address, value in memory_dict.items():
-        current_convo_num += 1
+    def summarize_conversation(item):
+        """Returns: (新结构 或 None (跳过), 是否推迟)"""
+        current_convo_num, (address, value) = item
         print(f"  [总结 {current_convo_num}/{total_conversations}] 正在处理: {address}")
 
-        # --- 1. (格式检测) ---
-        email_list = []
-        old_summary = None
-        old_style_profile = None  # <-- (新增) 默认为空
-
-        if isinstance(value, list):
-            # (检测到旧格式: 来自 init)
-            email_list = value
-            # (old_style_profile 保持 None)
-        elif isinstance(value, dict):
-            # (检测到新格式: 来自 maintain)
-            email_list = value.get("emails", [])
-            old_summary = value.get("general_summary", None)
-            old_style_profile = value.get("style_profile", None)  # <-- (新增) 获取已有的口吻
-        else:
-            print(f"    -> 警告: {address} 的数据格式无法识别，跳过。")
-            continue
-
-        if not email_list:
-            print("    -> 空对话，跳过。")
-            new_memory_structure[address] = {
-                "general_summary": "空对话历史。",
-                "style_profile": old_style_profile, # <-- (新增) 保留 (即使是 None)
-                "emails": []
-            }
-            continue
-
-        # --- 2. 构造 Prompt 输入 (对话摘要) ---
-        digest_lines = []
-        for email in email_list:  # (假设 email_list 已排序)
-            speaker = "[我]" if email.get("type") == "sent" else "[对方]"
-            summary = email.get("summary", "无总结")
-            subject = email.get("subject", "无主题")
-            digest_lines.append(f"{speaker} (主题: {subject}): {summary}")
-        conversation_digest = "\n".join(digest_lines)
-
-        # --- 3. (关键: 智能选择 Prompt) ---
-        if old_summary and "AI处理失败" not in old_summary:
-            # --- (A) 使用 UPDATE 提示词 ---
-            print("    -> 检测到旧总结，执行[更新]操作...")
-            SYSTEM_PROMPT = HISTORY_UPDATE.get("SYSTEM_PROMPT", "")
-            SUMMARY_TASK = HISTORY_UPDATE.get("SUMMARY_TASK", "")
-            RESPONSE_INSTRUCTION = HISTORY_UPDATE.get("RESPONSE_FORMAT_INSTRUCTION", "")
-
-            final_prompt = (
-                    SYSTEM_PROMPT + "\n\n" +
-                    SUMMARY_TASK + "\n\n" +
-                    f"【旧的总结】:\n{old_summary}\n\n" +
-                    f"【完整的对话摘要 (按时间顺序)】:\n{conversation_digest[:3000]}\n\n" +
-                    RESPONSE_INSTRUCTION
-            )
-        else:
-            # --- (B) 使用 CREATE (History) 提示词 ---
-            if old_summary:
-                print("    -> 旧总结处理失败，执行[重新生成]操作...")
-            else:
-                print("    -> 未检测到旧总结，执行[创建]操作...")
+        conversation, request = plan_history_summary(address, value)
+        if request is None:
+            return conversation, False
 
-            SYSTEM_PROMPT = HISTORY_SUMMARY.get("SYSTEM_PROMPT", "")
-            SUMMARY_TASK = HISTORY_SUMMARY.get("SUMMARY_TASK", "")
-            RESPONSE_INSTRUCTION = HISTORY_SUMMARY.get("RESPONSE_FORMAT_INSTRUCTION", "")
-
-            final_prompt = (
-                    SYSTEM_PROMPT + "\n\n" +
-                    SUMMARY_TASK + "\n\n" +
-                    f"以下是按时间顺序排列的对话摘要:\n{conversation_digest[:3000]}\n\n" +
-                    RESPONSE_INSTRUCTION
-            )
+        error = resolve_history_summary_request(ai_client, conversation, request, model_name)
+        if error is not None:
+            return conversation, apply_history_summary_result(conversation, error=error)
 
         # --- 4. 调用 API (try/except 块) ---
         try:
-            response = retry_gemini_call(
-                ai_client.models.generate_content,
-                model=model_name,
-                contents=final_prompt,
-                config={"response_mime_type": "application/json"}
-            )
-            result = json.loads(response.text)
-            summary = result.get('general_summary', 'AI未提供总体总结')
-            print(f"    AI GEN_SUMMARY SUCCESS -> 总结: {summary[:30]}...")
-
+            result = request_ai_json(ai_client, request["template"], model_name, **request["fields"])
         except Exception as e:
-            summary = f"AI处理失败: {e}"
-            print(f"    AI GEN_SUMMARY FAIL -> 错误: {e}")
-
-        # --- 5. 构建新结构 ---
-        new_memory_structure[address] = {
-            "general_summary": summary, # (新生成的总结)
-            "style_profile": old_style_profile, # <-- (新增) 保留传入的口吻
-            "emails": email_list  # (email_list 是已排序的列表)
-        }
+            return conversation, apply_history_summary_result(conversation, error=e)
+        return conversation, apply_history_summary_result(conversation, result,
+                                                          covered_emails=request.get("covered_emails"))
 
-        # --- 6. 速率限制 ---
-        time.sleep(SECONDS_BETWEEN_REQUESTS)
+    items = list(enumerate(memory_dict.items(), start=1))
+    for (_, (address, _)), (conversation, deferred) in zip(items, map_ai_tasks(summarize_conversation, items)):
+        if conversation is not None:
+            new_memory_structure[address] = conversation
+        if deferred and deferred_list is not None:
+            deferred_list.append(address)
 
     # 循环结束
     print(f"信息：新数据结构转换完成 (共 {len(new_memory_structure)} 条对话)。")
@@ -521,139 +1315,272 @@ def get_history_summary_for_conversation(ai_client, memory_dict, model_name="gem
 
 
 # --- 对话口吻分析 ---
-def get_style_profile_for_conversation(ai_client, memory_with_summaries, model_name="gemini-2.5-flash"):
+# --- (修改点 1: 添加 new_key) ---
+DEFAULT_STYLE_PROFILE = {
+    "formality": "未知",
+    "tone_description": "未知", # <-- (新增)
+    "greeting_template": "无",
+    "sign_off_template": "无"
+}
+# --- (修改结束) ---
+
+
+def plan_style_profile(address, value):
+    """
+    (数据提取 + 选择 Prompt) 确定一条对话的口吻分析需要怎样的 AI 调用。
+
+    Returns:
+        tuple: (对话结构, 请求)
+            对话结构: 数据格式不是字典时为 None；没有 sent 邮件时 style_profile 已设为默认值。
+            请求: {"mode": ..., "template": ..., "fields": ...}；无需调用 AI 时为 None。
+    """
+    # --- 1. (格式检测与数据提取) ---
+    if not isinstance(value, dict):
+        print(f"    -> 警告: {address} 的数据格式不是字典，跳过。")
+        return None, None
+
+    email_list = value.get("emails", [])
+    old_style_profile = value.get("style_profile", None)
+    conversation = {
+        **value,  # (保留 summary_watermark 等其他键)
+        "general_summary": value.get("general_summary", "总结丢失"),
+        "style_profile": old_style_profile,
+        "emails": email_list
+    }
+
+    # --- 2. 构造 Prompt 输入 (口吻分析) ---
+    sent_emails = [e for e in email_list if e.get("type") == "sent"]
+
+    if not sent_emails:
+        print("    -> 没有 'sent' 邮件，无法分析口吻，跳过。")
+        conversation["style_profile"] = DEFAULT_STYLE_PROFILE.copy() # (使用默认值)
+        return conversation, None
+
+    # (去除引用、签名与免责声明后再拼接，避免历史引用占满 3000 字的预算)
+    # (启用向量索引时在预算内挑选最近的与最能代表这段对话的发信，否则取最近 5 封)
+    reduced_bodies = {id(e): reduce_email_body(e.get("body", "")) for e in sent_emails}
+    if EMBEDDING_INDEX_ENABLED:
+        style_samples = select_context_emails(address, sent_emails, lambda e: reduced_bodies[id(e)], recent_count=2)
+    else:
+        style_samples = sent_emails[-5:]
+    recent_bodies = [reduced_bodies[id(e)] for e in style_samples]
+    style_digest = "\n\n--- (下一封邮件) ---\n\n".join(recent_bodies)
+
+    # --- 3. (智能选择 Prompt) ---
+    if old_style_profile and old_style_profile.get("formality", "未知") != "未知":
+        # (A) 使用 UPDATE 提示词
+        print("    -> 检测到旧口吻，执行[更新]操作...")
+        return conversation, {
+            "mode": "更新",
+            "template": UPDATE_STYLE_TEMPLATE,
+            "fields": {
+                "old_style_profile": json.dumps(old_style_profile, ensure_ascii=False),
+                "style_digest": style_digest[:3000]
+            }
+        }
+
+    # (B) 使用 CREATE 提示词
+    if old_style_profile:
+        print("    -> 旧口吻无效，执行[重新生成]操作...")
+    else:
+        print("    -> 未检测到旧口吻，执行[创建]操作...")
+
+    return conversation, {
+        "mode": "创建",
+        "template": CREATE_STYLE_TEMPLATE,
+        "fields": {"style_digest": style_digest[:3000]}
+    }
+
+
+def parse_style_profile(result):
+    """(修正点: 健壮的解析逻辑) 兼容嵌套 ('style_profile') 与扁平 (顶级 'formality') 两种响应格式。"""
+    style_profile = DEFAULT_STYLE_PROFILE.copy()  # 先从默认值开始
+
+    if 'style_profile' in result and isinstance(result['style_profile'], dict):
+        # (A) 理想情况: AI 遵守了嵌套格式
+        print("    -> (解析) AI 遵守了 'style_profile' 嵌套格式。")
+        style_profile.update(result['style_profile'])  # .update() 会自动处理新键
+
+    elif 'formality' in result:
+        # (B) 备用方案: AI 返回了扁平(flat)格式
+        print("    -> (解析) 警告: AI 返回了扁平格式，正在手动构建。")
+        style_profile['formality'] = result.get('formality', '未知')
+        # --- (修改点 2: 添加 new_key) ---
+        style_profile['tone_description'] = result.get('tone_description', '未知') # <-- (新增)
+        # --- (修改结束) ---
+        style_profile['greeting_template'] = result.get('greeting_template', '无')
+        style_profile['sign_off_template'] = result.get('sign_off_template', '无')
+    else:
+        # (C) 失败情况: AI 返回了无法识别的 JSON
+        print("    -> (解析) 警告: AI 未返回 'style_profile' 或 'formality' 键。")
+        # (style_profile 保持为 DEFAULT_STYLE_PROFILE)
+
+    return style_profile
+
+
+def apply_style_profile_result(conversation, result=None, error=None):
+    """
+    将口吻分析调用的结果 (或异常) 写入对话结构。
+
+    Returns:
+        bool: 是否被推迟 (熔断器打开或时间预算耗尽)
+    """
+    if error is None:
+        style_profile = parse_style_profile(result)
+        conversation["style_profile"] = style_profile
+        print(f"    AI STYLE SUCCESS -> 格式: {style_profile.get('formality', 'N/A')}")
+        return False
+
+    old_style_profile = conversation.get("style_profile")
+    if isinstance(error, AIWorkDeferredError):
+        # 熔断器打开或时间预算耗尽: 保留旧口吻，推迟到下一周期
+        if not old_style_profile:
+            conversation["style_profile"] = {**DEFAULT_STYLE_PROFILE, "error": f"AI处理失败: {error}"}
+        print(f"    AI STYLE DEFER -> {error}")
+        return True
+
+    conversation["style_profile"] = {**DEFAULT_STYLE_PROFILE, "error": f"AI处理失败: {error}"}
+    print(f"    AI STYLE FAIL -> 错误: {error}")
+    return False
+
+
+def get_style_profile_for_conversation(ai_client, memory_with_summaries, model_name="gemini-2.5-flash",
+                                       deferred_list=None):
     """
     (修正版) 遍历 *已经包含总结* 的对话历史，并为 *每一个* 历史生成或更新AI口吻分析 (style_profile)。
     (修正) 增强了 JSON 解析的健壮性，以处理扁平(flat)响应。
     (修正) 添加了对 'tone_description' 键的支持。
+    (可选) deferred_list: 因熔断器打开或时间预算耗尽而未能更新口吻的地址会追加到此列表 (旧口吻保持不变)。
     """
     print(f"开始为 {len(memory_with_summaries)} 条对话历史生成/更新口吻分析...")
 
     final_memory_structure = {}
     total_conversations = len(memory_with_summaries)
-    current_convo_num = 0
-
-    # --- (修改点 1: 添加 new_key) ---
-    default_style_profile = {
-        "formality": "未知",
-        "tone_description": "未知", # <-- (新增)
-        "greeting_template": "无",
-        "sign_off_template": "无"
-    }
-    # --- (修改结束) ---
 
-    for address, value in memory_with_summaries.items():
-        current_convo_num += 1
+    def analyze_style(item):
+        """Returns: (新结构 或 None (跳过), 是否推迟)"""
+        current_convo_num, (address, value) = item
         print(f"  [口吻 {current_convo_num}/{total_conversations}] 正在处理: {address}")
 
-        # --- 1. (格式检测与数据提取) ---
-        if not isinstance(value, dict):
-            print(f"    -> 警告: {address} 的数据格式不是字典，跳过。")
-            continue
+        conversation, request = plan_style_profile(address, value)
+        if request is None:
+            return conversation, False
 
-        email_list = value.get("emails", [])
-        general_summary = value.get("general_summary", "总结丢失")
-        old_style_profile = value.get("style_profile", None)
-
-        # --- 2. 构造 Prompt 输入 (口吻分析) ---
-        sent_emails = [e for e in email_list if e.get("type") == "sent"]
-
-        if not sent_emails:
-            print("    -> 没有 'sent' 邮件，无法分析口吻，跳过。")
-            final_memory_structure[address] = {
-                "general_summary": general_summary,
-                "style_profile": default_style_profile.copy(), # (使用默认值)
-                "emails": email_list
-            }
-            continue
+        # --- 4. 调用 API (try/except 块) (已修正) ---
+        try:
+            result = request_ai_json(ai_client, request["template"], model_name, **request["fields"])
+        except Exception as e:
+            return conversation, apply_style_profile_result(conversation, error=e)
+        return conversation, apply_style_profile_result(conversation, result)
 
-        recent_bodies = [e.get("body", "") for e in sent_emails[-5:]]
-        style_digest = "\n\n--- (下一封邮件) ---\n\n".join(recent_bodies)
-
-        # --- 3. (智能选择 Prompt) ---
-        if old_style_profile and old_style_profile.get("formality", "未知") != "未知":
-            # (A) 使用 UPDATE 提示词
-            print("    -> 检测到旧口吻，执行[更新]操作...")
-            SYSTEM_PROMPT = UPDATE_STYLE_PROMPT.get("SYSTEM_PROMPT", "")
-            SUMMARY_TASK = UPDATE_STYLE_PROMPT.get("SUMMARY_TASK", "")
-            RESPONSE_INSTRUCTION = UPDATE_STYLE_PROMPT.get("RESPONSE_FORMAT_INSTRUCTION", "")
-
-            final_prompt = (
-                    SYSTEM_PROMPT + "\n\n" +
-                    SUMMARY_TASK + "\n\n" +
-                    f"【旧的风格分析】:\n{json.dumps(old_style_profile, ensure_ascii=False)}\n\n" +
-                    f"【最新的邮件正文 (按时间顺序)】:\n{style_digest[:3000]}\n\n" +
-                    RESPONSE_INSTRUCTION
-            )
-        else:
-            # (B) 使用 CREATE 提示词
-            if old_style_profile:
-                print("    -> 旧口吻无效，执行[重新生成]操作...")
-            else:
-                print("    -> 未检测到旧口吻，执行[创建]操作...")
+    items = list(enumerate(memory_with_summaries.items(), start=1))
+    for (_, (address, _)), (conversation, deferred) in zip(items, map_ai_tasks(analyze_style, items)):
+        if conversation is not None:
+            final_memory_structure[address] = conversation
+        if deferred and deferred_list is not None:
+            deferred_list.append(address)
 
-            SYSTEM_PROMPT = CREATE_STYLE_PROMPT.get("SYSTEM_PROMPT", "")
-            SUMMARY_TASK = CREATE_STYLE_PROMPT.get("SUMMARY_TASK", "")
-            RESPONSE_INSTRUCTION = CREATE_STYLE_PROMPT.get("RESPONSE_FORMAT_INSTRUCTION", "")
+    # 循环结束
+    print(f"信息：口吻分析转换完成 (共 {len(final_memory_structure)} 条对话)。")
+    return final_memory_structure
+
+
+# --- 总体总结 + 口吻分析 (合并调用) ---
+def build_conversation_profile_fields(summary_request, style_request):
+    """将总结与口吻分析两个请求的输入合并为 CONVERSATION_PROFILE 模板的字段 (各自的 CREATE/UPDATE 选择保持不变)。"""
+    summary_fields = summary_request["fields"]
+    style_fields = style_request["fields"]
+    return {
+        "summary_mode": summary_request["mode"],
+        "old_summary": summary_fields.get("old_summary", "无"),
+        "digest": summary_fields["digest"],
+        "style_mode": style_request["mode"],
+        "old_style_profile": style_fields.get("old_style_profile", "无"),
+        "style_digest": style_fields["style_digest"]
+    }
 
-            final_prompt = (
-                    SYSTEM_PROMPT + "\n\n" +
-                    SUMMARY_TASK + "\n\n" +
-                    f"以下是[我]发送的邮件正文 (按时间顺序):\n{style_digest[:3000]}\n\n" +
-                    RESPONSE_INSTRUCTION
-            )
-        # --- (Prompt 构造结束) ---
 
-        # --- 4. 调用 API (try/except 块) (已修正) ---
-        try:
-            response = retry_gemini_call(
-                ai_client.models.generate_content,
-                model=model_name,
-                contents=final_prompt,
-                config={"response_mime_type": "application/json"}
-            )
-            result = json.loads(response.text)
-
-            # (修正点: 健壮的解析逻辑)
-            style_profile = default_style_profile.copy()  # 先从默认值开始
-
-            if 'style_profile' in result and isinstance(result['style_profile'], dict):
-                # (A) 理想情况: AI 遵守了嵌套格式
-                print("    -> (解析) AI 遵守了 'style_profile' 嵌套格式。")
-                style_profile.update(result['style_profile'])  # .update() 会自动处理新键
-
-            elif 'formality' in result:
-                # (B) 备用方案: AI 返回了扁平(flat)格式
-                print("    -> (解析) 警告: AI 返回了扁平格式，正在手动构建。")
-                style_profile['formality'] = result.get('formality', '未知')
-                # --- (修改点 2: 添加 new_key) ---
-                style_profile['tone_description'] = result.get('tone_description', '未知') # <-- (新增)
-                # --- (修改结束) ---
-                style_profile['greeting_template'] = result.get('greeting_template', '无')
-                style_profile['sign_off_template'] = result.get('sign_off_template', '无')
-            else:
-                # (C) 失败情况: AI 返回了无法识别的 JSON
-                print("    -> (解析) 警告: AI 未返回 'style_profile' 或 'formality' 键。")
-                # (style_profile 保持为 default_style_profile)
+def get_summary_and_style_for_conversation(ai_client, memory_dict, model_name="gemini-2.5-flash", deferred_list=None,
+                                           summary_addresses=None, style_addresses=None):
+    """
+    为每条对话生成或更新总体总结与口吻分析，两者都需要 AI 时合并为一次调用 (CONVERSATION_PROFILE)。
 
-            print(f"    AI STYLE SUCCESS -> 格式: {style_profile.get('formality', 'N/A')}")
+    总结与口吻各自的 CREATE/UPDATE 选择与单独调用时相同；只有一方需要 AI 时 (例如水位线之后没有新邮件，
+    或对话中没有 sent 邮件) 使用该方单独的 Prompt；配置中缺少 CONVERSATION_PROFILE 时退回分别调用。
 
-        except Exception as e:
-            style_profile = default_style_profile.copy()
-            style_profile["error"] = f"AI处理失败: {e}"
-            print(f"    AI STYLE FAIL -> 错误: {e}")
-        # --- (修正结束) ---
-
-        # --- 5. (构建 *完整* 结构) ---
-        final_memory_structure[address] = {
-            "general_summary": general_summary,
-            "style_profile": style_profile,
-            "emails": email_list
-        }
+    Args:
+        ai_client: 已经初始化的 AI 后端实例 (Utils.ai_backend.AIBackend)。
+        memory_dict (dict): 同 get_history_summary_for_conversation (旧格式或新格式)。
+        model_name: 使用的模型名称
+        deferred_list: (可选) 因熔断器打开或时间预算耗尽而有部分未能更新的地址会追加到此列表。
+        summary_addresses: (可选) 需要更新总结的地址集合，None 表示全部。
+        style_addresses: (可选) 需要更新口吻的地址集合，None 表示全部。
 
-        # --- 6. 速率限制 ---
-        time.sleep(SECONDS_BETWEEN_REQUESTS)
+    Returns:
+        dict: 新格式 {"address": {"general_summary": ..., "style_profile": ..., "summary_watermark": ..., "emails": [...]}}
+    """
+    print(f"开始为 {len(memory_dict)} 条对话历史生成/更新总体总结与口吻分析...")
+
+    final_memory_structure = {}
+    total_conversations = len(memory_dict)
+
+    def call_ai(request):
+        """Returns: (result, error)"""
+        try:
+            return request_ai_json(ai_client, request["template"], model_name, **request["fields"]), None
+        except Exception as e:
+            return None, e
+
+    def build_profile(item):
+        """Returns: (新结构 或 None (跳过), 是否推迟)"""
+        current_convo_num, (address, value) = item
+        print(f"  [总结/口吻 {current_convo_num}/{total_conversations}] 正在处理: {address}")
+
+        conversation, summary_request = value, None
+        if summary_addresses is None or address in summary_addresses:
+            conversation, summary_request = plan_history_summary(address, value)
+            if conversation is None:
+                return None, False
+
+        style_request = None
+        if style_addresses is None or address in style_addresses:
+            conversation, style_request = plan_style_profile(address, conversation)
+            if conversation is None:
+                return None, False
+
+        deferred = False
+        if summary_request:
+            # (分层总结先完成分段总结，最终的合并调用仍可与口吻分析合并)
+            error = resolve_history_summary_request(ai_client, conversation, summary_request, model_name)
+            if error is not None:
+                deferred = apply_history_summary_result(conversation, error=error)
+                summary_request = None
+
+        if summary_request and style_request and CONVERSATION_PROFILE_TEMPLATE is not None:
+            # (合并调用: 一次请求同时返回 general_summary 与 style_profile)
+            result, error = call_ai({
+                "template": CONVERSATION_PROFILE_TEMPLATE,
+                "fields": build_conversation_profile_fields(summary_request, style_request)
+            })
+            summary_deferred = apply_history_summary_result(conversation, result, error,
+                                                            covered_emails=summary_request.get("covered_emails"))
+            style_deferred = apply_style_profile_result(conversation, result, error)
+            return conversation, summary_deferred or style_deferred
+
+        if summary_request:
+            deferred |= apply_history_summary_result(conversation, *call_ai(summary_request),
+                                                     covered_emails=summary_request.get("covered_emails"))
+        if style_request:
+            deferred |= apply_style_profile_result(conversation, *call_ai(style_request))
+        return conversation, deferred
+
+    items = list(enumerate(memory_dict.items(), start=1))
+    for (_, (address, _)), (conversation, deferred) in zip(items, map_ai_tasks(build_profile, items)):
+        if conversation is not None:
+            final_memory_structure[address] = conversation
+        if deferred and deferred_list is not None:
+            deferred_list.append(address)
 
     # 循环结束
-    print(f"信息：口吻分析转换完成 (共 {len(final_memory_structure)} 条对话)。")
-    return final_memory_structure
\ No newline at end of file
+    print(f"信息：总结与口吻分析完成 (共 {len(final_memory_structure)} 条对话)。")
+    return final_memory_structure
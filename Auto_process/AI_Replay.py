@@ -0,0 +1,391 @@
+import argparse
+import copy
+import glob
+import hashlib
+import json
+import os
+import time
+
+import AI_Handler
+
+from datetime import datetime, timezone
+from Auto_process.mail_AutoProcess import CURRENT_DIR, AI_SETUP, AI_CONCURRENCY_CONFIG, MODEL_NAME, \
+    IN_RAWDATA_OUTPUT_PATH, SENT_RAWDATA_OUTPUT_PATH, VALID_MAIL_OUTPUT_PATH, INVALID_MAIL_OUTPUT_PATH, \
+    SENT_MAIL_OUTPUT_PATH, CONVERSATION_MEMORY_PATH, connect_gemini
+from Utils.util import datetime_to_json, reduce_email_body, get_email_key, iter_json_array
+from Utils.ai_throttle import AdaptiveConcurrencyController, AIWorkDeferredError
+
+# 回放结果的输出根目录: Info/replay/<版本>/
+REPLAY_OUTPUT_DIR = os.path.join(CURRENT_DIR, "../Info/replay")
+
+# --- 回放配置 ---
+REPLAY_CONFIG = AI_SETUP.get('REPLAY', {})
+# 每批提交的 AI 调用数 (每完成一批写一次结果，中断后最多重做一批)
+REPLAY_BATCH_SIZE = REPLAY_CONFIG.get('BATCH_SIZE', 200)
+# 每分钟请求数上限 (0 表示只依赖自适应并发控制)
+REPLAY_MAX_REQUESTS_PER_MINUTE = REPLAY_CONFIG.get('MAX_REQUESTS_PER_MINUTE', 0)
+# 熔断导致工作被推迟时，等待恢复后重试的最大轮数
+REPLAY_MAX_PASSES = REPLAY_CONFIG.get('MAX_PASSES', 5)
+
+# --- 数据来源 ---
+REPLAY_SOURCES = {
+    "inbox": IN_RAWDATA_OUTPUT_PATH,  # 原始收信
+    "sentbox": SENT_RAWDATA_OUTPUT_PATH,  # 原始发信
+    "valid": VALID_MAIL_OUTPUT_PATH,
+    "invalid": INVALID_MAIL_OUTPUT_PATH,
+    "sent": SENT_MAIL_OUTPUT_PATH,
+}
+
+# --- 可回放的阶段 ---
+# 单封邮件的阶段: 阶段名 -> (Prompt 模板, AI 结果 -> 输出结果)
+EMAIL_STAGES = {
+    "classification": (
+        AI_Handler.CLASSIFICATION_TEMPLATE,
+        lambda result: {"score": int(result.get('score', 5)), "summary": result.get('summary', '未总结')}
+    ),
+    "summary": (
+        AI_Handler.SUMMARY_TEMPLATE,
+        lambda result: {"summary": result.get('summary', 'AI未提供总结')}
+    ),
+    "conversation_check": (
+        AI_Handler.CONVO_TEMPLATE,
+        lambda result: {"is_conversation": str(result.get('is_conversation', True)).lower() == 'true',
+                        "reason": result.get('reason', 'AI未提供理由')}
+    ),
+}
+# 整条对话的阶段 (来源为对话历史文件): 总体总结 + 口吻分析
+STAGE_CONVERSATION_PROFILE = "conversation_profile"
+REPLAY_STAGES = tuple(EMAIL_STAGES) + (STAGE_CONVERSATION_PROFILE,)
+CONVERSATION_PROFILE_TEMPLATES = ("HISTORY_SUMMARY", "HISTORY_CHUNK_SUMMARY", "HISTORY_REDUCE",
+                                  "CREATE_STYLE_PROFILE", "CONVERSATION_PROFILE")
+
+
+def get_stage_fingerprint(stages):
+    """所选阶段使用的 Prompt 前缀的指纹。Prompt_config.json 修改后指纹变化，默认版本号随之变化。"""
+    prefix_keys = []
+    for stage in stages:
+        if stage in EMAIL_STAGES:
+            names = [EMAIL_STAGES[stage][0].name]
+        else:
+            names = [name for name in CONVERSATION_PROFILE_TEMPLATES if name in AI_Handler.PROMPT_TEMPLATES]
+        prefix_keys.extend(f"{name}:{AI_Handler.PROMPT_TEMPLATES[name].prefix_key}" for name in names)
+    return hashlib.sha256("\n".join(sorted(prefix_keys)).encode('utf-8')).hexdigest()[:8]
+
+
+def get_email_address(email):
+    """收信取发件人，发信取第一个收件人。"""
+    if email.get("type") == "sent":
+        receivers = email.get("receiver") or []
+        return receivers[0] if receivers else ""
+    if "sender_name" in email:
+        return f"{email.get('sender_name', '')}@{email.get('sender_root', '')}"
+    return email.get("sender", "")
+
+
+def get_shard(value, shard_count):
+    """稳定的分片编号 (不使用内置 hash，保证不同进程之间结果一致)。"""
+    return int(hashlib.md5(str(value).encode('utf-8')).hexdigest()[:8], 16) % shard_count
+
+
+class ReplayRun:
+    """
+    一次回放任务: 结果写入 Info/replay/<版本>/，每个分片一个 JSON Lines 文件，每行一条结果:
+        {"stage": ..., "key": ..., "address": ..., "sent_time": ..., "result": {...}, "replayed_at": ...}
+    启动时读取该版本目录下已有的全部结果，跳过已完成的 (阶段, 邮件)，因此中断后以相同参数重新执行即可续跑，
+    也可以用不同的分片参数在多个进程中并行执行。AI 失败的项不写入结果，续跑时会重新处理。
+    """
+
+    def __init__(self, ai_client, stages, model_name, version, shard_by=None, shard_count=1, shard_index=0,
+                 since=None, until=None, limit=None):
+        self.ai_client = ai_client
+        self.stages = stages
+        self.model_name = model_name
+        self.version = version
+        self.shard_by = shard_by
+        self.shard_count = shard_count
+        self.shard_index = shard_index
+        self.since = since
+        self.until = until
+        self.limit = limit
+
+        self.output_dir = os.path.join(REPLAY_OUTPUT_DIR, version)
+        shard_name = f"shard-{shard_index}-of-{shard_count}" if shard_by else "all"
+        self.results_path = os.path.join(self.output_dir, f"results.{shard_name}.jsonl")
+        self.completed = set()  # {(阶段, 键)}
+        self.stats = {"done": 0, "skipped": 0, "failed": 0, "deferred": 0}
+        self.started_at = time.monotonic()
+
+    # --- 结果文件 ---
+    def load_completed(self):
+        for path in glob.glob(os.path.join(self.output_dir, "results.*.jsonl")):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.completed.add((entry["stage"], entry["key"]))
+                    except (ValueError, KeyError, TypeError):
+                        continue  # (中断时未写完的最后一行)
+        if self.completed:
+            print(f"信息：(续跑) 版本 {self.version} 已有 {len(self.completed)} 条结果，将跳过。")
+
+    def write_manifest(self):
+        """版本目录的说明 (模型、阶段、Prompt 指纹)，首次创建时写入。"""
+        manifest_path = os.path.join(self.output_dir, "manifest.json")
+        if os.path.exists(manifest_path):
+            return
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": self.version,
+                "model_name": self.model_name,
+                "stages": list(self.stages),
+                "prompt_fingerprint": get_stage_fingerprint(self.stages),
+                "created_at": datetime.now(timezone.utc).isoformat()
+            }, f, indent=4, ensure_ascii=False)
+
+    def write_progress(self, status):
+        """每个分片单独的进度文件 (多个分片进程并行时互不覆盖)。"""
+        with open(self.results_path[:-len(".jsonl")] + ".progress.json", 'w', encoding='utf-8') as f:
+            json.dump({
+                "status": status,
+                "shard_by": self.shard_by,
+                "shard": f"{self.shard_index}/{self.shard_count}",
+                "since": self.since,
+                "until": self.until,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+                **self.stats
+            }, f, indent=4, ensure_ascii=False)
+
+    def append_results(self, entries):
+        if not entries:
+            return
+        with open(self.results_path, 'a', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False, default=datetime_to_json) + "\n")
+                self.completed.add((entry["stage"], entry["key"]))
+
+    # --- 筛选 ---
+    def select(self, address, sent_time):
+        """按日期范围与分片筛选。"""
+        date = str(sent_time or "")[:10]
+        if self.since and date < self.since:
+            return False
+        if self.until and date > self.until:
+            return False
+        if self.shard_by:
+            value = address if self.shard_by == "sender" else date
+            if get_shard(value, self.shard_count) != self.shard_index:
+                return False
+        return True
+
+    # --- 执行 ---
+    def run_batches(self, work_items, run_batch):
+        """
+        将工作按 REPLAY_BATCH_SIZE 分批执行。run_batch(batch) 返回 (结果列表, 被推迟的项)；
+        被推迟的项在熔断器恢复后重试，最多 REPLAY_MAX_PASSES 轮。
+        """
+        batch = []
+        for item in work_items:
+            batch.append(item)
+            if len(batch) >= REPLAY_BATCH_SIZE:
+                self.run_batch_with_recovery(batch, run_batch)
+                batch = []
+        if batch:
+            self.run_batch_with_recovery(batch, run_batch)
+
+    def run_batch_with_recovery(self, batch, run_batch):
+        pending = batch
+        for current_pass in range(1, REPLAY_MAX_PASSES + 1):
+            entries, pending = run_batch(pending)
+            self.append_results(entries)
+            self.stats["done"] += len(entries)
+            if not pending or current_pass == REPLAY_MAX_PASSES:
+                break
+            controller = AI_Handler.AI_CONTROLLER
+            wait = controller.open_seconds if controller else AI_Handler.BASE_RETRY_DELAY
+            print(f"信息：{len(pending)} 项回放因 AI 服务不可用被推迟，{wait} 秒后重试 "
+                  f"(第 {current_pass}/{REPLAY_MAX_PASSES} 轮)...")
+            time.sleep(wait)
+        self.stats["deferred"] += len(pending)
+
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        print(f"信息：回放进度 完成 {self.stats['done']} / 跳过 {self.stats['skipped']} / "
+              f"失败 {self.stats['failed']} / 未完成 {self.stats['deferred']}，"
+              f"{self.stats['done'] / elapsed:.2f} 条/秒")
+        self.write_progress("running")
+
+    # --- 单封邮件的阶段 ---
+    def iter_email_work(self, source_paths):
+        """流式读取邮件，产出尚未完成的 (阶段, 键, 邮件)。"""
+        email_stages = [stage for stage in self.stages if stage in EMAIL_STAGES]
+        produced = 0
+        for source_path in source_paths:
+            if not os.path.exists(source_path):
+                print(f"警告：数据文件 {source_path} 不存在，跳过。")
+                continue
+            for email in iter_json_array(source_path):
+                if not isinstance(email, dict) or not self.select(get_email_address(email), email.get("sent_time")):
+                    continue
+                key = get_email_key(email)
+                for stage in email_stages:
+                    if (stage, key) in self.completed:
+                        self.stats["skipped"] += 1
+                        continue
+                    if self.limit is not None and produced >= self.limit:
+                        return
+                    produced += 1
+                    yield stage, key, email
+
+    def run_email_batch(self, batch):
+        def replay_email(item):
+            """Returns: (结果条目 或 None, 是否推迟)"""
+            stage, key, email = item
+            template, parse = EMAIL_STAGES[stage]
+            try:
+                result = AI_Handler.request_ai_json(
+                    self.ai_client, template, self.model_name,
+                    subject=email.get('subject', '无主题'),
+                    body=reduce_email_body(email.get('body', '无正文'))[:1000]
+                )
+                return {
+                    "stage": stage,
+                    "key": key,
+                    "address": get_email_address(email),
+                    "sent_time": email.get("sent_time"),
+                    "result": parse(result),
+                    "replayed_at": datetime.now(timezone.utc).isoformat()
+                }, False
+            except AIWorkDeferredError:
+                return None, True
+            except Exception as e:
+                print(f"  REPLAY FAIL -> [{stage}] {key}, 错误: {e}")
+                return None, False
+
+        entries, deferred = [], []
+        for item, (entry, is_deferred) in zip(batch, AI_Handler.map_ai_tasks(replay_email, batch)):
+            if entry is not None:
+                entries.append(entry)
+            elif is_deferred:
+                deferred.append(item)
+            else:
+                self.stats["failed"] += 1
+        return entries, deferred
+
+    # --- 对话阶段 ---
+    def iter_conversation_work(self, memory_path):
+        try:
+            with open(memory_path, 'r', encoding='utf-8') as f:
+                memory = json.load(f)
+        except Exception as e:
+            print(f"警告：读取对话历史 {memory_path} 失败 ({e})，跳过对话阶段。")
+            return
+        produced = 0
+        for address, conversation in memory.items():
+            if not isinstance(conversation, dict) or not conversation.get("emails"):
+                continue
+            key = f"conversation:{address}"
+            if not self.select(address, conversation["emails"][-1].get("sent_time")):
+                continue
+            if (STAGE_CONVERSATION_PROFILE, key) in self.completed:
+                self.stats["skipped"] += 1
+                continue
+            if self.limit is not None and produced >= self.limit:
+                return
+            produced += 1
+            # (去掉已有的总结、口吻与分段结果，使用当前的 Prompt/模型重新创建)
+            fresh = {"general_summary": None, "style_profile": None, "emails": copy.deepcopy(conversation["emails"])}
+            yield address, key, fresh
+
+    def run_conversation_batch(self, batch):
+        deferred_addresses = []
+        results = AI_Handler.get_summary_and_style_for_conversation(
+            self.ai_client, {address: conversation for address, _, conversation in batch},
+            self.model_name, deferred_list=deferred_addresses
+        )
+        entries, deferred = [], []
+        for item in batch:
+            address, key, _ = item
+            conversation = results.get(address)
+            if address in deferred_addresses:
+                deferred.append(item)
+                continue
+            summary = (conversation or {}).get("general_summary")
+            if not conversation or not summary or str(summary).startswith("AI处理失败"):
+                self.stats["failed"] += 1
+                continue
+            entries.append({
+                "stage": STAGE_CONVERSATION_PROFILE,
+                "key": key,
+                "address": address,
+                "sent_time": conversation["emails"][-1].get("sent_time"),
+                "result": {"general_summary": summary, "style_profile": conversation.get("style_profile")},
+                "replayed_at": datetime.now(timezone.utc).isoformat()
+            })
+        return entries, deferred
+
+    def run(self, source_paths, memory_path=CONVERSATION_MEMORY_PATH):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.load_completed()
+        self.write_manifest()
+        self.write_progress("running")
+        print(f"信息：开始回放 {', '.join(self.stages)} (模型 {self.model_name}，版本 {self.version}) -> {self.results_path}")
+
+        if any(stage in EMAIL_STAGES for stage in self.stages):
+            self.run_batches(self.iter_email_work(source_paths), self.run_email_batch)
+        if STAGE_CONVERSATION_PROFILE in self.stages:
+            self.run_batches(self.iter_conversation_work(memory_path), self.run_conversation_batch)
+
+        status = "completed" if not self.stats["deferred"] and not self.stats["failed"] else "incomplete"
+        self.write_progress(status)
+        print(f"信息：回放结束 ({status})，完成 {self.stats['done']} 条，跳过 {self.stats['skipped']} 条，"
+              f"失败 {self.stats['failed']} 条，未完成 {self.stats['deferred']} 条。")
+        return self.stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="使用当前的 Prompt/模型批量重新生成已保存邮件的 AI 结果 (写入新的版本目录)。")
+    parser.add_argument("--stages", default="classification",
+                        help=f"逗号分隔的阶段: {', '.join(REPLAY_STAGES)}")
+    parser.add_argument("--sources", default="inbox",
+                        help=f"逗号分隔的数据来源 (单封邮件阶段): {', '.join(REPLAY_SOURCES)}")
+    parser.add_argument("--model", default=MODEL_NAME, help="模型名称 (默认使用 AI_config.json 中的 MODEL_NAME)")
+    parser.add_argument("--version", default=None, help="输出版本名 (默认: <模型>-<Prompt 指纹>)")
+    parser.add_argument("--shard-by", choices=("sender", "date"), default=None, help="分片依据")
+    parser.add_argument("--shard", default="0/1", help="分片编号/分片总数，例如 2/8")
+    parser.add_argument("--since", default=None, help="起始日期 (含)，YYYY-MM-DD")
+    parser.add_argument("--until", default=None, help="结束日期 (含)，YYYY-MM-DD")
+    parser.add_argument("--limit", type=int, default=None, help="最多处理的条数 (用于试跑)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in REPLAY_STAGES]
+    if unknown:
+        print(f"错误：未知的阶段 {unknown}，可选: {REPLAY_STAGES}")
+        return
+    missing = [stage for stage in stages if stage in EMAIL_STAGES and EMAIL_STAGES[stage][0] is None]
+    if missing:
+        print(f"错误：Prompt 配置中缺少阶段 {missing} 的模板。")
+        return
+    sources = [source.strip() for source in args.sources.split(",") if source.strip()]
+    if any(source not in REPLAY_SOURCES for source in sources):
+        print(f"错误：未知的数据来源 {sources}，可选: {tuple(REPLAY_SOURCES)}")
+        return
+    shard_index, _, shard_count = args.shard.partition("/")
+    shard_index, shard_count = int(shard_index), int(shard_count or 1)
+
+    # (回放总是并发执行: 未启用 AI_CONCURRENCY 时也创建自适应并发控制器)
+    if AI_Handler.AI_CONTROLLER is None:
+        AI_Handler.AI_CONTROLLER = AdaptiveConcurrencyController.from_config(AI_CONCURRENCY_CONFIG)
+    AI_Handler.set_request_rate_limit(REPLAY_MAX_REQUESTS_PER_MINUTE)
+
+    version = args.version or f"{args.model}-{get_stage_fingerprint(stages)}"
+    replay = ReplayRun(connect_gemini(), stages, args.model, version, shard_by=args.shard_by,
+                       shard_count=shard_count, shard_index=shard_index, since=args.since, until=args.until,
+                       limit=args.limit)
+    replay.run([REPLAY_SOURCES[source] for source in sources])
+
+
+if __name__ == '__main__':
+    main()
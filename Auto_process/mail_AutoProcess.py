@@ -2,6 +2,7 @@ import imaplib
 import email
 import json
 import os
+import signal
 import threading
 import pytz
 import AI_Handler
@@ -11,9 +12,20 @@ from datetime import datetime, time
 from email.utils import parseaddr
 from email.header import decode_header
 from email.utils import parsedate_to_datetime
-from google import genai
 from Utils.util import datetime_to_json, extract_text_from_html, get_address_list_from_header, archive_email_to_memory, \
-    get_sortable_time
+    get_sortable_time, get_importance_from_headers, get_email_key, get_headers_from_msg
+from Utils.recompute_scheduler import RecomputeScheduler, ARTIFACT_SUMMARY, ARTIFACT_STYLE
+from Utils.ai_backend import create_backend
+from Utils.work_queue import AIWorkQueue, PriorityRules, new_work_batch, KIND_RECEIVED, KIND_SENT, KIND_CONVERSATION
+from Utils.init_checkpoint import InitCheckpoint, STAGE_CONVERSATION_CHECK, STAGE_SUMMARY, STAGE_STYLE
+from Utils.header_rules import HeaderRuleEngine, ACTION_INVALID, ACTION_VALID
+from Utils.sender_reputation import SenderReputation, STATE_CONFIDENT, STATE_RESAMPLE
+from Utils.domain_index import DomainScoreIndex
+from Utils.pipeline import StreamPipeline
+from Utils.poll_scheduler import AdaptivePollScheduler
+from Utils.metrics import METRICS, CycleReportWriter
+from Utils.status_server import StatusServer, render_prometheus
+from Utils.cycle_profiler import CycleProfiler
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 MAIL_CONFIG_FILE = os.path.join(CURRENT_DIR, "../Configs/Setup/mail_config.json")
@@ -21,10 +33,15 @@ AI_CONFIG_FILE = os.path.join(CURRENT_DIR,"../Configs/Setup/AI_config.json")
 IN_RAWDATA_OUTPUT_PATH = os.path.join(CURRENT_DIR, "../Info/inbox_data.json")
 SENT_RAWDATA_OUTPUT_PATH = os.path.join(CURRENT_DIR, "../Info/sentbox_data.json")
 SCORE_LIST_PATH = os.path.join(CURRENT_DIR, "../Info/email_sender_score_list.json")
+SENDER_REPUTATION_PATH = os.path.join(CURRENT_DIR, "../Info/sender_reputation.json")
 VALID_MAIL_OUTPUT_PATH = os.path.join(CURRENT_DIR, "../Info/valid_emails.json")
 INVALID_MAIL_OUTPUT_PATH = os.path.join(CURRENT_DIR, "../Info/invalid_emails.json")
 SENT_MAIL_OUTPUT_PATH = os.path.join(CURRENT_DIR, "../Info/sent_emails.json")
 CONVERSATION_MEMORY_PATH = os.path.join(CURRENT_DIR, "../Info/conversation_memory.json")
+AI_WORK_QUEUE_PATH = os.path.join(CURRENT_DIR, "../Info/ai_work_queue.json")
+INIT_CHECKPOINT_PATH = os.path.join(CURRENT_DIR, "../Info/init_checkpoint.jsonl")
+CYCLE_REPORT_PATH = os.path.join(CURRENT_DIR, "../Info/metrics/cycle_report.jsonl")
+PROFILE_OUTPUT_DIR = os.path.join(CURRENT_DIR, "../Info/profiles")
 
 # 读取邮箱配置
 try:
@@ -45,6 +62,14 @@ APP_PASSWORD = EMAIL_CONFIG['APP_PASSWORD']
 VALID_SCORE = EMAIL_CONFIG['THRESHOLD']['VALID_SCORE']
 NO_REPLY_PATTERN = EMAIL_CONFIG['NO_REPLY_PATTERNS']
 
+# --- 头部规则 (群发、自动发送、认证失败的邮件在 AI 之前直接分类；no-reply 类地址不参与对话记忆) ---
+HEADER_RULE_CONFIG = EMAIL_CONFIG.get('HEADER_RULES', {})
+HEADER_RULE_ENGINE = HeaderRuleEngine.from_config(HEADER_RULE_CONFIG, NO_REPLY_PATTERN)
+
+# --- 评分表查询 (按域名层级索引：精确规则、子域名继承、"*" 通配发件人) ---
+SCORE_LOOKUP_CONFIG = EMAIL_CONFIG.get('SCORE_LOOKUP', {})
+INHERIT_SENDER_NAMES = SCORE_LOOKUP_CONFIG.get('INHERIT_SENDER_NAMES', True)
+
 # --- 时区设置 ---
 TIMEZONE_STR = EMAIL_CONFIG['TIME_AREA'] + "/" + EMAIL_CONFIG['TIME_NATION']
 TIMEZONE = pytz.timezone(TIMEZONE_STR)
@@ -53,7 +78,8 @@ TIMEZONE = pytz.timezone(TIMEZONE_STR)
 # 读取AI配置
 try:
     with open(AI_CONFIG_FILE, 'r', encoding='utf-8') as f:
-        AI_CONFIG = json.load(f)["GEMINI_API"]
+        AI_SETUP = json.load(f)
+        AI_CONFIG = AI_SETUP["GEMINI_API"]
 except FileNotFoundError:
     print(f"错误：找不到配置文件 {MAIL_CONFIG_FILE}，请检查路径。")
     exit()
@@ -67,139 +93,356 @@ except json.JSONDecodeError:
 API_KEY = AI_CONFIG['API_KEY']
 MODEL_NAME = AI_CONFIG['MODEL_NAME']
 
+# --- AI 后端配置 ---
+AI_BACKEND_CONFIG = AI_SETUP.get('AI_BACKEND', {})
+
+# --- AI 并发控制与熔断配置 ---
+AI_CONCURRENCY_CONFIG = AI_SETUP.get('AI_CONCURRENCY', {})
+# --- AI 请求对冲配置 (削减尾延迟) ---
+AI_HEDGING_CONFIG = AI_SETUP.get('AI_HEDGING', {})
+
+# --- 分阶段模型路由 (先用快速模型，低置信度时升级到强模型) ---
+MODEL_CASCADE_CONFIG = AI_SETUP.get('MODEL_CASCADE', {})
+
+# --- 发件人信誉 (观测充分且稳定的发件人不再交由AI评分，按比例抽样复查) ---
+SENDER_REPUTATION_CONFIG = AI_SETUP.get('SENDER_REPUTATION', {})
+SENDER_REPUTATION = SenderReputation.from_config(SENDER_REPUTATION_PATH, SENDER_REPUTATION_CONFIG)
+
+# --- 本地预分类器配置 (缺省时使用默认值) ---
+LOCAL_CLASSIFIER_CONFIG = AI_SETUP.get('LOCAL_CLASSIFIER', {})
+# --- 近似重复检测配置 ---
+NEAR_DUPLICATE_CONFIG = AI_SETUP.get('NEAR_DUPLICATE', {})
+# --- 对话记忆向量索引配置 (按相关性挑选 AI 上下文) ---
+EMBEDDING_INDEX_CONFIG = AI_SETUP.get('EMBEDDING_INDEX', {})
+# --- 长对话分层 (map-reduce) 总结配置 ---
+HIERARCHICAL_SUMMARY_CONFIG = AI_SETUP.get('HIERARCHICAL_SUMMARY', {})
+
+# --- 总结/口吻重算调度 (防抖合并) ---
+RECOMPUTE_CONFIG = AI_SETUP.get('RECOMPUTE_SCHEDULER', {})
+RECOMPUTE_SCHEDULER = RecomputeScheduler(
+    window_seconds=RECOMPUTE_CONFIG.get('WINDOW_SECONDS', 21600),
+    change_threshold=RECOMPUTE_CONFIG.get('CHANGE_THRESHOLD', 5),
+    enabled=RECOMPUTE_CONFIG.get('ENABLED', False)
+)
+
+# --- AI 工作队列 (按优先级处理，每个周期有时间预算) ---
+WORK_QUEUE_CONFIG = AI_SETUP.get('WORK_QUEUE', {})
+CYCLE_TIME_BUDGET_SECONDS = WORK_QUEUE_CONFIG.get('CYCLE_TIME_BUDGET_SECONDS', 0)
+# 优先级不低于此值的工作单独先走完整流程 (分类 → 总结 → 对话维护)，不必等待其他邮件的分类
+URGENT_PRIORITY = WORK_QUEUE_CONFIG.get('URGENT_PRIORITY', 6)
+PRIORITY_RULES = PriorityRules.from_config(WORK_QUEUE_CONFIG, NO_REPLY_PATTERN)
+AI_WORK_QUEUE = AIWorkQueue(AI_WORK_QUEUE_PATH, aging_bonus=WORK_QUEUE_CONFIG.get('AGING_BONUS', 0.5))
+
+# --- 流水线模式 (抓取、解析与 AI 处理通过有界队列重叠执行) ---
+PIPELINE_CONFIG = AI_SETUP.get('PIPELINE', {})
+PIPELINE_ENABLED = PIPELINE_CONFIG.get('ENABLED', False)
+# 每凑满多少封邮件 (或第一封等待多久) 即交给分类与对话维护
+PIPELINE_BATCH_SIZE = PIPELINE_CONFIG.get('BATCH_SIZE', 20)
+PIPELINE_BATCH_WAIT_SECONDS = PIPELINE_CONFIG.get('BATCH_WAIT_SECONDS', 5)
+# 抓取/解析阶段之间的队列长度 (背压：下游处理不过来时抓取暂停)
+PIPELINE_QUEUE_SIZE = PIPELINE_CONFIG.get('QUEUE_SIZE', 64)
+
+# --- 轮询间隔 (按来信速率自适应：来信密集时缩短，安静时指数退避) ---
+POLLING_CONFIG = AI_SETUP.get('POLLING', {})
+POLL_SCHEDULER = AdaptivePollScheduler.from_config(POLLING_CONFIG)
+
+# --- 运行指标 (各阶段耗时、邮件数、AI 调用与重试、读写字节数)，每个周期输出一行 JSON 报告 ---
+METRICS_CONFIG = AI_SETUP.get('METRICS', {})
+CYCLE_REPORTER = CycleReportWriter(
+    CYCLE_REPORT_PATH,
+    max_bytes=METRICS_CONFIG.get('REPORT_MAX_BYTES', 5 * 1024 * 1024),
+    backup_count=METRICS_CONFIG.get('REPORT_BACKUP_COUNT', 5)
+)
+
+# --- 本地状态接口 (Prometheus 指标、健康/就绪检查、/stop 停止)，仅在守护进程模式下启动 ---
+STATUS_SERVER_CONFIG = AI_SETUP.get('STATUS_SERVER', {})
+STATUS_SERVER_ENABLED = STATUS_SERVER_CONFIG.get('ENABLED', False)
+STUCK_CYCLE_SECONDS = STATUS_SERVER_CONFIG.get('STUCK_CYCLE_SECONDS', 1800)
+# (状态接口的指标来自 METRICS，启用状态接口时同时启用指标记录)
+METRICS.enabled = METRICS_CONFIG.get('ENABLED', False) or STATUS_SERVER_ENABLED
+
+# --- 按需性能分析 (对接下来的 N 个周期进行 cProfile + tracemalloc 分析，报告写入 Info/profiles/) ---
+# 触发方式: 配置 PROFILE_CYCLES (启动后的前 N 个周期)、SIGUSR1 信号 (SIGNAL_CYCLES 个周期)、状态接口 POST /profile?cycles=N
+PROFILING_CONFIG = AI_SETUP.get('PROFILING', {})
+PROFILE_SIGNAL_CYCLES = PROFILING_CONFIG.get('SIGNAL_CYCLES', 1)
+CYCLE_PROFILER = CycleProfiler.from_config(PROFILING_CONFIG, PROFILE_OUTPUT_DIR)
+
+# --- 对话历史初始化任务 (断点续跑) ---
+INIT_JOB_CONFIG = AI_SETUP.get('INIT_JOB', {})
+# 对话筛选每完成一批写一次检查点
+INIT_CHECKPOINT_CHUNK_SIZE = INIT_JOB_CONFIG.get('CHECKPOINT_CHUNK_SIZE', 50)
+# 熔断导致部分工作被推迟时，等待恢复后重新执行剩余工作的最大轮数
+INIT_MAX_PASSES = INIT_JOB_CONFIG.get('MAX_PASSES', 5)
+
 
 # --- 连接到IMAP服务器并登录 ---
 def connect_and_login_email():
-    mclient = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
-    mclient.login(EMAIL_ADDRESS, APP_PASSWORD)
-    mclient.select('inbox')
+    with METRICS.timer("imap.login"):
+        mclient = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
+        mclient.login(EMAIL_ADDRESS, APP_PASSWORD)
+    imap_call(mclient, 'select', 'inbox')
     return mclient
 
 
-# --- 连接GEMINIAPI ---
+# --- 连接AI后端 (默认 Gemini，可配置为离线替身用于基准测试) ---
 def connect_gemini():
-    return genai.Client(api_key=API_KEY)
+    return create_backend(AI_BACKEND_CONFIG, API_KEY)
 
 
-# --- 读取未读邮件,结构化并保存为原始数据 ---
-def fetch_unseen_emails(mclient, json_file_path=IN_RAWDATA_OUTPUT_PATH):
-    # 搜索所有未读 (UNSEEN) 邮件
-    status, email_ids = mclient.search(None, 'UNSEEN')
-    email_id_list = email_ids[0].split()
+def load_score_index(score_list_path=SCORE_LIST_PATH):
+    """读取发件人评分表并编译为域名层级索引；读取失败时返回空索引。"""
+    score_list = {}
+    try:
+        if os.path.exists(score_list_path) and os.path.getsize(score_list_path) > 0:
+            with open(score_list_path, 'r', encoding='utf-8') as f:
+                score_list = json.load(f).get("SENDER_INFO_LIST", {})
+    except Exception as e:
+        print(f"WARNING: 读取评分表失败 ({e})，将不使用发件人评分。")
+    return DomainScoreIndex.from_score_list(score_list, INHERIT_SENDER_NAMES)
 
-    emails = []
 
-    for email_id in email_id_list:
-        # 获取邮件的完整数据 (RFC822 格式)
-        # 注意：这里 status, msg_data 的获取需要在循环内部
-        # mail.fetch() 的第一个返回值是状态，第二个是数据
-        status, msg_data = mclient.fetch(email_id, '(RFC822)')
+# --- AI 工作优先级 ---
+def make_priority_func(score_list_path=SCORE_LIST_PATH, memory_file_path=CONVERSATION_MEMORY_PATH):
+    """
+    读取估计优先级所需的廉价信号 (发件人评分表、已知对话伙伴地址)，
+    返回 email -> 优先级 的函数，供 AI_WORK_QUEUE 入队使用。
+    """
+    score_index = load_score_index(score_list_path)
+    known_addresses = set()
+    try:
+        if os.path.exists(memory_file_path) and os.path.getsize(memory_file_path) > 0:
+            with open(memory_file_path, 'r', encoding='utf-8') as f:
+                memory = json.load(f)
+            if isinstance(memory, dict):
+                known_addresses = set(memory.keys())
+    except Exception as e:
+        print(f"WARNING: 读取对话历史失败 ({e})，优先级估计将不使用已知对话伙伴。")
 
-        msg = email.message_from_bytes(msg_data[0][1])
+    return lambda email: PRIORITY_RULES.estimate(email, score_index, known_addresses)
 
-        date_header = msg['Date']
 
-        try:
-            sent_time = parsedate_to_datetime(date_header)
-        except Exception:
-            sent_time = None  # 遇到格式错误时设置为 None
+# --- IMAP 命令 (记录往返耗时与次数: imap.<命令>) ---
+def imap_call(mclient, command, *args):
+    with METRICS.timer("imap." + command):
+        return getattr(mclient, command)(*args)
 
-        subject_tuple = decode_header(msg['Subject'])[0]
-        subject = subject_tuple[0].decode(subject_tuple[1] or 'utf-8') if isinstance(subject_tuple[0], bytes) else \
-        subject_tuple[0]
 
-        body = ""
-        html_body = ""
+# --- 下载一封邮件的 RFC822 原始数据 ---
+def fetch_raw_message(mclient, email_id):
+    # mail.fetch() 的第一个返回值是状态，第二个是数据
+    status, msg_data = imap_call(mclient, 'fetch', email_id, '(RFC822)')
+    raw_message = msg_data[0][1]
+    METRICS.incr("bytes_fetched", len(raw_message))
+    return raw_message
 
-        if msg.is_multipart():
-            for part in msg.walk():
-                ctype = part.get_content_type()
-                cdispo = str(part.get('Content-Disposition'))
-                payload = part.get_payload(decode=True)
 
-                if ctype == 'text/plain' and 'attachment' not in cdispo and payload:
-                    # 找到纯文本，优先使用，并跳出循环
-                    body = payload.decode('utf-8', errors='ignore').strip()
-                    if body:
-                        break
+# --- 解析邮件正文 (纯文本优先，HTML 作为后备) ---
+def get_body_from_msg(msg):
+    body = ""
+    html_body = ""
 
-                elif ctype == 'text/html' and 'attachment' not in cdispo and payload:
-                    # 存储 HTML 内容作为后备
-                    html_body = payload.decode('utf-8', errors='ignore').strip()
+    if msg.is_multipart():
+        for part in msg.walk():
+            ctype = part.get_content_type()
+            cdispo = str(part.get('Content-Disposition'))
+            payload = part.get_payload(decode=True)
 
-        else:
-            # 非 multipart 消息
-            payload = msg.get_payload(decode=True)
-            if msg.get_content_type() == 'text/plain' and payload:
+            if ctype == 'text/plain' and 'attachment' not in cdispo and payload:
+                # 找到纯文本，优先使用，并跳出循环
                 body = payload.decode('utf-8', errors='ignore').strip()
-            elif msg.get_content_type() == 'text/html' and payload:
+                if body:
+                    break
+
+            elif ctype == 'text/html' and 'attachment' not in cdispo and payload:
+                # 存储 HTML 内容作为后备
                 html_body = payload.decode('utf-8', errors='ignore').strip()
 
-        if len(body) == 0:
+    else:
+        # 非 multipart 消息
+        payload = msg.get_payload(decode=True)
+        if msg.get_content_type() == 'text/plain' and payload:
+            body = payload.decode('utf-8', errors='ignore').strip()
+        elif msg.get_content_type() == 'text/html' and payload:
+            html_body = payload.decode('utf-8', errors='ignore').strip()
+
+    if not body and html_body:
+        with METRICS.timer("parse.html"):
             body = extract_text_from_html(html_body)
+    return body
 
-        # ----------------------------------------------------
-        # 转换为指定时区时间
-        if sent_time:
-            sent_time_jst = sent_time.astimezone(TIMEZONE)
-        else:
-            sent_time_jst = None
 
-        sender = msg['From']
-        to_header = msg['To']
-        cc_header = msg['Cc']
+# --- 解析邮件的发送时间 (转换为指定时区) 与主题 ---
+def get_time_and_subject_from_msg(msg):
+    date_header = msg['Date']
+
+    try:
+        sent_time = parsedate_to_datetime(date_header)
+    except Exception:
+        sent_time = None  # 遇到格式错误时设置为 None
+
+    subject_tuple = decode_header(msg['Subject'])[0]
+    subject = subject_tuple[0].decode(subject_tuple[1] or 'utf-8') if isinstance(subject_tuple[0], bytes) else \
+    subject_tuple[0]
+
+    # 转换为指定时区时间
+    if sent_time:
+        sent_time_jst = sent_time.astimezone(TIMEZONE)
+    else:
+        sent_time_jst = None
+    return sent_time_jst, subject
+
+
+# --- 将一封收到的邮件 (RFC822 原始数据) 结构化 ---
+def parse_received_email(email_id, raw_message):
+    with METRICS.timer("parse.received"):
+        return _parse_received_email(email_id, raw_message)
+
+
+def _parse_received_email(email_id, raw_message):
+    msg = email.message_from_bytes(raw_message)
+    sent_time_jst, subject = get_time_and_subject_from_msg(msg)
+    body = get_body_from_msg(msg)
+
+    sender = msg['From']
+    to_header = msg['To']
+    cc_header = msg['Cc']
+
+    to = get_address_list_from_header(to_header)
+    cc = get_address_list_from_header(cc_header)
+
+    # 解析sender
+    sender_root = ''
+    sender_name = ''
+
+    if sender:
+        display_name, email_addr = parseaddr(sender)
+        sender_name, sender_root = email_addr.split('@')
+
+    # 结构化返回信息
+    email_data = {
+        'type': 'received',
+        'id': email_id.decode() if isinstance(email_id, bytes) else email_id,
+        'sender_root': sender_root,
+        'sender_name': sender_name,
+        'receiver': to,
+        'cc': cc,
+        'subject': subject,
+        'sent_time': sent_time_jst,
+        'importance': get_importance_from_headers(msg),
+        'body': body
+    }
+    # 头部规则在此判断一次，只保存命中的规则名 (原始头部不写入任何存储)
+    headers = get_headers_from_msg(msg, HEADER_RULE_ENGINE.header_names)
+    rule = HEADER_RULE_ENGINE.evaluate({**email_data, 'headers': headers})
+    email_data['triage'] = rule["name"] if rule is not None else None
+    return email_data
+
+
+# --- 将一封已发送的邮件 (RFC822 原始数据) 结构化 ---
+def parse_sent_email(email_id, raw_message):
+    with METRICS.timer("parse.sent"):
+        return _parse_sent_email(email_id, raw_message)
+
+
+def _parse_sent_email(email_id, raw_message):
+    msg = email.message_from_bytes(raw_message)
+    sent_time_jst, subject = get_time_and_subject_from_msg(msg)
+    # 邮件正文提取逻辑 (与收到的邮件相同)
+    body = get_body_from_msg(msg)
+
+    # 获取 Sender
+    sender = msg['From']
+
+    # 获取 To 和 Cc
+    to_header = msg.get('To')
+    cc_header = msg.get('Cc')
+
+    to = get_address_list_from_header(to_header)
+    cc = get_address_list_from_header(cc_header)
+
+    display_name, email_addr = parseaddr(sender)
+
+    # 结构化返回信息
+    return {
+        'type': 'sent',
+        'id': email_id.decode() if isinstance(email_id, bytes) else email_id,
+        'sender': email_addr,
+        'receiver': to,
+        'cc': cc,
+        'subject': subject,
+        'sent_time': sent_time_jst,
+        'body': body
+    }
+
+
+# --- 将结构化的邮件合并写入原始数据文件 ---
+def save_raw_emails(emails, json_file_path, skip_existing=False):
+    """
+    读取现有原始数据，合并新邮件并按发送时间排序后覆盖写入。
+    skip_existing 为 True 时跳过 ID 已存在的邮件 (已发送邮件每次都会全部搜索到)。
+
+    Returns:
+        list: 实际写入的新邮件。
+    """
+    # 1. 尝试读取现有数据
+    all_emails = []
+    try:
+        if os.path.exists(json_file_path) and os.path.getsize(json_file_path) > 0:
+            with open(json_file_path, 'r', encoding='utf-8') as f:
+                all_emails = json.load(f)
+    except Exception as e:
+        # 如果文件存在但读取失败 (例如 JSON 格式错误)，打印警告并继续
+        print(f"WARNING: 原始数据文件读取失败 ({e})，将以新数据覆盖。")
+        all_emails = []
+
+    new_emails = emails
+    if skip_existing and all_emails:
+        existing_ids = {email.get('id') for email in all_emails if email.get('id')}
+        new_emails = [email for email in emails if email.get('id') not in existing_ids]
+
+    # 2. 合并新数据,并按发送时间进行排序
+    all_emails.extend(new_emails)
+    all_emails.sort(key=lambda email: email['sent_time']
+             if isinstance(email['sent_time'], datetime)
+             else datetime.fromisoformat(email['sent_time']))
+
+    # 3. 写入完整合并后的数据
+    with METRICS.persist(json_file_path), open(json_file_path, 'w', encoding='utf-8') as f:
+        json.dump(all_emails, f, indent=4, ensure_ascii=False, default=datetime_to_json)
+    return new_emails
 
-        to = get_address_list_from_header(to_header)
-        cc = get_address_list_from_header(cc_header)
 
-        # 解析sender
-        sender_root = ''
-        sender_name = ''
+# --- 读取原始数据文件中已有的邮件 ID ---
+def get_saved_email_ids(json_file_path):
+    try:
+        if os.path.exists(json_file_path) and os.path.getsize(json_file_path) > 0:
+            with open(json_file_path, 'r', encoding='utf-8') as f:
+                return {email.get('id') for email in json.load(f) if email.get('id')}
+    except Exception as e:
+        print(f"WARNING: 原始数据文件读取失败 ({e})，将视为没有已保存的邮件。")
+    return set()
+
+
+# --- 读取未读邮件,结构化并保存为原始数据 ---
+def fetch_unseen_emails(mclient, json_file_path=IN_RAWDATA_OUTPUT_PATH):
+    # 搜索所有未读 (UNSEEN) 邮件
+    status, email_ids = imap_call(mclient, 'search', None, 'UNSEEN')
+    email_id_list = email_ids[0].split()
 
-        if sender:
-            display_name, email_addr = parseaddr(sender)
-            sender_name, sender_root = email_addr.split('@')
+    emails = []
 
+    for email_id in email_id_list:
+        # 获取邮件的完整数据 (RFC822 格式)
+        raw_message = fetch_raw_message(mclient, email_id)
 
-        # 结构化返回信息
-        emails.append({
-            'type': 'received',
-            'id': email_id.decode(),
-            'sender_root': sender_root,
-            'sender_name': sender_name,
-            'receiver': to,
-            'cc': cc,
-            'subject': subject,
-            'sent_time': sent_time_jst,
-            'body': body
-        })
+        emails.append(parse_received_email(email_id, raw_message))
 
         # 处理完后标记为已读
-        mclient.store(email_id, '+FLAGS', '\\Seen')
+        imap_call(mclient, 'store', email_id, '+FLAGS', '\\Seen')
 
     # ------------------- JSON 写入部分 -------------------
     if emails:
-
-        # 1. 尝试读取现有数据
-        all_emails = []
-        try:
-            if os.path.exists(json_file_path) and os.path.getsize(json_file_path) > 0:
-                with open(json_file_path, 'r', encoding='utf-8') as f:
-                    all_emails = json.load(f)
-        except Exception as e:
-            # 如果文件存在但读取失败 (例如 JSON 格式错误)，打印警告并继续
-            print(f"WARNING: 原始数据文件读取失败 ({e})，将以新数据覆盖。")
-            all_emails = []
-
-            # 2. 合并新数据,并按发送时间进行排序
-        all_emails.extend(emails)
-        all_emails.sort(key=lambda email: email['sent_time']
-                 if isinstance(email['sent_time'], datetime)
-                 else datetime.fromisoformat(email['sent_time']))
-
-        # 3. 写入完整合并后的数据
-        with open(json_file_path, 'w', encoding='utf-8') as f:
-            json.dump(all_emails, f, indent=4, ensure_ascii=False, default=datetime_to_json)
+        save_raw_emails(emails, json_file_path)
         print(f"成功提取 {len(emails)} 封邮件，并写入到 {json_file_path}")
     else:
         print("没有发现新的未读邮件。")
@@ -211,130 +454,28 @@ def fetch_unseen_emails(mclient, json_file_path=IN_RAWDATA_OUTPUT_PATH):
 def fetch_sent_emails(mclient, json_file_path=SENT_RAWDATA_OUTPUT_PATH):
     # 1. 选择已发送文件夹。如果 'Sent' 失败，可以尝试 'Sent Items' 或其他特定名称
     try:
-        status, messages = mclient.select('Sent')
+        status, messages = imap_call(mclient, 'select', 'Sent')
     except mclient.error:
         print("警告：无法选择 'Sent' 文件夹。请检查您的邮箱服务商是否使用了其他名称（如 'Sent Items'）。")
         return []
 
     # 2. 搜索所有邮件 (已发送邮件通常被视为已读，不能用 UNSEEN)
-    status, email_ids = mclient.search(None, 'ALL')
+    status, email_ids = imap_call(mclient, 'search', None, 'ALL')
     email_id_list = email_ids[0].split()
 
     emails = []
 
     for email_id in email_id_list:
         # 获取邮件的完整数据 (RFC822 格式)
-        status, msg_data = mclient.fetch(email_id, '(RFC822)')
-
-        msg = email.message_from_bytes(msg_data[0][1])
-
-        date_header = msg['Date']
-
-        try:
-            sent_time = parsedate_to_datetime(date_header)
-        except Exception:
-            sent_time = None
-
-        # 获取 Subject
-        subject_tuple = decode_header(msg['Subject'])[0]
-        subject = subject_tuple[0].decode(subject_tuple[1] or 'utf-8') if isinstance(subject_tuple[0], bytes) else \
-            subject_tuple[0]
-
-        body = ""
-        html_body = ""
-
-        # 邮件正文提取逻辑 (与 fetch_unseen_emails 相同)
-        if msg.is_multipart():
-            for part in msg.walk():
-                ctype = part.get_content_type()
-                cdispo = str(part.get('Content-Disposition'))
-                payload = part.get_payload(decode=True)
-
-                if ctype == 'text/plain' and 'attachment' not in cdispo and payload:
-                    body = payload.decode('utf-8', errors='ignore').strip()
-                    if body:
-                        break
+        raw_message = fetch_raw_message(mclient, email_id)
 
-                elif ctype == 'text/html' and 'attachment' not in cdispo and payload:
-                    html_body = payload.decode('utf-8', errors='ignore').strip()
+        emails.append(parse_sent_email(email_id, raw_message))
 
-        else:
-            payload = msg.get_payload(decode=True)
-            if msg.get_content_type() == 'text/plain' and payload:
-                body = payload.decode('utf-8', errors='ignore').strip()
-            elif msg.get_content_type() == 'text/html' and payload:
-                html_body = payload.decode('utf-8', errors='ignore').strip()
-
-        if not body and html_body:
-            body = extract_text_from_html(html_body)
-
-        # ----------------------------------------------------
-        # 转换为指定时区时间
-        if sent_time:
-            sent_time_jst = sent_time.astimezone(TIMEZONE)
-        else:
-            sent_time_jst = None
-
-        # 获取 Sender
-        sender = msg['From']
-
-        # 获取 To 和 Cc
-        to_header = msg.get('To')
-        cc_header = msg.get('Cc')
-
-        to = get_address_list_from_header(to_header)
-        cc = get_address_list_from_header(cc_header)
-
-        display_name, email_addr = parseaddr(sender)
-
-
-        # 结构化返回信息
-        emails.append({
-            'type': 'sent',
-            'id': email_id.decode(),
-            'sender': email_addr,
-            'receiver': to,
-            'cc': cc,
-            'subject': subject,
-            'sent_time': sent_time_jst,
-            'body': body
-        })
-
-    # ------------------- JSON 写入部分 (新增去重逻辑) -------------------
+    # ------------------- JSON 写入部分 (去重：只追加 ID 不存在的邮件) -------------------
     new_unique_emails = []
 
     if emails:
-
-        # 尝试读取现有数据
-        all_emails = []
-        existing_ids = set()  # 存储现有邮件的ID
-        try:
-            if os.path.exists(json_file_path) and os.path.getsize(json_file_path) > 0:
-                with open(json_file_path, 'r', encoding='utf-8') as f:
-                    all_emails = json.load(f)
-
-                # 从已读取的数据中收集所有 ID
-                existing_ids = {email.get('id') for email in all_emails if email.get('id')}
-        except Exception as e:
-            print(f"WARNING: 原始数据文件读取失败 ({e})，将以新数据覆盖。")
-            all_emails = []
-
-
-        if not len(all_emails) > 0:
-            new_unique_emails = emails
-        else:
-            new_unique_emails = [email for email in emails if email.get('id') not in existing_ids]
-
-        all_emails.extend(new_unique_emails)  # 只追加不重复的邮件
-
-        # 排序逻辑
-        all_emails.sort(key=lambda email: email['sent_time']
-        if isinstance(email['sent_time'], datetime)
-        else datetime.fromisoformat(email['sent_time']))
-
-        # 写入完整合并后的数据
-        with open(json_file_path, 'w', encoding='utf-8') as f:
-            json.dump(all_emails, f, indent=4, ensure_ascii=False, default=datetime_to_json)
+        new_unique_emails = save_raw_emails(emails, json_file_path, skip_existing=True)
         print(f"成功提取 {len(new_unique_emails)} 封新增的已发送邮件，并写入到 {json_file_path}")
     else:
         print("没有发现新的已发送邮件。")
@@ -343,7 +484,11 @@ def fetch_sent_emails(mclient, json_file_path=SENT_RAWDATA_OUTPUT_PATH):
 
 
 # --- 对邮件分类并存储，随后根据该发件地址对分数列表进行维护 ---
-def email_classification(ai_client, in_emails, sent_emails, invalid_output_path=INVALID_MAIL_OUTPUT_PATH, valid_output_path=VALID_MAIL_OUTPUT_PATH, sent_output_path=SENT_MAIL_OUTPUT_PATH):
+def email_classification(ai_client, in_emails, sent_emails, invalid_output_path=INVALID_MAIL_OUTPUT_PATH, valid_output_path=VALID_MAIL_OUTPUT_PATH, sent_output_path=SENT_MAIL_OUTPUT_PATH, deferred=None):
+    # deferred: (可选) new_work_batch() 结构，熔断或时间预算耗尽时未处理的邮件会追加到其中
+    if deferred is None:
+        deferred = new_work_batch()
+
     valid_emails = []
     invalid_emails = []
     uncertain_emails = []
@@ -370,18 +515,37 @@ def email_classification(ai_client, in_emails, sent_emails, invalid_output_path=
             score_list = {}
 
         os.makedirs(os.path.dirname(invalid_output_path), exist_ok=True)
+        # 评分表编译为域名层级索引，子域名与通配规则也能在本地命中
+        score_index = DomainScoreIndex.from_score_list(score_list, INHERIT_SENDER_NAMES)
 
-        # 遍历读取的邮件，根据地址名单命中情况与具体评分进行分类
+        # 遍历读取的邮件，先按头部规则分类 (不写入评分表)，再根据地址名单命中情况与具体评分进行分类
+        header_count = 0
+        reputation_counts = {STATE_CONFIDENT: 0, STATE_RESAMPLE: 0}
         for email in in_emails:
             sender_root = email['sender_root']
             sender_name = email['sender_name']
-
-            sender_name_list = score_list.get(sender_root)
-            if sender_name_list is None:
-                uncertain_emails.append(email)
+            listed_score = score_index.lookup(sender_name, sender_root)
+
+            rule = HEADER_RULE_ENGINE.match(email)
+            if rule is not None and rule["action"] in (ACTION_INVALID, ACTION_VALID) and (
+                    rule["override_score_list"] or listed_score is None):
+                email["score"] = rule["score"]
+                (valid_emails if rule["action"] == ACTION_VALID else invalid_emails).append(email)
+                header_count += 1
                 continue
 
-            score = sender_name_list.get(sender_name)
+            # 发件人信誉可信时直接使用本地评分；观测不足、波动大或被抽中复查时交由AI
+            # 尚无信誉记录的发件人沿用评分表 (人工维护或旧版数据)，最后参考域名信誉
+            state, score = SENDER_REPUTATION.lookup_sender(sender_name, sender_root)
+            if state is None:
+                score = listed_score
+                if score is not None and SENDER_REPUTATION.should_resample():
+                    state, score = STATE_RESAMPLE, None
+                elif score is None:
+                    state, score = SENDER_REPUTATION.lookup_domain(sender_root)
+            if state in reputation_counts:
+                reputation_counts[state] += 1
+
             if score is None:
                 uncertain_emails.append(email)
 
@@ -394,13 +558,36 @@ def email_classification(ai_client, in_emails, sent_emails, invalid_output_path=
                 email["score"] = score
                 invalid_emails.append(email)
 
+        METRICS.incr("emails.header_rule", header_count)
+        METRICS.incr("emails.reputation_local", reputation_counts[STATE_CONFIDENT])
+        METRICS.incr("emails.reputation_resample", reputation_counts[STATE_RESAMPLE])
+        METRICS.incr("emails.uncertain", len(uncertain_emails))
+        if header_count:
+            print(f"SUCCESS: {header_count} 封邮件由头部规则直接分类 (自动回复/认证失败)，不交由AI")
+        if any(reputation_counts.values()):
+            print(f"信息：{reputation_counts[STATE_CONFIDENT]} 封邮件按可信的发件人信誉直接评分，"
+                  f"{reputation_counts[STATE_RESAMPLE]} 封被抽中交由AI复查。")
 
         # 完成分类后分别进行对应处理
         # 未识别邮件交由AI根据摘要和内容进行评分后分为有效和无效邮件中
         if len(uncertain_emails) > 0:
             print(f"SUCCESS: {len(uncertain_emails)} 封邮件被初步筛选为待定,等待后续识别归档")
+            # 先复用近似重复邮件的历史判断，再由本地预分类器截留高置信度邮件，仅将无法确定的邮件交由AI
+            with METRICS.timer("stage.near_duplicate"):
+                result_list, remaining_emails = AI_Handler.match_near_duplicate_emails(uncertain_emails)
+            with METRICS.timer("stage.pre_classifier"):
+                local_results, ambiguous_emails = AI_Handler.pre_classify_uncertain_emails(remaining_emails)
+            result_list += local_results
+            METRICS.incr("emails.near_duplicate_or_local", len(result_list))
+            METRICS.incr("emails.ai_classification", len(ambiguous_emails))
             # 交由AI读取其内容并为其进行评分,返回邮件字典-评分的元组的列表
-            result_list = AI_Handler.get_score_for_uncertain_emails(ai_client, uncertain_emails, MODEL_NAME)
+            ai_scored_ids = set()
+            if ambiguous_emails:
+                ai_results = AI_Handler.get_score_for_uncertain_emails(
+                    ai_client, ambiguous_emails, MODEL_NAME, deferred_list=deferred[KIND_RECEIVED]
+                )
+                ai_scored_ids = {id(email) for email in ai_results}
+                result_list += ai_results
 
             count = 0
             # 根据结果字典维护邮件评分文件
@@ -412,7 +599,16 @@ def email_classification(ai_client, in_emails, sent_emails, invalid_output_path=
                     if sender_root not in score_list:
                         score_list[sender_root] = {}
 
-                    if sender_name in score_list[sender_root]:
+                    # 信誉库只记录AI的评分 (近似重复继承与本地预分类的结果不计入，避免本地猜测使发件人变为"可信")，
+                    # 信誉库中有记录的发件人，评分表同步为加权均值 (供优先级估计等使用)
+                    reputation_mean = None
+                    if id(email) in ai_scored_ids:
+                        SENDER_REPUTATION.observe(sender_name, sender_root, email["score"],
+                                                  prior=score_list[sender_root].get(sender_name))
+                        reputation_mean = SENDER_REPUTATION.get_mean(sender_name, sender_root)
+                    if reputation_mean is not None:
+                        score_list[sender_root][sender_name] = int(round(reputation_mean))
+                    elif sender_name in score_list[sender_root]:
                         score_list[sender_root][sender_name] = int(round((score_list[sender_root][sender_name] + email["score"]) / 2))
                     else:
                         score_list[sender_root][sender_name] = email["score"]
@@ -420,11 +616,12 @@ def email_classification(ai_client, in_emails, sent_emails, invalid_output_path=
                     count += 1
 
                 # 将结果重新写入评分表文件
-                with open(SCORE_LIST_PATH, 'w', encoding='utf-8') as f:
+                with METRICS.persist(SCORE_LIST_PATH), open(SCORE_LIST_PATH, 'w', encoding='utf-8') as f:
                     score_output = {"SENDER_INFO_LIST":score_list}
                     json.dump(score_output, f, indent=4, ensure_ascii=False, default=datetime_to_json)
                     print(
                         f"SUCCESS: {count} 条记录被维护到 {SCORE_LIST_PATH}中")
+                SENDER_REPUTATION.save()
 
                 # 进行邮件有效性的区分
                 for email in result_list:
@@ -454,7 +651,7 @@ def email_classification(ai_client, in_emails, sent_emails, invalid_output_path=
                      else datetime.fromisoformat(email['sent_time']))
 
             # 3. 覆盖写入完整列表
-            with open(invalid_output_path, 'w', encoding='utf-8') as f:
+            with METRICS.persist(invalid_output_path), open(invalid_output_path, 'w', encoding='utf-8') as f:
                 json.dump(all_invalid_emails, f, indent=4, ensure_ascii=False, default=datetime_to_json)
                 print(f"SUCCESS: {len(invalid_emails)} 封邮件被标记为无效邮件，写入 {invalid_output_path}")
 
@@ -469,7 +666,16 @@ def email_classification(ai_client, in_emails, sent_emails, invalid_output_path=
 
             if len(need_summarize_list) > 0:
                 # 由于是对数据源的引用，所以更改数据源后所有引用无需手动更新
-                AI_Handler.get_summary_for_emails(ai_client, need_summarize_list, MODEL_NAME)
+                deferred_valid = []
+                AI_Handler.get_summary_for_emails(ai_client, need_summarize_list, MODEL_NAME, deferred_list=deferred_valid)
+
+                # 未能总结的邮件不写入有效邮件，推迟到下一周期重新分类与总结
+                if deferred_valid:
+                    deferred_ids = {id(email) for email in deferred_valid}
+                    valid_emails = [email for email in valid_emails if id(email) not in deferred_ids]
+                    for email in deferred_valid:
+                        email.pop("score", None)
+                    deferred[KIND_RECEIVED].extend(deferred_valid)
 
             # 存储有效邮件
             # 1. 读取现有有效邮件数据
@@ -489,17 +695,25 @@ def email_classification(ai_client, in_emails, sent_emails, invalid_output_path=
                      else datetime.fromisoformat(email['sent_time']))
 
             # 3. 覆盖写入完整列表
-            with open(valid_output_path, 'w', encoding='utf-8') as f:
+            with METRICS.persist(valid_output_path), open(valid_output_path, 'w', encoding='utf-8') as f:
                 json.dump(all_valid_emails, f, indent=4, ensure_ascii=False, default=datetime_to_json)
                 print(f"SUCCESS: {len(valid_emails)} 封邮件被标记为有效邮件，将在处理后写入 {valid_output_path},并用于记忆构成")
 
 
+    METRICS.incr("emails.valid", len(valid_emails))
+    METRICS.incr("emails.invalid", len(invalid_emails))
+
     # 发送邮件处理
     if len(sent_emails) > 0:
         sent_bol = True
         print(f"SUCCESS: {len(sent_emails)} 封已发送邮件将交由AI总结内容")
-        # 交由AI进行总结
-        AI_Handler.get_summary_for_emails(ai_client, sent_emails, MODEL_NAME)
+        # 交由AI进行总结 (未能总结的发信推迟到下一周期)
+        deferred_sent = []
+        AI_Handler.get_summary_for_emails(ai_client, sent_emails, MODEL_NAME, deferred_list=deferred_sent)
+        if deferred_sent:
+            deferred_ids = {id(email) for email in deferred_sent}
+            sent_emails = [email for email in sent_emails if id(email) not in deferred_ids]
+            deferred[KIND_SENT].extend(deferred_sent)
 
         # 存储发送邮件
         all_sent_emails = []
@@ -518,7 +732,7 @@ def email_classification(ai_client, in_emails, sent_emails, invalid_output_path=
         else datetime.fromisoformat(email['sent_time']))
 
         # 覆盖写入完整列表
-        with open(sent_output_path, 'w', encoding='utf-8') as f:
+        with METRICS.persist(sent_output_path), open(sent_output_path, 'w', encoding='utf-8') as f:
             json.dump(all_sent_emails, f, indent=4, ensure_ascii=False, default=datetime_to_json)
             print(f"SUCCESS: {len(sent_emails)} 封发送邮件，将写入 {sent_output_path},并用于记忆构成")
 
@@ -526,27 +740,145 @@ def email_classification(ai_client, in_emails, sent_emails, invalid_output_path=
     return valid_emails, sent_emails
 
 
+# --- 对话历史初始化任务的辅助函数 ---
+def run_with_recovery(run_pass, pending_items):
+    """
+    执行 run_pass(pending_items)，它返回因熔断而被推迟的项。
+    若有推迟，等待熔断器恢复后只对推迟的项重新执行，最多 INIT_MAX_PASSES 轮。
+
+    Returns:
+        list: 最终仍未完成的项。
+    """
+    for current_pass in range(1, INIT_MAX_PASSES + 1):
+        pending_items = run_pass(pending_items)
+        if not pending_items or current_pass == INIT_MAX_PASSES:
+            break
+        controller = AI_Handler.AI_CONTROLLER
+        wait = controller.open_seconds if controller else AI_Handler.BASE_RETRY_DELAY
+        print(f"信息：{len(pending_items)} 项工作因 AI 服务不可用被推迟，{wait} 秒后重试 "
+              f"(第 {current_pass}/{INIT_MAX_PASSES} 轮)...")
+        time_module.sleep(wait)
+
+    if pending_items:
+        print(f"警告：仍有 {len(pending_items)} 项初始化工作未完成。")
+    return pending_items
+
+
+def run_init_conversation_checks(ai_client, emails, checkpoint):
+    """
+    对尚未记录在检查点中的邮件执行 AI 对话筛选，每完成 INIT_CHECKPOINT_CHUNK_SIZE 封写一次检查点。
+
+    Returns:
+        list: 因熔断而被推迟的邮件。
+    """
+    pending = [email for email in emails
+               if not checkpoint.has(STAGE_CONVERSATION_CHECK, get_email_key(email))]
+    if len(pending) < len(emails):
+        print(f"信息：(断点续跑) {len(emails) - len(pending)} 封邮件的对话筛选已完成，跳过。")
+
+    deferred_emails = []
+    for start in range(0, len(pending), INIT_CHECKPOINT_CHUNK_SIZE):
+        chunk = pending[start:start + INIT_CHECKPOINT_CHUNK_SIZE]
+        deferred_chunk = []
+        kept = AI_Handler.get_conversation_constitutes_for_emails(ai_client, chunk, deferred_list=deferred_chunk)
+
+        kept_ids = {id(email) for email in kept}
+        deferred_ids = {id(email) for email in deferred_chunk}
+        checkpoint.record_many(STAGE_CONVERSATION_CHECK, [
+            (get_email_key(email), id(email) in kept_ids) for email in chunk if id(email) not in deferred_ids
+        ])
+        deferred_emails.extend(deferred_chunk)
+        print(f"信息：对话筛选进度 {min(start + len(chunk), len(pending))}/{len(pending)} (已写入检查点)")
+    return deferred_emails
+
+
+def build_init_conversation(ai_client, address, email_list, checkpoint):
+    """
+    为一条对话生成总结与口吻分析。已在检查点中的阶段直接恢复；
+    AI 失败的结果不写入检查点，重启后会重新生成。
+
+    Returns:
+        tuple: (对话结构, 是否有阶段因熔断被推迟)
+    """
+    saved_summary = checkpoint.get(STAGE_SUMMARY, address)
+    saved_style = checkpoint.get(STAGE_STYLE, address)
+
+    if saved_summary is None:
+        conversation = email_list
+    else:
+        conversation = {
+            "general_summary": saved_summary.get("general_summary"),
+            "style_profile": saved_style,
+            "summary_watermark": saved_summary.get("summary_watermark"),
+            "emails": email_list
+        }
+        if saved_summary.get("chunk_summaries"):
+            conversation["chunk_summaries"] = saved_summary["chunk_summaries"]
+        if saved_style is not None:
+            return conversation, False
+
+    # --- 总结与口吻 (均未完成时合并为一次 AI 调用) ---
+    deferred = []
+    result = AI_Handler.get_summary_and_style_for_conversation(
+        ai_client, {address: conversation}, deferred_list=deferred,
+        summary_addresses={address} if saved_summary is None else set(),
+        style_addresses={address} if saved_style is None else set()
+    )
+    conversation = result.get(address, {"general_summary": None, "style_profile": None, "emails": email_list})
+
+    if saved_summary is None:
+        summary = conversation.get("general_summary")
+        if not deferred and summary and not str(summary).startswith("AI处理失败"):
+            checkpoint.record(STAGE_SUMMARY, address, {
+                "general_summary": summary,
+                "summary_watermark": conversation.get("summary_watermark"),
+                "chunk_summaries": conversation.get("chunk_summaries")
+            })
+
+    if saved_style is None:
+        style_profile = conversation.get("style_profile") or {}
+        if not deferred and "error" not in style_profile:
+            checkpoint.record(STAGE_STYLE, address, style_profile)
+    else:
+        conversation["style_profile"] = saved_style
+
+    return conversation, bool(deferred)
+
+
 # --- 根据历史邮件构建对话历史 ---
 def init_conversation_history(ai_client, all_valid_emails_path=VALID_MAIL_OUTPUT_PATH,
-                              all_sent_emails_path=SENT_MAIL_OUTPUT_PATH, memory_file_path=CONVERSATION_MEMORY_PATH):
+                              all_sent_emails_path=SENT_MAIL_OUTPUT_PATH, memory_file_path=CONVERSATION_MEMORY_PATH,
+                              checkpoint_path=INIT_CHECKPOINT_PATH):
     print("\n//////////////////对话历史初始化...//////////////////")
 
     # --- 1. (约束检查) ---
+    # (存在检查点说明上次初始化未完成，从断点继续)
+    checkpoint = InitCheckpoint(checkpoint_path)
     if os.path.exists(memory_file_path):
         try:
             if os.path.getsize(memory_file_path) > 10:
                 with open(memory_file_path, 'r', encoding='utf-8') as f:
                     content = json.load(f)
                 if content:
+                    if checkpoint.exists:
+                        # (上次初始化已保存对话历史，但未来得及删除检查点)
+                        checkpoint.clear()
                     print(f"信息：对话历史文件 {memory_file_path} 已存在且不为空。终止初始化。")
                     print("//////////////////对话历史初始化终止。//////////////////\n")
                     return
         except Exception as e:
-            print(f"警告：对话历史文件 {memory_file_path} 存在但无法解析({e})。终止初始化。")
-            print("//////////////////对话历史初始化终止。//////////////////\n")
-            return
-
-    print(f"信息：对话历史文件为空，开始从历史邮件构建...")
+            if not checkpoint.exists:
+                print(f"警告：对话历史文件 {memory_file_path} 存在但无法解析({e})。终止初始化。")
+                print("//////////////////对话历史初始化终止。//////////////////\n")
+                return
+            print(f"警告：对话历史文件 {memory_file_path} 无法解析({e})，但存在未完成的初始化检查点，将继续初始化。")
+
+    if checkpoint.exists:
+        print(f"信息：检测到未完成的初始化检查点，从断点继续 (已完成: 对话筛选 "
+              f"{checkpoint.count(STAGE_CONVERSATION_CHECK)} 封，总结 {checkpoint.count(STAGE_SUMMARY)} 条，"
+              f"口吻 {checkpoint.count(STAGE_STYLE)} 条)...")
+    else:
+        print(f"信息：对话历史文件为空，开始从历史邮件构建...")
 
     # --- 2. 加载所有历史邮件 ---
     try:
@@ -582,8 +914,11 @@ def init_conversation_history(ai_client, all_valid_emails_path=VALID_MAIL_OUTPUT
     # --- 4. (格式化收信) ---
     formatted_valid_emails = []
     if len(all_valid_emails) > 0:
+        # 评分表中已有评分的发件人 (如订阅的邮件列表) 不因群发类头部规则被排除
+        score_index = load_score_index()
         for email in all_valid_emails:
-            if any(pattern in email.get("sender_name", "").lower() for pattern in NO_REPLY_PATTERN):
+            listed = score_index.lookup(email.get("sender_name", ""), email.get("sender_root", "")) is not None
+            if HEADER_RULE_ENGINE.excludes_conversation(email, listed):
                 continue
             sender_addr = email.get("sender_name", "unknown") + "@" + email.get("sender_root", "unknown.com")
             if not sender_addr or sender_addr == "unknown@unknown.com":
@@ -612,13 +947,23 @@ def init_conversation_history(ai_client, all_valid_emails_path=VALID_MAIL_OUTPUT
     # --- 6. (慢速通道) 运行 AI 清洗 ---
     if emails_to_filter_slow:
         print(f"信息：正在提交 {len(emails_to_filter_slow)} 封新邮件到 AI 进行内容清洗...")
-        print("(这可能需要很长时间，取决于邮件数量...)")
+        print("(这可能需要很长时间，取决于邮件数量；进度会写入检查点，中断后重启可继续...)")
 
-        filtered_new_emails = AI_Handler.get_conversation_constitutes_for_emails(
-            ai_client, emails_to_filter_slow
+        deferred_conversation = run_with_recovery(
+            lambda pending: run_init_conversation_checks(ai_client, pending, checkpoint),
+            emails_to_filter_slow
         )
+        filtered_new_emails = [
+            email for email in emails_to_filter_slow
+            if checkpoint.get(STAGE_CONVERSATION_CHECK, get_email_key(email)) is True
+        ]
         print(f"信息：AI 清洗完成，{len(filtered_new_emails)} 封邮件被确认为新对话。")
         emails_to_add_fast.extend(filtered_new_emails)
+
+        # 未能筛选的邮件进入工作队列，交由之后的对话历史维护处理
+        if deferred_conversation:
+            AI_WORK_QUEUE.push(KIND_CONVERSATION, deferred_conversation, make_priority_func())
+            AI_WORK_QUEUE.save()
     else:
         print("信息：没有需要 AI 清洗的邮件。")
 
@@ -643,6 +988,11 @@ def init_conversation_history(ai_client, all_valid_emails_path=VALID_MAIL_OUTPUT
 
     print(f"信息：归档完成。总共添加了 {new_email_added_count} 封邮件到 {len(all_memory)} 条对话中。")
 
+    # (向量索引: 为所有对话中的邮件建立索引，已索引的邮件会被跳过)
+    AI_Handler.index_conversation_emails(
+        [(address, email) for address, email_list in all_memory.items() for email in email_list]
+    )
+
     # --- 8. (排序、生成总结/口吻并保存) ---
     print("信息：正在对所有对话进行时间排序...")
     for email_list in all_memory.values():
@@ -652,29 +1002,45 @@ def init_conversation_history(ai_client, all_valid_emails_path=VALID_MAIL_OUTPUT
         except Exception as e:
             print(f"警告：对话 {e} 排序失败。")
 
-    print("信息：调用AI为所有对话生成总体总结...")
-    memory_with_summaries = AI_Handler.get_history_summary_for_conversation(ai_client, all_memory)
+    # (每条对话的总结与口吻分析作为一个任务，多条对话并发执行；已完成的阶段从检查点恢复)
+    print("信息：调用AI为所有对话生成总体总结与口吻分析...")
+    final_memory_structure = {}
 
-    # (修改点 2: 将上一步的结果 传入 第二个 AI 函数)
-    print("信息：调用AI为所有对话生成口吻分析...")
-    final_memory_structure = AI_Handler.get_style_profile_for_conversation(ai_client, memory_with_summaries)
+    def build_pending_conversations(pending_addresses):
+        deferred_addresses = []
+        results = AI_Handler.map_ai_tasks(
+            lambda address: build_init_conversation(ai_client, address, all_memory[address], checkpoint),
+            pending_addresses
+        )
+        for address, (conversation, deferred) in zip(pending_addresses, results):
+            final_memory_structure[address] = conversation
+            if deferred:
+                deferred_addresses.append(address)
+        return deferred_addresses
+
+    run_with_recovery(build_pending_conversations, list(all_memory.keys()))
 
     print(f"信息：AI 分析与数据结构合并完成。")
 
     # (修改点 3: 保存)
+    # (先写入临时文件再替换，避免中断时留下不完整的对话历史文件)
     try:
-        with open(memory_file_path, 'w', encoding='utf-8') as f:
+        temp_path = memory_file_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
             # (保存最终的、包含总结和口吻的完整结构)
             json.dump(final_memory_structure, f, ensure_ascii=False, indent=2, default=datetime_to_json)
+        os.replace(temp_path, memory_file_path)
+        checkpoint.clear()
         print(f"信息：对话历史已成功初始化并保存到 {memory_file_path}")
     except Exception as e:
-        print(f"错误：保存对话历史文件失败 ({e})")
+        print(f"错误：保存对话历史文件失败 ({e})，检查点已保留，重启后可继续。")
 
     print("//////////////////对话历史初始化完成。//////////////////\n")
 
 
 # --- 根据获取的有效邮件维护对话历史 ---
-def maintain_conversation_history(ai_client, valid_emails, sent_emails, memory_file_path=CONVERSATION_MEMORY_PATH):
+def maintain_conversation_history(ai_client, valid_emails, sent_emails, memory_file_path=CONVERSATION_MEMORY_PATH,
+                                  deferred=None):
     # 步骤：
     # 1. 读取对话历史 (修正)
     # 2. (发信优先) 格式化 sent_emails
@@ -684,12 +1050,18 @@ def maintain_conversation_history(ai_client, valid_emails, sent_emails, memory_f
     # 6. (慢速通道) 运行 AI 清洗
     # 7. (归档) (修正) *内联* 新的归档逻辑
     # 8. (排序) (修正) 排序新结构
-    # 9. (总结与口吻) (实现) *仅* 为 'updated_addresses' 调用 AI 管道
+    # 9. (总结与口吻) (实现) 标记过期产物，*仅* 为到期的对话调用 AI 管道
     # 10. (保存)
+    # deferred: (可选) new_work_batch() 结构，熔断或时间预算耗尽时未能筛选的邮件会追加到其 "conversation" 中
+    if deferred is None:
+        deferred = new_work_batch()
 
     if not (valid_emails or sent_emails):
-        print("无可用于对话历史维护的邮件")
-        return
+        if not RECOMPUTE_SCHEDULER.has_due_work():
+            print("无可用于对话历史维护的邮件")
+            return
+        print("无新增邮件，检查到期的对话总结/口吻重算...")
+        valid_emails, sent_emails = [], []
     print("\n//////////////////开始对话历史维护...//////////////////")
 
     # --- 1. 读取对话历史记录 (修正) ---
@@ -704,13 +1076,14 @@ def maintain_conversation_history(ai_client, valid_emails, sent_emails, memory_f
         print(f"警告：读取现有对话历史文件失败 ({e})，将从零开始构建。")
         all_memory = {}
 
+    # (IMAP 编号在收件箱与发件箱之间会重复，按 类型:编号:发送时间 判断邮件是否已归档)
     existing_ids = set()
     for convo_data in all_memory.values():
         if isinstance(convo_data, dict):
             email_list = convo_data.get("emails", [])
             for email in email_list:
                 if email and email.get("id"):
-                    existing_ids.add(email.get("id"))
+                    existing_ids.add(get_email_key(email))
 
     existing_addresses_from_memory = set(all_memory.keys())
     print(f"信息：已加载 {len(existing_ids)} 个邮件ID 和 {len(existing_addresses_from_memory)} 条已有对话。")
@@ -721,7 +1094,7 @@ def maintain_conversation_history(ai_client, valid_emails, sent_emails, memory_f
 
     if len(sent_emails) > 0:
         for email in sent_emails:
-            if email.get("id") and email.get("id") in existing_ids:
+            if email.get("id") and get_email_key(email) in existing_ids:
                 continue
             receivers = email.get("receiver")
             if not isinstance(receivers, list) or not receivers:
@@ -739,10 +1112,17 @@ def maintain_conversation_history(ai_client, valid_emails, sent_emails, memory_f
     # --- 4. (格式化收信) 处理 valid_emails ---
     formatted_valid_emails = []
     if len(valid_emails) > 0:
+        # 评分表中已有评分的发件人 (如订阅的邮件列表) 不因群发类头部规则被排除
+        score_index = load_score_index()
         for email in valid_emails:
-            if email.get("id") and email.get("id") in existing_ids:
+            if email.get("id") and get_email_key(email) in existing_ids:
+                continue
+            if "sender_name" not in email and email.get("sender"):
+                # (已格式化: 上一周期推迟的对话筛选邮件)
+                formatted_valid_emails.append(email)
                 continue
-            if any(pattern in email.get("sender_name", "").lower() for pattern in NO_REPLY_PATTERN):
+            listed = score_index.lookup(email.get("sender_name", ""), email.get("sender_root", "")) is not None
+            if HEADER_RULE_ENGINE.excludes_conversation(email, listed):
                 continue
 
             sender_addr = email.get("sender_name", "unknown") + "@" + email.get("sender_root", "unknown.com")
@@ -774,7 +1154,7 @@ def maintain_conversation_history(ai_client, valid_emails, sent_emails, memory_f
     if emails_to_filter_slow:
         print(f"信息：正在提交 {len(emails_to_filter_slow)} 封新邮件到 AI 进行内容清洗...")
         filtered_new_emails = AI_Handler.get_conversation_constitutes_for_emails(
-            ai_client, emails_to_filter_slow
+            ai_client, emails_to_filter_slow, deferred_list=deferred[KIND_CONVERSATION]
         )
         print(f"信息：AI 清洗完成，{len(filtered_new_emails)} 封邮件被确认为新对话。")
         emails_to_add_fast.extend(filtered_new_emails)
@@ -785,6 +1165,8 @@ def maintain_conversation_history(ai_client, valid_emails, sent_emails, memory_f
     new_email_added_count = 0
     addresses_that_were_updated = set()
     processed_email_ids_in_this_run = set(existing_ids)  # (修正：使用 existing_ids 初始化)
+    now = RECOMPUTE_SCHEDULER.now()
+    archived_pairs = []  # (对话地址, 邮件)，用于增量更新向量索引
 
     for email in emails_to_add_fast:
         email_id = email.get("id")
@@ -812,18 +1194,33 @@ def maintain_conversation_history(ai_client, valid_emails, sent_emails, memory_f
                     "style_profile": None,  # (为新对话添加占位符)
                     "emails": []
                 }
+                # (新对话立即生成总结与口吻)
+                RECOMPUTE_SCHEDULER.mark_stale(all_memory[address], ARTIFACT_SUMMARY, "new_conversation", 0, now)
+                RECOMPUTE_SCHEDULER.mark_stale(all_memory[address], ARTIFACT_STYLE, "new_conversation", 0, now)
 
             all_memory[address]["emails"].append(email)
             addresses_that_were_updated.add(address)
+            archived_pairs.append((address, email))
 
-        if email_id and email_id not in processed_email_ids_in_this_run:
+            # (标记过期产物: 总结依赖所有邮件，口吻只依赖 sent 邮件)
+            RECOMPUTE_SCHEDULER.mark_stale(all_memory[address], ARTIFACT_SUMMARY, email_type, 1, now)
+            if email_type == "sent":
+                RECOMPUTE_SCHEDULER.mark_stale(all_memory[address], ARTIFACT_STYLE, email_type, 1, now)
+
+        if email_id and get_email_key(email) not in processed_email_ids_in_this_run:
             new_email_added_count += 1
-            processed_email_ids_in_this_run.add(email_id)
+            processed_email_ids_in_this_run.add(get_email_key(email))
         elif not email_id:
             new_email_added_count += 1
 
     print(
         f"信息：归档完成。总共添加了 {new_email_added_count} 封新邮件 (分布在 {len(addresses_that_were_updated)} 个对话中)。")
+    METRICS.incr("emails.archived", new_email_added_count)
+    METRICS.incr("emails.conversation_check", len(emails_to_filter_slow))
+
+    # (向量索引: 首次启用时从已有对话记忆构建，之后只增量加入新归档的邮件)
+    AI_Handler.bootstrap_embedding_index(all_memory)
+    AI_Handler.index_conversation_emails(archived_pairs)
 
     # --- 8. (排序) ---
     print("信息：正在对所有受影响的对话进行时间排序...")
@@ -838,42 +1235,51 @@ def maintain_conversation_history(ai_client, valid_emails, sent_emails, memory_f
                     print(f"警告：对话 {address} 排序失败: {e}")
 
     # --- 9. (总结与口吻分析) (修改点) ---
-    if addresses_that_were_updated:
-        print(f"信息：检测到 {len(addresses_that_were_updated)} 条对话有更新，准备调用AI分析管道...")
-
-        # (实现点: 只构建需要更新的子集)
-        memory_to_update = {}
-        for address in addresses_that_were_updated:
-            if address in all_memory:  # (安全检查)
-                memory_to_update[address] = all_memory[address]
-
-        # --- (AI Pipeline Step 1: 更新总结) ---
-        print("  -> (AI Pipeline 1/2) 正在更新对话总结...")
-        memory_with_updated_summaries = AI_Handler.get_history_summary_for_conversation(
-            ai_client, memory_to_update
+    # (由调度器合并多次变更，只为到期的对话重算；口吻仅在有新的 sent 邮件时重算)
+    due = RECOMPUTE_SCHEDULER.collect_due(all_memory, now)
+    summary_due = due[ARTIFACT_SUMMARY]
+    style_due = due[ARTIFACT_STYLE]
+
+    if summary_due or style_due:
+        print(f"信息：{len(addresses_that_were_updated)} 条对话有更新，其中 {len(summary_due)} 条总结、"
+              f"{len(style_due)} 条口吻到期，准备调用AI分析管道...")
+
+        # --- (AI Pipeline: 更新总结与口吻，两者同时到期的对话合并为一次 AI 调用) ---
+        print("  -> (AI Pipeline) 正在更新对话总结与口吻分析...")
+        profile_due = list(dict.fromkeys(list(summary_due) + list(style_due)))
+        METRICS.incr("conversations.profile_due", len(profile_due))
+        deferred_addresses = []
+        updated_conversations = AI_Handler.get_summary_and_style_for_conversation(
+            ai_client, {address: all_memory[address] for address in profile_due},
+            deferred_list=deferred_addresses, summary_addresses=set(summary_due), style_addresses=set(style_due)
         )
-        print("  -> AI 总结更新完毕。")
-
-        # --- (AI Pipeline Step 2: 更新口吻) ---
-        print("  -> (AI Pipeline 2/2) 正在更新口吻分析...")
-        # (将上一步的结果传入，确保口吻分析函数能保留更新后的总结)
-        final_updated_conversations = AI_Handler.get_style_profile_for_conversation(
-            ai_client, memory_with_updated_summaries
-        )
-        print("  -> AI 口吻分析更新完毕。")
+        for address, conversation in updated_conversations.items():
+            # (被推迟的对话保留过期状态，下次维护时重试)
+            if address in deferred_addresses:
+                continue
+            if address in summary_due:
+                RECOMPUTE_SCHEDULER.clear(conversation, ARTIFACT_SUMMARY)
+            if address in style_due:
+                RECOMPUTE_SCHEDULER.clear(conversation, ARTIFACT_STYLE)
+        if deferred_addresses:
+            RECOMPUTE_SCHEDULER.next_due_time = None  # (下个周期即使没有新邮件也重新检查)
+        all_memory.update(updated_conversations)
+        print("  -> AI 总结与口吻分析更新完毕。")
 
-        # --- (AI Pipeline Step 3: 合并最终结果) ---
-        # (final_updated_conversations 包含了 "general_summary", "style_profile", "emails")
-        all_memory.update(final_updated_conversations)
         print("信息：AI 分析结果已合并。")
 
+    elif addresses_that_were_updated:
+        print(f"信息：{len(addresses_that_were_updated)} 条对话有更新，总结/口吻重算尚未到期，将合并到后续周期。")
     else:
         print("信息：没有检测到需要更新的对话总结。")
+        if not (valid_emails or sent_emails):
+            print("//////////////////对话历史维护完成。//////////////////\n")
+            return
     # --- (修改结束) ---
 
     # --- 10. (保存) ---
     try:
-        with open(memory_file_path, 'w', encoding='utf-8') as f:
+        with METRICS.persist(memory_file_path), open(memory_file_path, 'w', encoding='utf-8') as f:
             json.dump(all_memory, f, ensure_ascii=False, indent=2, default=datetime_to_json)
         print(f"信息：对话历史已成功保存到 {memory_file_path}")
     except Exception as e:
@@ -882,19 +1288,194 @@ def maintain_conversation_history(ai_client, valid_emails, sent_emails, memory_f
     print("//////////////////对话历史维护完成。//////////////////\n")
 
 
+# --- 按优先级处理一批 AI 工作 ---
+def process_work(ai_client, work, priority_func, deferred):
+    """
+    紧急工作与其余工作分为两批，各自依次走完整流程 (分类 → 总结 → 对话维护)。
+    未完成的工作追加到 deferred 中。
+
+    Returns:
+        (valid_emails, sent_emails)
+    """
+    urgent_work, normal_work = new_work_batch(), new_work_batch()
+    for kind, emails in work.items():
+        for email in emails:
+            (urgent_work if priority_func(email) >= URGENT_PRIORITY else normal_work)[kind].append(email)
+
+    valid_emails, sent_emails = [], []
+    for tier in (urgent_work, normal_work):
+        if not any(tier.values()):
+            continue
+        # 对邮件分类存储后获取经过总结的有效邮件和发送的邮件列表
+        with METRICS.timer("stage.classification"):
+            tier_valid_emails, tier_sent_emails = email_classification(
+                ai_client, tier[KIND_RECEIVED], tier[KIND_SENT], deferred=deferred
+            )
+
+        # 遍历有效邮件查看是否构成对话,若构成则检查对话历史,若存在则完善对话过程,不存在则建立新的对话历史
+        with METRICS.timer("stage.conversation"):
+            maintain_conversation_history(ai_client, tier[KIND_CONVERSATION] + tier_valid_emails, tier_sent_emails,
+                                          deferred=deferred)
+        valid_emails.extend(tier_valid_emails)
+        sent_emails.extend(tier_sent_emails)
+    return valid_emails, sent_emails
+
+
 # --- 周期获取新增邮件并解析处理 ---
 def auto_process(mclient, ai_client):
+    if PIPELINE_ENABLED:
+        return auto_process_pipelined(mclient, ai_client)
+
     # 获取邮箱未读邮件
     fetched_in_emails = fetch_unseen_emails(mclient)
 
     # 获取邮箱发送邮件
     fetched_sent_emails = fetch_sent_emails(mclient)
+    POLL_SCHEDULER.record_arrivals(len(fetched_in_emails) + len(fetched_sent_emails))
+
+    # 新邮件按优先级入队并立即落盘，与上一周期遗留的工作一起按优先级取出
+    # (评分高的已知发件人、已知对话伙伴、头部标记为重要或主题紧急的邮件优先交由AI处理)
+    priority_func = make_priority_func()
+    AI_WORK_QUEUE.push(KIND_RECEIVED, fetched_in_emails, priority_func)
+    AI_WORK_QUEUE.push(KIND_SENT, fetched_sent_emails, priority_func)
+    AI_WORK_QUEUE.save()
+    work = AI_WORK_QUEUE.peek_all()
+
+    # 本周期的 AI 时间预算，耗尽后剩余工作留待下一周期，保证轮询节奏稳定
+    AI_Handler.start_cycle_budget(CYCLE_TIME_BUDGET_SECONDS)
+    try:
+        valid_emails, sent_emails = run_queued_work(ai_client, work, priority_func)
+    finally:
+        AI_Handler.end_cycle_budget()
+
+    if len(AI_WORK_QUEUE):
+        print(f"信息：{len(AI_WORK_QUEUE)} 项 AI 工作推迟到下一周期，已写入 {AI_WORK_QUEUE_PATH}")
+
+    return valid_emails, sent_emails
+
+
+# --- 处理一批已在工作队列中的工作 ---
+def run_queued_work(ai_client, work, priority_func):
+    """
+    处理期间工作保留在 AI_WORK_QUEUE 中 (内存与文件，处理出错或中途崩溃时不丢失，下一周期重试)，
+    处理完成后移除，未完成的部分重新入队并落盘。
+    """
+    deferred = new_work_batch()
+    result = process_work(ai_client, work, priority_func, deferred)
+
+    AI_WORK_QUEUE.remove([email for emails in work.values() for email in emails])
+    for kind, emails in deferred.items():
+        AI_WORK_QUEUE.push(kind, emails, priority_func)
+    AI_WORK_QUEUE.save()
+    return result
+
+
+# --- 流水线模式：抓取 → 解析 → 分类/AI/落盘 三段重叠执行 ---
+def auto_process_pipelined(mclient, ai_client, in_json_file_path=IN_RAWDATA_OUTPUT_PATH,
+                           sent_json_file_path=SENT_RAWDATA_OUTPUT_PATH):
+    """
+    与 auto_process 结果相同，但各阶段通过有界队列重叠执行：
+    - 抓取线程：通过 IMAP 逐封下载 (IMAP 连接只在此线程中使用)，先下载新增发信 (跳过已保存的 ID)，再下载未读收信。
+    - 解析线程：MIME 解析、HTML 提取、头部解析。
+    - 当前线程：每凑满 PIPELINE_BATCH_SIZE 封 (或等待超过 PIPELINE_BATCH_WAIT_SECONDS) 即写入原始数据、入队落盘，
+      将该批收信标记为已读，再走完分类 → 总结 → 对话维护的完整流程；此时抓取与解析在后台继续进行。
+    发信先于收信抓取，使后续批次的收信可按已知对话伙伴直接归档。
+    收信只在落盘后才标记为已读：流水线出错时仍在队列中的邮件保持未读，下一周期重新抓取，不会丢失。
+    """
+    priority_func = make_priority_func()
+    saved_sent_ids = get_saved_email_ids(sent_json_file_path)
+    # 抓取线程与当前线程 (标记已读) 共用同一个 IMAP 连接，命令之间以锁串行
+    imap_lock = threading.Lock()
+
+    def locked_imap_call(command, *args):
+        with imap_lock:
+            return imap_call(mclient, command, *args)
 
-    # 对邮件分类存储后获取经过总结的有效邮件和发送的邮件列表
-    valid_emails, sent_emails = email_classification(ai_client, fetched_in_emails, fetched_sent_emails)
+    def locked_fetch(email_id):
+        with imap_lock:
+            return fetch_raw_message(mclient, email_id)
 
-    # 遍历有效邮件查看是否构成对话,若构成则检查对话历史,若存在则完善对话过程,不存在则建立新的对话历史
-    maintain_conversation_history(ai_client, valid_emails, sent_emails)
+    def produce(emit):
+        # 1. 新增的已发送邮件
+        try:
+            locked_imap_call('select', 'Sent')
+            status, email_ids = locked_imap_call('search', None, 'ALL')
+            for email_id in email_ids[0].split():
+                if email_id.decode() in saved_sent_ids:
+                    continue
+                raw_message = locked_fetch(email_id)
+                if not emit((KIND_SENT, email_id, raw_message)):
+                    return
+        except mclient.error:
+            print("警告：无法选择 'Sent' 文件夹。请检查您的邮箱服务商是否使用了其他名称（如 'Sent Items'）。")
+
+        # 2. 未读邮件 (落盘后由当前线程标记为已读；此后不再切换文件夹，标记作用于收件箱)
+        locked_imap_call('select', 'inbox')
+        status, email_ids = locked_imap_call('search', None, 'UNSEEN')
+        for email_id in email_ids[0].split():
+            raw_message = locked_fetch(email_id)
+            if not emit((KIND_RECEIVED, email_id, raw_message)):
+                return
+
+    def parse(item):
+        kind, email_id, raw_message = item
+        if kind == KIND_SENT:
+            return parse_sent_email(email_id, raw_message)
+        return parse_received_email(email_id, raw_message)
+
+    pipeline = StreamPipeline(produce, [parse], queue_size=PIPELINE_QUEUE_SIZE)
+    # 上一周期遗留的工作 (保留在队列中直到处理完成)
+    leftover_work = AI_WORK_QUEUE.peek_all()
+
+    # 本周期的 AI 时间预算，耗尽后剩余工作留待下一周期，保证轮询节奏稳定
+    AI_Handler.start_cycle_budget(CYCLE_TIME_BUDGET_SECONDS)
+    valid_emails, sent_emails = [], []
+    fetched_counts = {KIND_RECEIVED: 0, KIND_SENT: 0}
+    try:
+        pipeline.start()
+
+        # 抓取进行的同时先处理遗留工作
+        if any(leftover_work.values()):
+            batch_valid_emails, batch_sent_emails = run_queued_work(ai_client, leftover_work, priority_func)
+            valid_emails.extend(batch_valid_emails)
+            sent_emails.extend(batch_sent_emails)
+
+        for batch in pipeline.iter_batches(PIPELINE_BATCH_SIZE, PIPELINE_BATCH_WAIT_SECONDS):
+            work = new_work_batch()
+            for email in batch:
+                work[email['type']].append(email)
+
+            # 原始数据落盘
+            if work[KIND_RECEIVED]:
+                save_raw_emails(work[KIND_RECEIVED], in_json_file_path)
+            if work[KIND_SENT]:
+                work[KIND_SENT] = save_raw_emails(work[KIND_SENT], sent_json_file_path, skip_existing=True)
+            fetched_counts[KIND_RECEIVED] += len(work[KIND_RECEIVED])
+            fetched_counts[KIND_SENT] += len(work[KIND_SENT])
+            POLL_SCHEDULER.record_arrivals(len(work[KIND_RECEIVED]) + len(work[KIND_SENT]))
+            depths = pipeline.depths()
+            METRICS.set_gauge("pipeline.fetched_depth", depths[0])
+            METRICS.set_gauge("pipeline.parsed_depth", depths[-1])
+            print(f"信息：(流水线) 取得一批 {len(work[KIND_RECEIVED])} 封收信、{len(work[KIND_SENT])} 封发信，"
+                  f"队列积压 {depths}")
+
+            # 新邮件按优先级入队并立即落盘，随后走完整流程
+            AI_WORK_QUEUE.push(KIND_RECEIVED, work[KIND_RECEIVED], priority_func)
+            AI_WORK_QUEUE.push(KIND_SENT, work[KIND_SENT], priority_func)
+            AI_WORK_QUEUE.save()
+            for email in work[KIND_RECEIVED]:
+                locked_imap_call('store', email['id'], '+FLAGS', '\\Seen')
+            batch_valid_emails, batch_sent_emails = run_queued_work(ai_client, work, priority_func)
+            valid_emails.extend(batch_valid_emails)
+            sent_emails.extend(batch_sent_emails)
+    finally:
+        pipeline.close()
+        AI_Handler.end_cycle_budget()
+
+    print(f"信息：(流水线) 本周期共抓取 {fetched_counts[KIND_RECEIVED]} 封未读邮件、"
+          f"{fetched_counts[KIND_SENT]} 封新增的已发送邮件，并写入到 {in_json_file_path} / {sent_json_file_path}")
+    if len(AI_WORK_QUEUE):
+        print(f"信息：{len(AI_WORK_QUEUE)} 项 AI 工作推迟到下一周期，已写入 {AI_WORK_QUEUE_PATH}")
 
     return valid_emails, sent_emails
 
@@ -903,37 +1484,62 @@ def auto_process(mclient, ai_client):
 def start_auto_process_loop(ai_client, stop_event, interval_seconds=600):
     """
     周期性地运行 auto_process 函数，直到 stop_event 被设置。
+    启用自适应轮询 (POLLING.ENABLED) 时，间隔由 POLL_SCHEDULER 根据来信速率与积压工作决定，
+    interval_seconds 仅在未启用时使用。
     """
 
     while not stop_event.is_set():
         mclient = None
+        failed = False
+        cycle_started_at = time_module.monotonic()
+        since_last_cycle = POLL_SCHEDULER.start_cycle(cycle_started_at)
+        cycle_id = METRICS.start_cycle()
         print(f"\n[{time_module.strftime('%Y-%m-%d %H:%M:%S')}] 开始执行自动流程...")
 
-        try:
-            mclient = connect_and_login_email()
-
-            auto_process(mclient, ai_client)
+        # (预约了性能分析时对本周期进行 cProfile + tracemalloc 分析，未预约时没有额外开销)
+        with CYCLE_PROFILER.profile_cycle(cycle_id):
+            try:
+                mclient = connect_and_login_email()
 
-            print(f"[{time_module.strftime('%Y-%m-%d %H:%M:%S')}] 流程执行完毕。")
+                auto_process(mclient, ai_client)
 
+                print(f"[{time_module.strftime('%Y-%m-%d %H:%M:%S')}] 流程执行完毕。")
 
-        except Exception as e:
-            print(f"错误：在 auto_process 期间发生意外错误: {e}")
 
-        finally:
-            # --- (关键修改 2) ---
-            # 3. 无论成功还是失败, 都在循环结束时登出
-            if mclient:
-                print("  -> 正在从 IMAP 服务器登出...")
-                try:
-                    mclient.logout()
-                except Exception as logout_e:
-                    print(f"  -> 警告：登出时发生错误: {logout_e}")
-            mclient = None
+            except Exception as e:
+                failed = True
+                print(f"错误：在 auto_process 期间发生意外错误: {e}")
+
+            finally:
+                # --- (关键修改 2) ---
+                # 3. 无论成功还是失败, 都在循环结束时登出
+                if mclient:
+                    print("  -> 正在从 IMAP 服务器登出...")
+                    try:
+                        mclient.logout()
+                    except Exception as logout_e:
+                        print(f"  -> 警告：登出时发生错误: {logout_e}")
+                mclient = None
+
+        if POLL_SCHEDULER.enabled:
+            interval = POLL_SCHEDULER.finish_cycle(since_last_cycle, backlog=len(AI_WORK_QUEUE), failed=failed)
+            wait_seconds = POLL_SCHEDULER.wait_seconds(time_module.monotonic() - cycle_started_at)
+            print(f"  -> 来信速率约 {POLL_SCHEDULER.rate * 60:.2f} 封/分钟，轮询间隔调整为 {interval:.0f} 秒，"
+                  f"下次执行将在 {wait_seconds:.0f} 秒后...")
+        else:
+            interval = wait_seconds = interval_seconds
+            print(f"  -> 下次执行将在 {interval_seconds} 秒后...")
 
-        print(f"  -> 下次执行将在 {interval_seconds} 秒后...")
+        # 输出本周期的结构化报告 (Info/metrics/cycle_report.jsonl)
+        METRICS.set_gauge("work_queue_depth", len(AI_WORK_QUEUE))
+        if METRICS.enabled:
+            CYCLE_REPORTER.write(METRICS.end_cycle(
+                status="failed" if failed else "ok",
+                arrivals=POLL_SCHEDULER.cycle_arrivals,
+                next_interval_seconds=round(interval, 1)
+            ))
 
-        interrupted = stop_event.wait(timeout=interval_seconds)
+        interrupted = stop_event.wait(timeout=wait_seconds)
 
         if interrupted:
             break
@@ -941,9 +1547,89 @@ def start_auto_process_loop(ai_client, stop_event, interval_seconds=600):
     print("自动处理循环已收到停止信号，即将退出。")
 
 
+def get_store_sizes():
+    """各数据文件当前的大小 (字节)，不存在的文件不计入。"""
+    store_paths = {
+        "inbox_data": IN_RAWDATA_OUTPUT_PATH,
+        "sentbox_data": SENT_RAWDATA_OUTPUT_PATH,
+        "valid_emails": VALID_MAIL_OUTPUT_PATH,
+        "invalid_emails": INVALID_MAIL_OUTPUT_PATH,
+        "sent_emails": SENT_MAIL_OUTPUT_PATH,
+        "conversation_memory": CONVERSATION_MEMORY_PATH,
+        "score_list": SCORE_LIST_PATH,
+        "sender_reputation": SENDER_REPUTATION_PATH,
+        "judgment_record": AI_Handler.JUDGMENT_RECORD_PATH,
+        "work_queue": AI_WORK_QUEUE_PATH
+    }
+    sizes = {}
+    for name, path in store_paths.items():
+        try:
+            sizes[name] = os.path.getsize(path)
+        except OSError:
+            continue
+    return sizes
+
+
+def get_status_metrics():
+    """状态接口 /metrics 的内容：累计指标 + 当前的队列深度、轮询间隔、上一周期耗时与数据文件大小。"""
+    snapshot = METRICS.snapshot()
+    last_report = snapshot["last_report"] or {}
+    gauges = {
+        "work_queue_depth": len(AI_WORK_QUEUE),
+        "poll_interval_seconds": POLL_SCHEDULER.interval if POLL_SCHEDULER.enabled else POLL_SCHEDULER.base_interval,
+        "arrival_rate_per_minute": POLL_SCHEDULER.rate * 60,
+        "cycle_id": snapshot["cycle_id"],
+        "cycle_running_seconds": snapshot["cycle_running_seconds"] or 0,
+        "last_cycle_seconds": last_report.get("wall_seconds"),
+        "last_cycle_failed": 1 if last_report.get("status") == "failed" else 0
+    }
+    for name, size in get_store_sizes().items():
+        gauges[f"store_bytes.{name}"] = size
+    return render_prometheus(snapshot, gauges)
+
+
+def get_daemon_status(process_thread=None):
+    """
+    状态接口 /ready 的内容。以下情况视为未就绪:
+    - 处理循环线程已退出；
+    - 当前周期运行超过 STUCK_CYCLE_SECONDS (疑似卡住)；
+    - 上一周期因异常中断。
+    """
+    snapshot = METRICS.snapshot()
+    last_report = snapshot["last_report"] or {}
+    loop_alive = process_thread.is_alive() if process_thread is not None else True
+    running_seconds = snapshot["cycle_running_seconds"]
+    stuck = running_seconds is not None and running_seconds > STUCK_CYCLE_SECONDS
+    last_failed = last_report.get("status") == "failed"
+
+    return {
+        "ready": loop_alive and not stuck and not last_failed,
+        "loop_alive": loop_alive,
+        "cycle_id": snapshot["cycle_id"],
+        "cycle_running_seconds": running_seconds,
+        "stuck": stuck,
+        "last_cycle": {
+            "started_at": last_report.get("started_at"),
+            "wall_seconds": last_report.get("wall_seconds"),
+            "status": last_report.get("status")
+        },
+        "work_queue_depth": len(AI_WORK_QUEUE)
+    }
+
+
+def request_profiling(params=None):
+    """预约对接下来的若干周期进行性能分析 (状态接口 /profile 与 SIGUSR1 信号共用)。"""
+    cycles = int((params or {}).get("cycles", PROFILE_SIGNAL_CYCLES))
+    if cycles <= 0:
+        raise ValueError("cycles 必须为正整数")
+    pending_cycles = CYCLE_PROFILER.request(cycles)
+    print(f"信息：已预约性能分析，接下来的 {pending_cycles} 个周期将被分析 (报告写入 {PROFILE_OUTPUT_DIR})。")
+    return {"pending_cycles": pending_cycles, "output_dir": PROFILE_OUTPUT_DIR}
+
+
 if __name__ == '__main__':
-    # 设置间隔时间
-    PROCESS_INTERVAL_SECONDS = 60
+    # 设置间隔时间 (启用自适应轮询时作为初始间隔)
+    PROCESS_INTERVAL_SECONDS = POLL_SCHEDULER.base_interval
 
     # 加载配置
     ai_client = connect_gemini()
@@ -967,16 +1653,42 @@ if __name__ == '__main__':
     # 主程序等待用户输入 "stop"
     print("\n" + "=" * 50)
     print("自动处理程序正在后台运行...")
-    print(f"每 {PROCESS_INTERVAL_SECONDS} 秒检查一次邮件。")
-    print("在控制台中输入 'stop' (或按 Enter) 来停止程序。")
+    if POLL_SCHEDULER.enabled:
+        print(f"根据来信速率在 {POLL_SCHEDULER.min_interval} ~ {POLL_SCHEDULER.max_interval} 秒之间自适应检查邮件。")
+    else:
+        print(f"每 {PROCESS_INTERVAL_SECONDS} 秒检查一次邮件。")
+    # 收到 SIGUSR1 时预约性能分析 (kill -USR1 <pid>，仅 POSIX)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: request_profiling())
+
+    status_server = None
+    if STATUS_SERVER_ENABLED:
+        status_server = StatusServer.from_config(
+            STATUS_SERVER_CONFIG, get_status_metrics, lambda: get_daemon_status(process_thread), stop_loop_event,
+            actions={"/profile": request_profiling}
+        )
+        try:
+            status_url = status_server.start()
+            print(f"状态接口: {status_url}/metrics、/health、/ready；向 {status_url}/stop 发送 POST 请求来停止程序，"
+                  f"向 {status_url}/profile?cycles=N 发送 POST 请求来分析接下来的 N 个周期。")
+        except OSError as e:
+            print(f"警告：状态接口启动失败 ({e})，改为通过控制台停止程序。")
+            status_server = None
+    if status_server is None:
+        print("在控制台中输入 'stop' (或按 Enter) 来停止程序。")
     print("=" * 50 + "\n")
 
     process_thread.start()
 
     try:
-        # 阻塞主线程，直到用户输入
-        input()
-    except EOFError:
+        if status_server is not None:
+            # 阻塞主线程，直到状态接口收到 /stop (或 Ctrl+C)
+            while not stop_loop_event.wait(timeout=1):
+                pass
+        else:
+            # 阻塞主线程，直到用户输入
+            input()
+    except (EOFError, KeyboardInterrupt):
         pass  # 在某些非交互式环境中，input()会立即结束
 
     # 用户输入后，发送 "停止" 信号
@@ -986,5 +1698,7 @@ if __name__ == '__main__':
     # 等待后台线程完全退出
     # (这会等待 stop_event.wait() 结束, 确保循环优雅地退出)
     process_thread.join(timeout=20)
+    if status_server is not None:
+        status_server.stop()
 
     print("程序已完全停止。")
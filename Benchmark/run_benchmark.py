@@ -0,0 +1,295 @@
+"""
+合成邮箱基准测试: 覆盖邮件解析、HTML 转文本、地址解析、归档与 JSON 持久化等热点路径。
+
+用法 (与 AI_Replay 相同，需将项目根目录与 Auto_process 加入 PYTHONPATH):
+    python Benchmark/run_benchmark.py --sizes 1k,10k                 # 运行并打印结果
+    python Benchmark/run_benchmark.py --sizes 1k --save-baseline     # 保存为基线 Benchmark/baselines/1k.json
+    python Benchmark/run_benchmark.py --sizes 1k --compare           # 与基线比较，出现退化或缺少基线时退出码为 1
+
+Benchmark/baselines/1k.json 为提交到仓库的参考基线 (记录了生成时的 Python 版本与机器信息)；
+耗时与机器相关，在其他机器上比较前应先用 --save-baseline 重新生成。
+
+各项结果以 "每项耗时" (微秒) 比较，因此不同规模的结果可以直接对照，观察随历史数据增长的变化。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import AI_Handler  # (与 AI_Replay 相同，先导入 AI_Handler 以解决与 mail_AutoProcess 之间的循环导入)
+
+from datetime import datetime
+from Auto_process.mail_AutoProcess import parse_received_email
+from Benchmark.synthetic_mailbox import CORPUS_SIZES, get_corpus_size, iter_raw_messages, generate_html_body, \
+    generate_address_header, generate_sent_email
+from Utils.util import extract_text_from_html, get_address_list_from_header, archive_email_to_memory, \
+    datetime_to_json, get_email_key
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# 每次从生成器取出的邮件数 (只在内存中保留一批原始数据)
+CHUNK_SIZE = 1000
+# 持久化基准中每个周期新增的邮件数 (与流水线的默认批次大小一致)
+PERSIST_BATCH_SIZE = 20
+# 持久化基准重复的周期数
+PERSIST_CYCLES = 3
+
+
+def time_call(func, repeat):
+    """多次执行 func，返回最短耗时 (秒) 与最后一次的返回值。"""
+    best, result = None, None
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started_at
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def make_result(items, seconds, **extra):
+    result = {
+        "items": items,
+        "seconds": round(seconds, 4),
+        "per_item_us": round(seconds / items * 1e6, 3) if items else None
+    }
+    result.update(extra)
+    return result
+
+
+# --- 各项基准 ---
+def bench_parse_received(count, seed, repeat):
+    """与 fetch_unseen_emails 相同的解析 (parse_received_email)，按批生成原始数据，只计入解析耗时。"""
+    total_seconds, total_bytes, parsed_emails = 0.0, 0, []
+    chunk = []
+
+    def parse_chunk():
+        return [parse_received_email(email_id, raw_message) for email_id, raw_message in chunk]
+
+    for item in iter_raw_messages(count, seed):
+        chunk.append(item)
+        if len(chunk) >= CHUNK_SIZE:
+            seconds, emails = time_call(parse_chunk, repeat)
+            total_seconds += seconds
+            total_bytes += sum(len(raw_message) for _, raw_message in chunk)
+            parsed_emails.extend(emails)
+            chunk = []
+    if chunk:
+        seconds, emails = time_call(parse_chunk, repeat)
+        total_seconds += seconds
+        total_bytes += sum(len(raw_message) for _, raw_message in chunk)
+        parsed_emails.extend(emails)
+
+    return make_result(count, total_seconds, megabytes=round(total_bytes / 1e6, 2)), parsed_emails
+
+
+def bench_extract_text_from_html(count, seed, repeat):
+    total_seconds = 0.0
+    for start in range(0, count, CHUNK_SIZE):
+        html_bodies = [generate_html_body(index, seed) for index in range(start, min(count, start + CHUNK_SIZE))]
+        seconds, _ = time_call(lambda: [extract_text_from_html(html) for html in html_bodies], repeat)
+        total_seconds += seconds
+    return make_result(count, total_seconds)
+
+
+def bench_get_address_list(count, seed, repeat):
+    headers = [generate_address_header(index, seed) for index in range(count)]
+    seconds, _ = time_call(lambda: [get_address_list_from_header(header) for header in headers], repeat)
+    return make_result(count, seconds)
+
+
+def bench_archive_email_to_memory(emails, repeat):
+    def archive():
+        all_memory, processed_ids = {}, set()
+        for email in emails:
+            archive_email_to_memory(email, all_memory, processed_ids)
+        return all_memory
+
+    seconds, all_memory = time_call(archive, repeat)
+    return make_result(len(emails), seconds, conversations=len(all_memory)), all_memory
+
+
+def bench_persist_valid_emails(emails, work_dir):
+    """
+    email_classification 写入有效邮件的过程: 读取完整的历史文件 -> 追加一批新邮件 -> 排序 -> 覆盖写入。
+    历史文件预先写入全部邮件，测量每个周期的耗时 (随历史增长的成本)。
+    """
+    file_path = os.path.join(work_dir, "valid_emails.json")
+    history, new_batch = emails[:-PERSIST_BATCH_SIZE], emails[-PERSIST_BATCH_SIZE:]
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(history, f, indent=4, ensure_ascii=False, default=datetime_to_json)
+
+    def cycle():
+        with open(file_path, 'r', encoding='utf-8') as f:
+            all_valid_emails = json.load(f)
+        all_valid_emails.extend(json.loads(json.dumps(new_batch, default=datetime_to_json)))
+        all_valid_emails.sort(key=lambda email: datetime.fromisoformat(email['sent_time']))
+        # (写入临时文件，保持历史文件不变，使每次重复的数据量相同)
+        with open(file_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(all_valid_emails, f, indent=4, ensure_ascii=False, default=datetime_to_json)
+
+    seconds, _ = time_call(cycle, PERSIST_CYCLES)
+    return make_result(1, seconds, history_emails=len(history),
+                       file_megabytes=round(os.path.getsize(file_path) / 1e6, 2))
+
+
+def bench_persist_conversation_memory(archived_memory, work_dir):
+    """maintain_conversation_history 的读取 -> 建立已归档 ID 集合 -> 覆盖写入 (每个周期一次)。"""
+    file_path = os.path.join(work_dir, "conversation_memory.json")
+    memory = {address: {"emails": emails} for address, emails in archived_memory.items()}
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(memory, f, ensure_ascii=False, indent=2, default=datetime_to_json)
+
+    def cycle():
+        with open(file_path, 'r', encoding='utf-8') as f:
+            all_memory = json.load(f)
+        existing_ids = {get_email_key(email) for convo_data in all_memory.values()
+                        for email in convo_data.get("emails", []) if email and email.get("id")}
+        with open(file_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(all_memory, f, ensure_ascii=False, indent=2, default=datetime_to_json)
+        return existing_ids
+
+    seconds, existing_ids = time_call(cycle, PERSIST_CYCLES)
+    return make_result(1, seconds, archived_emails=len(existing_ids), conversations=len(memory),
+                       file_megabytes=round(os.path.getsize(file_path) / 1e6, 2))
+
+
+def run_benchmarks(size, seed=0, repeat=3):
+    count = get_corpus_size(size)
+    print(f"信息：开始基准测试 (规模 {size} = {count} 封，seed {seed}，重复 {repeat} 次取最短)...")
+    results = {}
+
+    results["parse_received_email"], received_emails = bench_parse_received(count, seed, repeat)
+    results["extract_text_from_html"] = bench_extract_text_from_html(count, seed, repeat)
+    results["get_address_list_from_header"] = bench_get_address_list(count, seed, repeat)
+
+    # (与 maintain_conversation_history 相同，归档前将收信格式化为带 sender 地址的结构)
+    formatted_emails = [dict(email, sender=f"{email['sender_name']}@{email['sender_root']}")
+                        for email in received_emails]
+    sent_emails = [generate_sent_email(index, seed, max(50, count // 20)) for index in range(count // 4)]
+    results["archive_email_to_memory"], archived_memory = bench_archive_email_to_memory(
+        formatted_emails + sent_emails, repeat
+    )
+
+    work_dir = tempfile.mkdtemp(prefix="mail_bench_")
+    try:
+        results["persist.valid_emails"] = bench_persist_valid_emails(received_emails, work_dir)
+        results["persist.conversation_memory"] = bench_persist_conversation_memory(archived_memory, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "size": size,
+        "count": count,
+        "seed": seed,
+        "repeat": repeat,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "results": results
+    }
+
+
+# --- 基线 ---
+def get_baseline_path(size):
+    return os.path.join(BASELINE_DIR, f"{size}.json")
+
+
+def save_baseline(report):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = get_baseline_path(report["size"])
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+    print(f"信息：基线已保存到 {path}")
+
+
+def compare_with_baseline(report, baseline, threshold):
+    """
+    按每项耗时与基线比较。
+    Returns:
+        list: 退化的基准名称 (耗时超过基线的 1 + threshold 倍)。
+    """
+    regressions = []
+    print(f"\n与基线 ({baseline.get('created_at')}，Python {baseline.get('python')}，{baseline.get('platform')}，"
+          f"{baseline.get('cpu_count')} 核) 比较，阈值 +{threshold:.0%}:")
+    for name, result in report["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base.get("per_item_us") or result["per_item_us"] is None:
+            # (per_item_us 为 None 表示本项没有处理任何数据，无法比较)
+            print(f"  {name:<32} {str(result['per_item_us']):>12} us   (基线中没有此项)")
+            continue
+        ratio = result["per_item_us"] / base["per_item_us"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- 退化"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = "  (改善)"
+        print(f"  {name:<32} {result['per_item_us']:>12} us   基线 {base['per_item_us']:>12} us   "
+              f"x{ratio:.2f}{flag}")
+    return regressions
+
+
+def print_report(report):
+    print(f"\n规模 {report['size']} ({report['count']} 封):")
+    for name, result in report["results"].items():
+        extra = {key: value for key, value in result.items() if key not in ("items", "seconds", "per_item_us")}
+        print(f"  {name:<32} {result['seconds']:>9.3f} s   {str(result['per_item_us']):>12} us/项   {extra or ''}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="合成邮箱基准测试 (解析、HTML 转文本、地址解析、归档、JSON 持久化)。")
+    parser.add_argument("--sizes", default="1k",
+                        help=f"逗号分隔的语料规模: {', '.join(CORPUS_SIZES)} 或邮件数")
+    parser.add_argument("--seed", type=int, default=0, help="语料生成的随机种子")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数 (取最短耗时)")
+    parser.add_argument("--save-baseline", action="store_true", help="将结果保存为基线")
+    parser.add_argument("--compare", action="store_true", help="与已保存的基线比较")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定退化的相对阈值 (默认 0.2，即慢 20%%)")
+    parser.add_argument("--output", default=None, help="将完整结果写入该 JSON 文件")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+
+    reports, regressions, missing_baselines = [], [], []
+    for size in sizes:
+        report = run_benchmarks(size, seed=args.seed, repeat=args.repeat)
+        reports.append(report)
+        print_report(report)
+
+        if args.compare:
+            baseline_path = get_baseline_path(size)
+            if not os.path.exists(baseline_path):
+                print(f"错误：没有规模 {size} 的基线 ({baseline_path})，请先使用 --save-baseline 生成。")
+                missing_baselines.append(size)
+            else:
+                with open(baseline_path, 'r', encoding='utf-8') as f:
+                    baseline = json.load(f)
+                if baseline.get("seed") != report["seed"]:
+                    print(f"警告：基线的 seed ({baseline.get('seed')}) 与本次不同，比较结果可能不可靠。")
+                regressions += [f"{size}:{name}" for name in compare_with_baseline(report, baseline, args.threshold)]
+        if args.save_baseline:
+            save_baseline(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=4, ensure_ascii=False)
+
+    if regressions:
+        print(f"\n错误：以下基准出现退化: {', '.join(regressions)}")
+    if missing_baselines:
+        print(f"\n错误：以下规模没有基线，无法比较: {', '.join(missing_baselines)}")
+    return 1 if regressions or missing_baselines else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
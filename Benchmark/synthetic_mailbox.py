@@ -0,0 +1,193 @@
+import base64
+import random
+
+from datetime import datetime, timedelta, timezone
+from email.header import Header
+from email.utils import format_datetime, formataddr
+
+# 语料规模: 名称 -> 邮件数
+CORPUS_SIZES = {"1k": 1000, "10k": 10000, "100k": 100000}
+
+# 邮件类型 (按 MESSAGE_KIND_WEIGHTS 的比例混合)
+KIND_PLAIN = "plain"  # text/plain 单部分
+KIND_ALTERNATIVE = "alternative"  # multipart/alternative (纯文本 + HTML)
+KIND_HTML = "html"  # 只有 HTML 的营销/通知邮件 (需要 HTML 转文本)
+KIND_ATTACHMENT = "attachment"  # multipart/mixed，带 PDF/图片附件
+KIND_CJK = "cjk"  # 中文/日文主题与正文，编码后的头部
+MESSAGE_KIND_WEIGHTS = {KIND_PLAIN: 2, KIND_ALTERNATIVE: 3, KIND_HTML: 3, KIND_ATTACHMENT: 1, KIND_CJK: 2}
+
+BASE_TIME = datetime(2024, 1, 1, 9, 0, tzinfo=timezone(timedelta(hours=9)))
+MY_ADDRESS = "me@example.jp"
+
+WORDS = ("project", "meeting", "invoice", "schedule", "update", "review", "report", "please", "confirm",
+         "attached", "shipment", "account", "security", "thanks", "deadline", "budget", "proposal", "team",
+         "customer", "order", "delivery", "weekly", "summary", "question", "draft", "release", "access")
+CJK_PHRASES = ("请确认附件中的报价单", "会议时间调整为下周三下午", "感谢您的订购，商品已发货", "本月账单已生成",
+               "ご確認のほどよろしくお願いいたします", "来週の打ち合わせについて", "セキュリティ通知：新しいログイン",
+               "项目进度汇报", "お支払い期限のお知らせ", "发票已开具，请查收")
+DOMAINS = ("example.com", "corp.example.co.jp", "mail.shop.example.net", "notify.service.example.org",
+           "university.example.edu", "qq.example.cn", "news.example.com", "bank.example.co.jp")
+NAMES = ("Alice", "Bob", "Carol", "Dave", "Eve", "Frank", "Grace", "Heidi", "佐藤 花子", "李雷", "韩梅梅", "田中 太郎")
+
+
+def get_corpus_size(size):
+    """"1k"/"10k"/"100k" 或整数字符串 -> 邮件数。"""
+    return CORPUS_SIZES[size] if size in CORPUS_SIZES else int(size)
+
+
+def _rng(seed, index, salt=""):
+    # 每封邮件使用独立的随机数发生器：同一 (seed, index) 总是生成相同的内容，与生成顺序无关
+    return random.Random(f"{seed}:{index}:{salt}")
+
+
+def _sentence(rng, min_words=6, max_words=18):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    return " ".join(words).capitalize() + "."
+
+
+def _contact(rng, contact_count):
+    contact = rng.randrange(contact_count)
+    return NAMES[contact % len(NAMES)], f"user{contact}@{DOMAINS[contact % len(DOMAINS)]}"
+
+
+def _encode_address(name, address):
+    # 非 ASCII 的显示名按 RFC 2047 编码
+    return formataddr((Header(name, "utf-8").encode() if not name.isascii() else name, address))
+
+
+def generate_address_header(index, seed=0, contact_count=500):
+    """To/Cc 头部: 1~8 个地址，部分带有 RFC 2047 编码的显示名。"""
+    rng = _rng(seed, index, "address")
+    addresses = []
+    for _ in range(rng.randint(1, 8)):
+        name, address = _contact(rng, contact_count)
+        addresses.append(_encode_address(name, address) if rng.random() < 0.7 else address)
+    return ", ".join(addresses)
+
+
+def generate_html_body(index, seed=0):
+    """HTML 正文: 表格布局、内联样式、脚本/样式块与追踪链接 (典型的营销与通知邮件)。"""
+    rng = _rng(seed, index, "html")
+    blocks = ["<html><head><style>td{font-family:Arial;color:#333} .btn{padding:8px}</style>",
+              "<script>var tracking='" + "x" * rng.randint(50, 400) + "';</script></head><body>",
+              "<table width='600' cellpadding='0' cellspacing='0'>"]
+    for _ in range(rng.randint(5, 40)):
+        text = _sentence(rng) if rng.random() < 0.7 else rng.choice(CJK_PHRASES)
+        blocks.append(f"<tr><td style='padding:4px;font-size:14px'><p>{text}</p>"
+                      f"<a href='https://track.example.com/c/{rng.getrandbits(64):x}'>link</a>&nbsp;&amp;</td></tr>")
+    blocks.append("</table><div style='display:none'>" + "&zwnj;" * rng.randint(0, 50) + "</div></body></html>")
+    return "".join(blocks)
+
+
+def _plain_body(rng):
+    return "\n\n".join(_sentence(rng, 8, 30) for _ in range(rng.randint(2, 12)))
+
+
+def _cjk_body(rng):
+    return "\n".join(rng.choice(CJK_PHRASES) + "。" + rng.choice(CJK_PHRASES) for _ in range(rng.randint(3, 20)))
+
+
+def _b64(data):
+    encoded = base64.b64encode(data).decode("ascii")
+    return "\r\n".join(encoded[i:i + 76] for i in range(0, len(encoded), 76))
+
+
+def _text_part(subtype, text, charset="utf-8"):
+    return (f"Content-Type: text/{subtype}; charset=\"{charset}\"\r\nContent-Transfer-Encoding: base64\r\n\r\n"
+            f"{_b64(text.encode(charset))}\r\n")
+
+
+def _multipart(subtype, boundary, parts):
+    body = "".join(f"--{boundary}\r\n{part}" for part in parts)
+    return f"Content-Type: multipart/{subtype}; boundary=\"{boundary}\"\r\n\r\n{body}--{boundary}--\r\n"
+
+
+def get_message_kind(index, seed=0):
+    rng = _rng(seed, index, "kind")
+    return rng.choices(list(MESSAGE_KIND_WEIGHTS), weights=list(MESSAGE_KIND_WEIGHTS.values()))[0]
+
+
+def generate_raw_message(index, seed=0, contact_count=500):
+    """
+    生成第 index 封收到的邮件的 RFC822 原始数据 (bytes)。
+    相同的 (index, seed, contact_count) 总是生成相同的字节 (分隔符、时间、附件内容均由种子决定)。
+    """
+    rng = _rng(seed, index)
+    kind = get_message_kind(index, seed)
+    sender_name, sender = _contact(rng, contact_count)
+    sent_time = BASE_TIME + timedelta(minutes=index * 7 + rng.randint(0, 6))
+    boundary = f"=_bench_{seed}_{index}_{rng.getrandbits(32):08x}"
+
+    if kind == KIND_CJK:
+        subject = Header(rng.choice(CJK_PHRASES), "utf-8" if rng.random() < 0.5 else "gb18030").encode()
+    else:
+        subject = f"{_sentence(rng, 3, 8)[:-1]} #{index}"
+
+    headers = [
+        f"From: {_encode_address(sender_name, sender)}",
+        f"To: {_encode_address('Me', MY_ADDRESS)}" + (
+            f", {generate_address_header(index, seed, contact_count)}" if rng.random() < 0.3 else ""),
+        f"Subject: {subject}",
+        f"Date: {format_datetime(sent_time)}",
+        f"Message-ID: <{index}.{seed}@bench.example>",
+        "MIME-Version: 1.0",
+    ]
+    if rng.random() < 0.4:
+        headers.append(f"Cc: {generate_address_header(index + 1, seed, contact_count)}")
+    if rng.random() < 0.3:
+        headers.append(f"List-Unsubscribe: <https://{DOMAINS[index % len(DOMAINS)]}/unsubscribe/{index}>")
+    if rng.random() < 0.5:
+        headers.append(f"Authentication-Results: mx.example.jp; spf=pass; dkim=pass; dmarc=pass header.from={sender}")
+
+    if kind == KIND_PLAIN:
+        content = _text_part("plain", _plain_body(rng))
+    elif kind == KIND_HTML:
+        content = _text_part("html", generate_html_body(index, seed))
+    elif kind == KIND_CJK:
+        charset = "utf-8" if rng.random() < 0.6 else "gb18030"
+        content = _text_part("plain", _cjk_body(rng), charset)
+    elif kind == KIND_ALTERNATIVE:
+        content = _multipart("alternative", boundary, [
+            _text_part("plain", _plain_body(rng)),
+            _text_part("html", generate_html_body(index, seed))
+        ])
+    else:
+        attachments = []
+        for number in range(rng.randint(1, 3)):
+            filename, ctype = rng.choice((("report.pdf", "application/pdf"), ("photo.jpg", "image/jpeg"),
+                                          ("data.xlsx", "application/vnd.ms-excel")))
+            size = rng.randint(2048, 16384)
+            payload = rng.getrandbits(8 * size).to_bytes(size, "little")
+            attachments.append(f"Content-Type: {ctype}; name=\"{number}_{filename}\"\r\n"
+                               f"Content-Disposition: attachment; filename=\"{number}_{filename}\"\r\n"
+                               f"Content-Transfer-Encoding: base64\r\n\r\n{_b64(payload)}\r\n")
+        content = _multipart("mixed", boundary, [
+            _multipart("alternative", boundary + "_alt", [
+                _text_part("plain", _plain_body(rng)),
+                _text_part("html", generate_html_body(index, seed))
+            ])
+        ] + attachments)
+
+    return ("\r\n".join(headers) + "\r\n" + content).encode("utf-8")
+
+
+def iter_raw_messages(count, seed=0, contact_count=None):
+    """逐封生成 (email_id, 原始数据)，不在内存中保留整个语料。"""
+    contact_count = contact_count or max(50, count // 20)
+    for index in range(count):
+        yield str(index + 1).encode(), generate_raw_message(index, seed, contact_count)
+
+
+def generate_sent_email(index, seed=0, contact_count=500):
+    """已结构化的发送邮件 (与 parse_sent_email 的输出结构相同)，用于归档与持久化的基准。"""
+    rng = _rng(seed, index, "sent")
+    receivers = [_contact(rng, contact_count)[1] for _ in range(rng.randint(1, 3))]
+    return {
+        'type': 'sent',
+        'id': f"sent-{index + 1}",
+        'receiver': receivers,
+        'cc': [],
+        'subject': f"Re: {_sentence(rng, 3, 8)[:-1]}",
+        'sent_time': BASE_TIME + timedelta(minutes=index * 11),
+        'body': _plain_body(rng)
+    }
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import random
+import threading
+import time
+
+# --- AI 阶段名称 (与判断记录中的 judgment_type 对应) ---
+STAGE_CLASSIFICATION = "classification"
+STAGE_SUMMARY = "get_summary"
+STAGE_CONVERSATION = "conversation_check"
+STAGE_HISTORY_SUMMARY = "history_summary"
+STAGE_STYLE_PROFILE = "style_profile"
+STAGE_CONVERSATION_PROFILE = "conversation_profile"  # 总体总结与口吻分析合并为一次调用
+
+
+class AIBackendError(Exception):
+    """
+    AI 后端调用错误。
+
+    Attributes:
+        status_code: HTTP 风格的状态码 (429 限流、503 服务不可用、400 请求错误等)，未知时为 None。
+        retry_after: 服务端建议的重试等待秒数，未提供时为 None。
+    """
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AIBackend:
+    """
+    AI 后端协议。AI_Handler 中的所有 AI 阶段都通过 generate() 调用模型。
+
+    子类需要实现 generate(prompt, model_name, stage, prefix)，返回模型输出的 JSON 文本。
+    prefix 为各次调用共享的静态前缀 (见 Utils.prompt_templates)，prompt 为变化部分；
+    后端将前缀放在开头拼接发送，以命中服务端的隐式前缀缓存。
+    """
+
+    name = "base"
+
+    def generate(self, prompt, model_name, stage=None, prefix=None):
+        raise NotImplementedError
+
+    @staticmethod
+    def join_prompt(prompt, prefix):
+        return prefix + "\n\n" + prompt if prefix else prompt
+
+
+class GeminiBackend(AIBackend):
+    """
+    基于 Google genai SDK 的后端。
+
+    静态前缀与变化部分拼接后放在同一请求中发送 (前缀在前)。不使用 caches.create 显式缓存：
+    本项目的前缀只有约 1000 字，远低于 Gemini 显式缓存的最小 token 数；
+    相同的前缀放在开头即可命中服务端的隐式前缀缓存。
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key):
+        # (延迟导入，使离线后端不依赖 google-genai)
+        from google import genai
+        self.client = genai.Client(api_key=api_key)
+
+    def generate(self, prompt, model_name, stage=None, prefix=None):
+        config = {
+            "response_mime_type": "application/json"
+            # 这里省略 response_schema，因为 prompt 已经严格要求了 JSON 格式
+        }
+        response = self.client.models.generate_content(
+            model=model_name,
+            contents=self.join_prompt(prompt, prefix),
+            config=config
+        )
+        return response.text
+
+
+class OfflineBackend(AIBackend):
+    """
+    离线确定性替身后端，用于在无网络、无配额的情况下对整个流程做基准测试与压测。
+
+    - 响应内容由 prompt 的哈希值确定性地生成，同一 prompt 始终得到相同结果。
+    - 可配置延迟 (latency_seconds ± latency_jitter)、普通错误率 (error_rate) 与 429 注入率 (rate_limit_rate)。
+    - 可按 stall_rate 注入偶发的长时间挂起 (stall_seconds)，模拟尾延迟。
+    - 错误注入使用固定 seed 的随机序列，因此同一调用序列的故障也是可复现的。
+    """
+
+    name = "offline"
+
+    def __init__(self, latency_seconds=0.0, latency_jitter=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1.0, stall_rate=0.0, stall_seconds=30.0, seed=0):
+        self.latency_seconds = latency_seconds
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.call_count = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            latency_seconds=config.get("LATENCY_SECONDS", 0.0),
+            latency_jitter=config.get("LATENCY_JITTER", 0.0),
+            error_rate=config.get("ERROR_RATE", 0.0),
+            rate_limit_rate=config.get("RATE_LIMIT_RATE", 0.0),
+            retry_after=config.get("RETRY_AFTER_SECONDS", 1.0),
+            stall_rate=config.get("STALL_RATE", 0.0),
+            stall_seconds=config.get("STALL_SECONDS", 30.0),
+            seed=config.get("SEED", 0)
+        )
+
+    @staticmethod
+    def detect_stage(prompt):
+        """未指定 stage 时，根据 prompt 中要求的 JSON 键推断阶段。"""
+        if '"style_profile"' in prompt and '"general_summary"' in prompt:
+            return STAGE_CONVERSATION_PROFILE
+        if '"style_profile"' in prompt:
+            return STAGE_STYLE_PROFILE
+        if '"general_summary"' in prompt:
+            return STAGE_HISTORY_SUMMARY
+        if '"is_conversation"' in prompt:
+            return STAGE_CONVERSATION
+        if '"score"' in prompt:
+            return STAGE_CLASSIFICATION
+        return STAGE_SUMMARY
+
+    @staticmethod
+    def build_response(prompt, stage):
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        value = int(digest[:8], 16)
+        tag = digest[:8]
+
+        # (置信度在 0.5 ~ 0.99 之间，用于模拟模型路由的升级)
+        confidence = round(0.5 + (value >> 8) % 50 / 100, 2)
+
+        if stage == STAGE_CLASSIFICATION:
+            return {"score": value % 5 + 1, "summary": f"[离线] 邮件总结 {tag}", "confidence": confidence}
+        if stage == STAGE_CONVERSATION:
+            return {"is_conversation": value % 2 == 0, "reason": f"[离线] 判断理由 {tag}", "confidence": confidence}
+        if stage == STAGE_HISTORY_SUMMARY:
+            return {"general_summary": f"[离线] 对话总体总结 {tag}"}
+        style_profile = {
+            "formality": ("非常正式（商务敬语）", "正式（生活商务）", "非正式")[value % 3],
+            "tone_description": f"[离线] 语气描述 {tag}",
+            "greeting_template": "无",
+            "sign_off_template": "无"
+        }
+        if stage == STAGE_STYLE_PROFILE:
+            return {"style_profile": style_profile}
+        if stage == STAGE_CONVERSATION_PROFILE:
+            return {"general_summary": f"[离线] 对话总体总结 {tag}", "style_profile": style_profile}
+        return {"summary": f"[离线] 邮件总结 {tag}"}
+
+    def generate(self, prompt, model_name, stage=None, prefix=None):
+        prompt = self.join_prompt(prompt, prefix)
+        with self.lock:
+            self.call_count += 1
+            latency = max(0.0, self.latency_seconds + self.random.uniform(-self.latency_jitter, self.latency_jitter))
+            roll = self.random.random()
+            if self.stall_rate and self.random.random() < self.stall_rate:
+                latency += self.stall_seconds
+
+        if latency:
+            time.sleep(latency)
+
+        if roll < self.rate_limit_rate:
+            raise AIBackendError("[离线] 429 RESOURCE_EXHAUSTED (注入)", status_code=429, retry_after=self.retry_after)
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise AIBackendError("[离线] 500 INTERNAL (注入)", status_code=500)
+
+        return json.dumps(self.build_response(prompt, stage or self.detect_stage(prompt)), ensure_ascii=False)
+
+
+def create_backend(backend_config, api_key):
+    """
+    根据配置创建 AI 后端。
+
+    Args:
+        backend_config (dict): AI_config.json 中的 "AI_BACKEND" 配置，TYPE 为 "gemini" 或 "offline"。
+        api_key (str): Gemini API Key。
+    """
+    backend_type = backend_config.get("TYPE", "gemini")
+    if backend_type == "offline":
+        print("信息：使用离线确定性 AI 后端 (不会访问网络)。")
+        return OfflineBackend.from_config(backend_config.get("OFFLINE", {}))
+    if backend_type != "gemini":
+        print(f"警告：未知的 AI 后端类型 {backend_type}，将使用 gemini。")
+    return GeminiBackend(api_key)
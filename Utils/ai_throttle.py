@@ -0,0 +1,265 @@
+import re
+import threading
+import time
+
+# --- 错误分类 ---
+THROTTLE_STATUS_CODES = (429, 503)  # 限流 / 服务过载: 降低并发
+TRANSIENT_STATUS_CODES = (408, 500, 502, 504)  # 临时性错误: 可重试
+RETRY_DELAY_PATTERN = re.compile(r"retry[_ ]?delay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", re.IGNORECASE)
+RETRY_IN_PATTERN = re.compile(r"retry in (\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+
+
+class AIWorkDeferredError(Exception):
+    """本次 AI 调用未被发出，剩余工作应推迟到下一周期 (熔断器打开或本周期时间预算耗尽)。"""
+
+
+class CircuitOpenError(AIWorkDeferredError):
+    """熔断器处于打开状态。"""
+
+
+class CycleBudgetExceededError(AIWorkDeferredError):
+    """本周期的 AI 时间预算已耗尽。"""
+
+
+class CycleBudget:
+    """
+    单个处理周期的 AI 时间预算。
+    预算耗尽后不再发出新的 AI 调用 (在途调用正常完成)，剩余工作进入工作队列留待下一周期，
+    从而使每个周期的耗时有上限，轮询节奏保持稳定。
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.started_at = time.monotonic()
+
+    def remaining(self):
+        return self.seconds - (time.monotonic() - self.started_at)
+
+    @property
+    def exhausted(self):
+        return self.remaining() <= 0
+
+    def check(self):
+        if self.exhausted:
+            raise CycleBudgetExceededError(f"本周期 AI 时间预算 ({self.seconds} 秒) 已耗尽，推迟到下一周期。")
+
+
+class RequestRateLimiter:
+    """
+    每分钟请求数上限 (令牌桶)。用于批量回放等长时间任务，使请求速率不超过 API 配额，
+    而不是依赖 429 之后再降速。max_per_minute <= 0 表示不限制。
+    """
+
+    def __init__(self, max_per_minute):
+        self.rate = max_per_minute / 60.0 if max_per_minute and max_per_minute > 0 else 0.0
+        self.capacity = max(1.0, self.rate)  # 最多允许约 1 秒的突发
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """不等待的 acquire: 当前有令牌时取走并返回 True，否则返回 False。"""
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+def get_error_status(error):
+    """
+    从异常中提取 HTTP 风格状态码。
+    支持 AIBackendError.status_code、google-genai APIError.code，以及错误信息中的状态关键字。
+    """
+    for attr in ("status_code", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    message = str(error)
+    if "RESOURCE_EXHAUSTED" in message or re.search(r'\b429\b', message):
+        return 429
+    if "UNAVAILABLE" in message or re.search(r'\b503\b', message):
+        return 503
+    if "DEADLINE_EXCEEDED" in message or re.search(r'\b504\b', message):
+        return 504
+    if "INTERNAL" in message or re.search(r'\b500\b', message):
+        return 500
+    if "INVALID_ARGUMENT" in message or re.search(r'\b400\b', message):
+        return 400
+    return None
+
+
+def get_retry_after(error):
+    """从异常中提取服务端建议的重试等待秒数 (retry_after 属性或 RetryInfo 的 retryDelay)。"""
+    value = getattr(error, "retry_after", None)
+    if isinstance(value, (int, float)):
+        return float(value)
+    message = str(error)
+    match = RETRY_DELAY_PATTERN.search(message) or RETRY_IN_PATTERN.search(message)
+    return float(match.group(1)) if match else None
+
+
+def is_throttle_error(error):
+    return get_error_status(error) in THROTTLE_STATUS_CODES
+
+
+def is_retryable_error(error):
+    """限流、服务过载、临时性错误以及无法识别状态码的网络错误可重试；4xx 请求错误不重试。"""
+    status = get_error_status(error)
+    if status is None:
+        return True
+    return status in THROTTLE_STATUS_CODES or status in TRANSIENT_STATUS_CODES
+
+
+class AdaptiveConcurrencyController:
+    """
+    AI 调用的 AIMD 自适应并发控制器 + 熔断器 (所有 AI 阶段共享)。
+
+    - 成功: 并发上限加性增加 (每完成约 limit 次成功调用，上限 +1)。
+    - 429/503: 并发上限乘性减少，并按服务端建议 (retry_after) 暂停新请求。
+    - 连续失败达到 failure_threshold: 熔断器打开，open_seconds 内的调用直接抛出 CircuitOpenError；
+      到期后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, min_limit=1, max_limit=8, initial_limit=2, decrease_factor=0.5,
+                 failure_threshold=5, open_seconds=300):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.decrease_factor = decrease_factor
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.resume_at = 0.0  # 按 retry_after 暂停新请求直到此时刻
+        self.consecutive_failures = 0
+        self.opened_at = None  # 熔断器打开的时刻 (None 表示关闭)
+        self.half_open_probe = False  # 半开状态下是否已有探测请求在途
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            min_limit=config.get("MIN_CONCURRENCY", 1),
+            max_limit=config.get("MAX_CONCURRENCY", 8),
+            initial_limit=config.get("INITIAL_CONCURRENCY", 2),
+            decrease_factor=config.get("DECREASE_FACTOR", 0.5),
+            failure_threshold=config.get("FAILURE_THRESHOLD", 5),
+            open_seconds=config.get("BREAKER_OPEN_SECONDS", 300)
+        )
+
+    @property
+    def is_open(self):
+        with self.condition:
+            return self._is_open(time.monotonic())
+
+    def _is_open(self, now):
+        return self.opened_at is not None and now - self.opened_at < self.open_seconds
+
+    def acquire(self):
+        """
+        获取一个在途调用名额。熔断器打开时抛出 CircuitOpenError。
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self._is_open(now):
+                    raise CircuitOpenError(f"AI 熔断器已打开 (连续失败 {self.consecutive_failures} 次)，推迟到下一周期。")
+
+                if self.opened_at is not None:
+                    # 半开状态: 只放行一个探测请求
+                    if not self.half_open_probe and self.in_flight == 0:
+                        self.half_open_probe = True
+                        self.in_flight += 1
+                        return
+                    self.condition.wait(timeout=1.0)
+                    continue
+
+                if now < self.resume_at:
+                    self.condition.wait(timeout=self.resume_at - now)
+                    continue
+
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                self.condition.wait(timeout=1.0)
+
+    def try_acquire(self):
+        """
+        不等待的 acquire: 熔断器关闭、没有暂停且有空闲名额时占用一个名额并返回 True，否则返回 False (不抛出异常)。
+        用于对冲等可有可无的附加请求。
+        """
+        with self.condition:
+            now = time.monotonic()
+            if self.opened_at is not None or now < self.resume_at or self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, error=None):
+        """
+        归还名额并根据调用结果调整并发上限与熔断状态。
+
+        Args:
+            error: 调用抛出的异常，成功时为 None。
+        """
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+
+            if error is None:
+                self.consecutive_failures = 0
+                if self.opened_at is not None:
+                    print("信息：AI 熔断器探测成功，恢复正常调用。")
+                self.opened_at = None
+                self.half_open_probe = False
+                self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+
+            elif is_retryable_error(error):
+                self.consecutive_failures += 1
+                if is_throttle_error(error):
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    retry_after = get_retry_after(error)
+                    if retry_after:
+                        self.resume_at = max(self.resume_at, now + retry_after)
+
+                if self.opened_at is not None or self.consecutive_failures >= self.failure_threshold:
+                    if self.opened_at is None or self.half_open_probe:
+                        print(f"警告：AI 调用连续失败 {self.consecutive_failures} 次，熔断器打开 {self.open_seconds} 秒。")
+                    self.opened_at = now
+                    self.half_open_probe = False
+
+            else:
+                # 请求本身的错误 (4xx)，与服务健康无关
+                if self.half_open_probe:
+                    self.half_open_probe = False
+
+            self.condition.notify_all()
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "consecutive_failures": self.consecutive_failures,
+                "circuit_open": self._is_open(time.monotonic())
+            }
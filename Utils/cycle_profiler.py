@@ -0,0 +1,107 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+from contextlib import contextmanager, nullcontext
+
+
+class CycleProfiler:
+    """
+    按需对接下来的 N 个处理周期进行 cProfile (CPU 热点) 与 tracemalloc (内存分配) 分析。
+
+    - request(cycles) 预约接下来的周期 (可由配置、信号或状态接口触发，线程安全)。
+    - profile_cycle(cycle_id) 包裹一个周期：未预约时直接返回空的上下文 (无额外开销)；
+      预约时记录该周期并写出 Info/profiles/cycle_<编号>_<时间>.prof (pstats 原始数据) 与 .txt (报告)。
+    - cProfile 只记录执行周期的线程；流水线与 AI 并发调用在其他线程中执行，
+      它们的耗时在报告中体现为等待 (queue.get / future.result / Event.wait)，内存分配统计则覆盖所有线程。
+    """
+
+    def __init__(self, output_dir, top_n=40, tracemalloc_frames=10, pending_cycles=0):
+        self.output_dir = output_dir
+        self.top_n = top_n
+        self.tracemalloc_frames = tracemalloc_frames
+        self.pending_cycles = pending_cycles
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, output_dir):
+        return cls(
+            output_dir,
+            top_n=config.get("TOP_N", 40),
+            tracemalloc_frames=config.get("TRACEMALLOC_FRAMES", 10),
+            pending_cycles=config.get("PROFILE_CYCLES", 0)
+        )
+
+    def request(self, cycles=1):
+        """预约对接下来的 cycles 个周期进行分析 (与尚未执行的预约累加)。返回预约后的待分析周期数。"""
+        with self.lock:
+            self.pending_cycles += max(0, int(cycles))
+            return self.pending_cycles
+
+    def _take(self):
+        with self.lock:
+            if self.pending_cycles <= 0:
+                return False
+            self.pending_cycles -= 1
+            return True
+
+    def profile_cycle(self, cycle_id):
+        if not self.pending_cycles or not self._take():
+            return nullcontext()
+        return self._profile(cycle_id)
+
+    @contextmanager
+    def _profile(self, cycle_id):
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start(self.tracemalloc_frames)
+        tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        started_at = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started_at
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started_tracemalloc:
+                tracemalloc.stop()
+            self.write_report(cycle_id, profiler, snapshot, elapsed, current, peak)
+
+    def write_report(self, cycle_id, profiler, snapshot, elapsed, current, peak):
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            base_path = os.path.join(self.output_dir, f"cycle_{cycle_id}_{time.strftime('%Y%m%d_%H%M%S')}")
+            profiler.dump_stats(base_path + ".prof")
+
+            report = io.StringIO()
+            report.write(f"周期 {cycle_id}: 耗时 {elapsed:.2f} 秒，"
+                         f"周期结束时追踪内存 {current / 1e6:.1f} MB，峰值 {peak / 1e6:.1f} MB\n")
+            for sort_key, title in (("cumulative", "累计耗时"), ("tottime", "自身耗时")):
+                report.write(f"\n===== CPU 热点 (按{title}排序，前 {self.top_n} 项) =====\n")
+                pstats.Stats(profiler, stream=report).strip_dirs().sort_stats(sort_key).print_stats(self.top_n)
+
+            snapshot = snapshot.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            report.write(f"\n===== 内存分配 (按代码行，前 {self.top_n} 项) =====\n")
+            for stat in snapshot.statistics("lineno")[:self.top_n]:
+                report.write(f"{stat}\n")
+            report.write(f"\n===== 内存分配 (按调用栈，前 5 项) =====\n")
+            for stat in snapshot.statistics("traceback")[:5]:
+                report.write(f"{stat.size / 1e6:.2f} MB，{stat.count} 个对象\n")
+                for line in stat.traceback.format():
+                    report.write(f"    {line}\n")
+
+            with open(base_path + ".txt", 'w', encoding='utf-8') as f:
+                f.write(report.getvalue())
+            print(f"信息：周期 {cycle_id} 的性能分析报告已写入 {base_path}.txt")
+        except Exception as e:
+            print(f"警告：写入周期 {cycle_id} 的性能分析报告失败: {e}")
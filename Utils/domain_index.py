@@ -0,0 +1,71 @@
+WILDCARD_SENDER = "*"  # 评分表中的通配发件人名: {"bounce.example.com": {"*": 0}}
+
+
+class _DomainNode:
+    __slots__ = ("children", "senders", "wildcard")
+
+    def __init__(self):
+        self.children = {}
+        self.senders = {}  # 发件人名 -> 评分
+        self.wildcard = None  # "*@该域名" 的评分 (同时适用于所有子域名)
+
+
+class DomainScoreIndex:
+    """
+    发件人评分表 (SENDER_INFO_LIST: {域名: {发件人名: 评分}}) 的域名层级索引。
+
+    域名按标签倒序插入前缀树 (com -> example -> eu -> notify)，查询时从顶级域名向下走到发件域名，
+    沿途记录命中的规则，最深 (最具体) 的规则生效:
+    - 精确规则: 发件人名与域名完全一致。
+    - 子域名继承: inherit_sender_names 为 True 时，notify@eu.example.com 可继承 notify@example.com 的评分。
+    - 通配规则: 发件人名为 "*" 时适用于该域名及其所有子域名，例如 "*@bounce.example.com"。
+    同一层级上精确/继承的发件人名优先于通配规则。查询开销只与域名的标签数有关，与评分表大小无关。
+    """
+
+    def __init__(self, inherit_sender_names=True):
+        self.inherit_sender_names = inherit_sender_names
+        self.root = _DomainNode()
+
+    @classmethod
+    def from_score_list(cls, score_list, inherit_sender_names=True):
+        index = cls(inherit_sender_names)
+        for sender_root, senders in score_list.items():
+            if not isinstance(senders, dict):
+                continue
+            for sender_name, score in senders.items():
+                index.set(sender_name, sender_root, score)
+        return index
+
+    @staticmethod
+    def _labels(sender_root):
+        return reversed((sender_root or "").lower().strip(".").split("."))
+
+    def set(self, sender_name, sender_root, score):
+        node = self.root
+        for label in self._labels(sender_root):
+            node = node.children.setdefault(label, _DomainNode())
+        if sender_name == WILDCARD_SENDER:
+            node.wildcard = score
+        else:
+            node.senders[sender_name] = score
+
+    def lookup(self, sender_name, sender_root):
+        """
+        Returns:
+            评分 (最具体的规则)；没有任何规则适用时返回 None。
+        """
+        node = self.root
+        labels = list(self._labels(sender_root))
+        best = None
+        for depth, label in enumerate(labels, 1):
+            node = node.children.get(label)
+            if node is None:
+                break
+            if depth == len(labels) or self.inherit_sender_names:
+                score = node.senders.get(sender_name)
+                if score is not None:
+                    best = score
+                    continue
+            if node.wildcard is not None:
+                best = node.wildcard
+        return best
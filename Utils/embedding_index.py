@@ -0,0 +1,348 @@
+import json
+import math
+import os
+import threading
+import zlib
+from array import array
+
+from Utils.pre_classifier import normalize_text, extract_ngrams
+
+# NumPy 为可选依赖：安装时使用矩阵运算做余弦检索，否则退回纯 Python 实现 (结果相同，速度较慢)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# --- 嵌入器 (可插拔) ---
+class Embedder:
+    """
+    嵌入器协议。子类实现 embed(texts) -> 每段文本一个 (已 L2 归一化的) float 向量列表。
+    name 与 dimension 会写入索引信息，嵌入器变更后索引自动重建。
+    """
+
+    name = "base"
+    dimension = 0
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    """
+    离线的哈希 n-gram 嵌入器 (无需网络与额外依赖)。
+    复用预分类器的文本归一化与 n-gram 提取，以带符号的特征哈希投影到固定维度。
+    """
+
+    name = "hashing"
+
+    def __init__(self, dimension=256):
+        self.dimension = dimension
+
+    def embed(self, texts):
+        vectors = []
+        for text in texts:
+            counts = {}
+            for gram in extract_ngrams(normalize_text(text)):
+                counts[gram] = counts.get(gram, 0) + 1
+
+            vector = [0.0] * self.dimension
+            for gram, count in counts.items():
+                h = zlib.crc32(gram.encode('utf-8'))
+                # (次数取对数，避免高频词主导向量)
+                vector[h % self.dimension] += (1.0 + math.log(count)) * (1.0 if h >> 31 else -1.0)
+            vectors.append(l2_normalize(vector))
+        return vectors
+
+
+class GeminiEmbedder(Embedder):
+    """基于 Gemini embed_content 的嵌入器 (需要网络)。"""
+
+    name = "gemini"
+
+    def __init__(self, api_key, model_name="text-embedding-004", dimension=256):
+        # (延迟导入，使离线嵌入器不依赖 google-genai)
+        from google import genai
+        self.client = genai.Client(api_key=api_key)
+        self.model_name = model_name
+        self.dimension = dimension
+        self.name = f"gemini:{model_name}"
+
+    def embed(self, texts):
+        response = self.client.models.embed_content(
+            model=self.model_name,
+            contents=list(texts),
+            config={"output_dimensionality": self.dimension}
+        )
+        return [l2_normalize(list(embedding.values)) for embedding in response.embeddings]
+
+
+def create_embedder(embedder_config, api_key=None):
+    """
+    根据配置创建嵌入器。
+
+    Args:
+        embedder_config (dict): AI_config.json 中 EMBEDDING_INDEX 的 "EMBEDDER" 配置，TYPE 为 "hashing" 或 "gemini"。
+        api_key (str): Gemini API Key (仅 gemini 嵌入器需要)。
+    """
+    embedder_type = embedder_config.get("TYPE", "hashing")
+    if embedder_type == "gemini":
+        return GeminiEmbedder(
+            api_key,
+            model_name=embedder_config.get("GEMINI_MODEL", "text-embedding-004"),
+            dimension=embedder_config.get("DIMENSION", 256)
+        )
+    if embedder_type != "hashing":
+        print(f"警告：未知的嵌入器类型 {embedder_type}，将使用离线哈希嵌入器。")
+    return HashingEmbedder(dimension=embedder_config.get("DIMENSION", 256))
+
+
+def l2_normalize(vector):
+    norm = math.sqrt(sum(value * value for value in vector))
+    if norm == 0:
+        return vector
+    return [value / norm for value in vector]
+
+
+class EmbeddingIndex:
+    """
+    对话记忆中每封邮件 (主题 + 单封总结) 的本地向量索引，用于按相关性挑选 AI 上下文。
+
+    存储于 index_dir 目录:
+        info.json    嵌入器名称与维度 (变更后索引重建)
+        meta.jsonl   每行一个条目 {"key", "address"}，与向量按行对应 (追加写入)
+        vectors.f32  float32 向量的原始字节 (追加写入；NumPy 与 array 模块读写格式相同)
+
+    同一封邮件可以属于多条对话 (发信有多个收件人)，因此条目以 (address, key) 去重。
+    检索按对话地址限定候选行，使用余弦相似度 (向量已归一化，即点积) 取 top-k。
+    """
+
+    def __init__(self, index_dir, embedder):
+        self.index_dir = index_dir
+        self.embedder = embedder
+        self.dimension = embedder.dimension
+        self.info_path = os.path.join(index_dir, "info.json")
+        self.meta_path = os.path.join(index_dir, "meta.jsonl")
+        self.vectors_path = os.path.join(index_dir, "vectors.f32")
+
+        self.lock = threading.Lock()
+        self.row_keys = []  # 行号 -> (address, key)
+        self.rows_by_address = {}  # address -> {key: 行号}
+        self.vectors = None  # NumPy: (N, dimension) float32 矩阵；否则为 array('f')
+        self.load()
+
+    def __len__(self):
+        return len(self.row_keys)
+
+    # --- 持久化 ---
+    def _reset(self):
+        self.row_keys = []
+        self.rows_by_address = {}
+        self.vectors = np.zeros((0, self.dimension), dtype=np.float32) if np is not None else array('f')
+
+    def load(self):
+        self._reset()
+        os.makedirs(self.index_dir, exist_ok=True)
+        info = {"embedder": self.embedder.name, "dimension": self.dimension}
+        try:
+            if os.path.exists(self.info_path):
+                with open(self.info_path, 'r', encoding='utf-8') as f:
+                    saved_info = json.load(f)
+                if saved_info != info:
+                    print(f"信息：嵌入器已从 {saved_info.get('embedder')} 变更为 {self.embedder.name}，向量索引将重建。")
+                    self._clear_files()
+
+            if os.path.exists(self.meta_path) and os.path.exists(self.vectors_path):
+                with open(self.meta_path, 'r', encoding='utf-8') as f:
+                    metas = [json.loads(line) for line in f if line.strip()]
+                with open(self.vectors_path, 'rb') as f:
+                    raw = f.read()
+                # (中断写入时两个文件的行数可能不一致，以较短者为准)
+                row_count = min(len(metas), len(raw) // (4 * self.dimension))
+                raw = raw[:row_count * 4 * self.dimension]
+                if np is not None:
+                    self.vectors = np.frombuffer(raw, dtype=np.float32).reshape(row_count, self.dimension).copy()
+                else:
+                    self.vectors.frombytes(raw)
+                for meta in metas[:row_count]:
+                    self._register(meta["address"], meta["key"])
+        except Exception as e:
+            print(f"警告：向量索引 {self.index_dir} 读取失败 ({e})，将重建。")
+            self._reset()
+            self._clear_files()
+
+        with open(self.info_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False)
+
+    def _clear_files(self):
+        for path in (self.meta_path, self.vectors_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _register(self, address, key):
+        self.rows_by_address.setdefault(address, {})[key] = len(self.row_keys)
+        self.row_keys.append((address, key))
+
+    # --- 维护 ---
+    def contains(self, address, key):
+        return key in self.rows_by_address.get(address, {})
+
+    def add(self, entries):
+        """
+        增量加入条目，已存在的 (address, key) 会被跳过。
+
+        Args:
+            entries: (address, key, text) 的列表。
+
+        Returns:
+            int: 新加入的条目数。
+        """
+        with self.lock:
+            seen = set()
+            pending = []
+            for address, key, text in entries:
+                if self.contains(address, key) or (address, key) in seen:
+                    continue
+                seen.add((address, key))
+                pending.append((address, key, text))
+            if not pending:
+                return 0
+
+            # 同一封邮件 (同一 key) 只嵌入一次
+            texts_by_key = {key: text for _, key, text in pending}
+            keys = list(texts_by_key)
+            vector_by_key = dict(zip(keys, self.embedder.embed([texts_by_key[key] for key in keys])))
+
+            new_vectors = array('f')
+            for address, key, _ in pending:
+                new_vectors.extend(vector_by_key[key])
+                self._register(address, key)
+
+            if np is not None:
+                block = np.frombuffer(new_vectors.tobytes(), dtype=np.float32).reshape(len(pending), self.dimension)
+                self.vectors = np.vstack([self.vectors, block])
+            else:
+                self.vectors.extend(new_vectors)
+
+            try:
+                with open(self.meta_path, 'a', encoding='utf-8') as f:
+                    f.writelines(json.dumps({"address": address, "key": key}, ensure_ascii=False) + "\n"
+                                 for address, key, _ in pending)
+                with open(self.vectors_path, 'ab') as f:
+                    f.write(new_vectors.tobytes())
+            except IOError as e:
+                print(f"错误：写入向量索引 {self.index_dir} 失败: {e}")
+            return len(pending)
+
+    # --- 检索 ---
+    def _row_vector(self, row):
+        if np is not None:
+            return self.vectors[row]
+        start = row * self.dimension
+        return self.vectors[start:start + self.dimension]
+
+    def similarities(self, address, keys, query_vector):
+        """
+        计算某条对话中指定邮件与 query_vector 的余弦相似度。
+
+        Returns:
+            dict: {key: 相似度}，未被索引的 key 不会出现在结果中。
+        """
+        rows_of_address = self.rows_by_address.get(address, {})
+        indexed = [(key, rows_of_address[key]) for key in keys if key in rows_of_address]
+        if not indexed:
+            return {}
+        if np is not None:
+            scores = self.vectors[[row for _, row in indexed]] @ np.asarray(query_vector, dtype=np.float32)
+            return {key: float(score) for (key, _), score in zip(indexed, scores)}
+        return {key: sum(a * b for a, b in zip(self._row_vector(row), query_vector)) for key, row in indexed}
+
+    def centroid(self, address, keys):
+        """返回指定邮件向量的归一化均值 (作为 "这段对话在讲什么" 的查询向量)，没有可用向量时返回 None。"""
+        rows_of_address = self.rows_by_address.get(address, {})
+        rows = [rows_of_address[key] for key in keys if key in rows_of_address]
+        if not rows:
+            return None
+        if np is not None:
+            mean = self.vectors[rows].mean(axis=0)
+            norm = float(np.linalg.norm(mean))
+            return (mean / norm).tolist() if norm else mean.tolist()
+        total = [0.0] * self.dimension
+        for row in rows:
+            for i, value in enumerate(self._row_vector(row)):
+                total[i] += value
+        return l2_normalize(total)
+
+    def search(self, query_text, k=5, address=None):
+        """
+        以文本检索最相关的 k 个条目 (address 为空时在全部对话中检索)。
+
+        Returns:
+            list: [(address, key, 相似度), ...]，按相似度从高到低。
+        """
+        if not self.row_keys:
+            return []
+        query_vector = self.embedder.embed([query_text])[0]
+        if address is not None:
+            scores = self.similarities(address, list(self.rows_by_address.get(address, {})), query_vector)
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [(address, key, score) for key, score in ranked]
+
+        if np is not None:
+            scores = self.vectors @ np.asarray(query_vector, dtype=np.float32)
+            k = min(k, len(scores))
+            top_rows = np.argpartition(-scores, k - 1)[:k]
+            top_rows = top_rows[np.argsort(-scores[top_rows])]
+            return [(*self.row_keys[row], float(scores[row])) for row in top_rows]
+        scored = [(sum(a * b for a, b in zip(self._row_vector(row), query_vector)), row)
+                  for row in range(len(self.row_keys))]
+        scored.sort(reverse=True)
+        return [(*self.row_keys[row], score) for score, row in scored[:k]]
+
+
+def select_relevant_emails(index, address, email_list, key_func, text_func, budget_chars, recent_count=3):
+    """
+    在字数预算内为 AI 挑选一条对话中最相关的邮件，按原有时间顺序返回。
+
+    - 最近的 recent_count 封邮件总是优先保留 (最新进展)。
+    - 其余预算按与对话主题 (所有已索引邮件向量的均值) 的余弦相似度从高到低填充，
+      而不是像截断那样只保留恰好排在前面的内容。
+    - 全部邮件都放得下时原样返回；索引不可用时退回保留最近的邮件。
+
+    Args:
+        email_list: 已按时间排序的邮件列表。
+        key_func: email -> 索引中的 key。
+        text_func: email -> 该邮件在 prompt 中占用的文本 (用于计算预算)。
+        budget_chars: 字数预算 (近似 token 预算)。
+    """
+    costs = [len(text_func(email)) + 1 for email in email_list]
+    if sum(costs) <= budget_chars:
+        return list(email_list)
+
+    selected = set()
+    used = 0
+    # 1. 最近的邮件
+    for position in range(len(email_list) - 1, max(len(email_list) - 1 - recent_count, -1), -1):
+        if used + costs[position] > budget_chars and selected:
+            break
+        selected.add(position)
+        used += costs[position]
+
+    # 2. 按相关性填充剩余预算
+    keys = [key_func(email) for email in email_list]
+    query_vector = index.centroid(address, keys) if index is not None else None
+    if query_vector is not None:
+        scores = index.similarities(address, keys, query_vector)
+        ranked = sorted(
+            (position for position in range(len(email_list)) if position not in selected),
+            key=lambda position: scores.get(keys[position], -1.0), reverse=True
+        )
+    else:
+        ranked = [position for position in range(len(email_list) - 1, -1, -1) if position not in selected]
+
+    for position in ranked:
+        if used + costs[position] <= budget_chars:
+            selected.add(position)
+            used += costs[position]
+
+    return [email_list[position] for position in sorted(selected)]
@@ -0,0 +1,135 @@
+import re
+
+# --- 规则动作 ---
+ACTION_INVALID = "invalid"  # 直接判为无效邮件 (使用规则的 SCORE)，不交由 AI
+ACTION_VALID = "valid"  # 直接判为有效邮件 (使用规则的 SCORE)，之后仍由 AI 总结
+ACTION_NO_CONVERSATION = "no_conversation"  # 照常分类，但不参与对话记忆 (自动发送的邮件)
+RULE_ACTIONS = (ACTION_INVALID, ACTION_VALID, ACTION_NO_CONVERSATION)
+
+# 匹配发件人 (sender_name，即 @ 之前的部分) 的规则使用的伪头部名
+SENDER_FIELD = "sender_name"
+
+
+class HeaderRuleEngine:
+    """
+    基于邮件头部与发件人地址的规则引擎，在任何 AI 阶段之前对收信进行分类或分流。
+
+    - 规则按配置顺序排列，先命中的规则生效。
+    - 每条规则针对一个头部 (HEADER，如 List-Unsubscribe / Precedence / Auto-Submitted / X-Mailer /
+      Authentication-Results) 或发件人 (SENDER: true)，PATTERN 为正则 (忽略大小写，缺省表示头部存在即命中)，
+      PATTERNS 为子串列表 (转义后合并为一个正则)。
+    - 同一字段的所有规则在初始化时编译为一个按顺序尝试的正则，每个字段只扫描一次。
+    - 评分表中已有评分的发件人默认不受规则影响，OVERRIDE_SCORE_LIST 为 true 的规则 (如认证失败) 除外。
+    - NO_REPLY_PATTERNS 作为最后一条发件人规则追加 (动作 no_conversation)，与原先的对话过滤行为一致。
+    - 头部只在解析时读取并判断一次，邮件只保存命中的规则名 (triage)，之后通过 match() 按名称取回规则，
+      原始头部不写入任何存储。
+    """
+
+    def __init__(self, rules=(), no_reply_patterns=()):
+        self.rules = []
+        for index, rule in enumerate(rules):
+            self.rules.append(self._normalize_rule(rule, index))
+        if no_reply_patterns:
+            self.rules.append(self._normalize_rule({
+                "NAME": "no_reply_sender",
+                "SENDER": True,
+                "PATTERNS": list(no_reply_patterns),
+                "ACTION": ACTION_NO_CONVERSATION
+            }, len(self.rules)))
+
+        # 字段名 (小写) -> 编译后的组合正则；分组名 r<序号> 对应 self.rules 中的规则
+        self.field_patterns = {}
+        grouped = {}
+        for index, rule in enumerate(self.rules):
+            grouped.setdefault(rule["field"], []).append(
+                f"(?P<r{index}>(?=.*?(?:{rule['pattern']})))" if rule["pattern"] else f"(?P<r{index}>)"
+            )
+        for field, alternatives in grouped.items():
+            self.field_patterns[field] = re.compile("^(?:" + "|".join(alternatives) + ")", re.IGNORECASE | re.DOTALL)
+        self.rules_by_name = {rule["name"]: rule for rule in self.rules}
+
+    @classmethod
+    def from_config(cls, config, no_reply_patterns=()):
+        rules = config.get("RULES", []) if config.get("ENABLED", True) else []
+        return cls(rules, no_reply_patterns)
+
+    @staticmethod
+    def _normalize_rule(rule, index):
+        action = rule.get("ACTION", ACTION_INVALID)
+        if action not in RULE_ACTIONS:
+            raise ValueError(f"头部规则 {rule.get('NAME', index)} 的动作 {action} 无效，可选: {', '.join(RULE_ACTIONS)}")
+
+        if rule.get("SENDER"):
+            field = SENDER_FIELD
+        elif rule.get("HEADER"):
+            field = rule["HEADER"].lower()
+        else:
+            raise ValueError(f"头部规则 {rule.get('NAME', index)} 缺少 HEADER 或 SENDER")
+
+        if rule.get("PATTERNS"):
+            pattern = "|".join(re.escape(text) for text in rule["PATTERNS"])
+        else:
+            pattern = rule.get("PATTERN") or ""
+        # (提前编译一次，配置中的正则写错时在启动阶段报错)
+        re.compile(pattern)
+
+        return {
+            "name": rule.get("NAME", f"rule_{index}"),
+            "field": field,
+            "pattern": pattern,
+            "action": action,
+            "score": rule.get("SCORE", 1),
+            "override_score_list": rule.get("OVERRIDE_SCORE_LIST", False)
+        }
+
+    @property
+    def header_names(self):
+        """规则用到的头部名 (小写)，抓取邮件时只需解析这些头部。"""
+        return [field for field in self.field_patterns if field != SENDER_FIELD]
+
+    def evaluate(self, email):
+        """
+        返回邮件命中的第一条规则 (按配置顺序)，未命中时返回 None。
+        规则字典包含 name / action / score / override_score_list。
+        """
+        headers = email.get("headers") or {}
+        if "sender_name" in email:
+            sender_name = email.get("sender_name") or ""
+        else:
+            # (已格式化的收信只有 sender 字段)
+            sender_name = (email.get("sender") or "").partition("@")[0]
+
+        best = None
+        for field, pattern in self.field_patterns.items():
+            value = sender_name if field == SENDER_FIELD else headers.get(field)
+            if value is None:
+                continue
+            match = pattern.match(value)
+            if match is None:
+                continue
+            index = int(match.lastgroup[1:])
+            if best is None or index < best:
+                best = index
+                if best == 0:
+                    break
+        return self.rules[best] if best is not None else None
+
+    def match(self, email):
+        """
+        返回邮件适用的规则 (未命中时返回 None)。
+        解析时已判断过的邮件带有 triage 键 (命中的规则名，未命中为 None)，直接按名称取回；
+        没有 triage 键的旧数据按头部与发件人重新判断。
+        """
+        if "triage" in email:
+            return self.rules_by_name.get(email["triage"])
+        return self.evaluate(email)
+
+    def excludes_conversation(self, email, listed=False):
+        """
+        邮件是否应排除在对话记忆之外：命中除 valid 以外的任何规则 (群发、自动发送或 no-reply 类地址)。
+        listed 为 True (发件人在评分表中已有评分) 时，与分类一致，只有 OVERRIDE_SCORE_LIST 的规则生效。
+        """
+        rule = self.match(email)
+        if rule is None or rule["action"] == ACTION_VALID:
+            return False
+        return not listed or rule["override_score_list"]
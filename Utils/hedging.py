@@ -0,0 +1,147 @@
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+
+class RequestHedger:
+    """
+    AI 请求对冲 (hedged requests)，用于削减偶发的长时间挂起造成的尾延迟。
+
+    - 每个键 (阶段:模型) 在线记录最近 window 次调用的耗时，取第 percentile 百分位作为对冲阈值
+      (样本不足 min_samples 时不对冲，阈值不低于 min_delay_seconds)。
+    - 调用超过阈值仍未返回时，发出一个相同的副本请求，先返回有效结果 (通过 validate 校验) 的请求胜出；
+      落后的请求无法中止，在后台线程中自然结束，结果被丢弃。
+    - 副本请求总数不超过主请求数的 budget_ratio (例如 5%)，平均成本基本不变。
+    - 副本请求由调用方的 admit/release 计入并发控制与速率限制: admit() 返回 False (没有空闲名额) 时不对冲，
+      副本结束后以其结果 (或异常) 调用 release(error)。
+    """
+
+    def __init__(self, percentile=95, budget_ratio=0.05, min_samples=20, min_delay_seconds=2.0, window=200):
+        self.percentile = percentile
+        self.budget_ratio = budget_ratio
+        self.min_samples = min_samples
+        self.min_delay_seconds = min_delay_seconds
+        self.window = window
+
+        self.lock = threading.Lock()
+        self.latencies = {}  # 键 -> deque(最近的耗时)
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            percentile=config.get("PERCENTILE", 95),
+            budget_ratio=config.get("BUDGET_RATIO", 0.05),
+            min_samples=config.get("MIN_SAMPLES", 20),
+            min_delay_seconds=config.get("MIN_DELAY_SECONDS", 2.0),
+            window=config.get("WINDOW", 200)
+        )
+
+    # --- 耗时统计 ---
+    def record(self, key, seconds):
+        with self.lock:
+            samples = self.latencies.get(key)
+            if samples is None:
+                samples = self.latencies[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def threshold(self, key):
+        """当前的对冲阈值 (秒)；样本不足时返回 None。"""
+        with self.lock:
+            samples = sorted(self.latencies.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return max(self.min_delay_seconds, samples[index])
+
+    def _take_budget(self):
+        with self.lock:
+            if self.hedges + 1 > self.budget_ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    # --- 调用 ---
+    def _refund_budget(self):
+        with self.lock:
+            self.hedges -= 1
+
+    @staticmethod
+    def _start(func, args, kwargs, validate=None, release=None):
+        """在守护线程中执行调用 (挂起的请求不会阻止程序退出)。validate 抛出异常时视为该请求失败。"""
+        future = Future()
+
+        def run():
+            error = None
+            try:
+                result = func(*args, **kwargs)
+                if validate:
+                    validate(result)
+                future.set_result(result)
+            except Exception as e:
+                error = e
+                future.set_exception(e)
+            finally:
+                if release:
+                    release(error)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def call(self, key, func, *args, admit=None, release=None, validate=None, **kwargs):
+        """
+        执行 func(*args, **kwargs)，超过阈值时对冲；返回先通过校验的结果，全部失败时抛出主请求的异常。
+
+        Args:
+            admit: 发出副本请求前调用，返回 False 时不对冲 (例如并发名额或速率配额不足)。
+            release: 副本请求结束后调用 release(error) (成功时 error 为 None)。
+            validate: 对冲时校验结果 (例如解析 JSON)，抛出异常表示结果无效，由另一个请求的结果胜出。
+        """
+        with self.lock:
+            self.requests += 1
+        started_at = time.monotonic()
+        threshold = self.threshold(key)
+
+        if threshold is None:
+            result = func(*args, **kwargs)
+            self.record(key, time.monotonic() - started_at)
+            return result
+
+        primary = self._start(func, args, kwargs, validate)
+        wait([primary], timeout=threshold)
+        hedging = not primary.done() and self._take_budget()
+        if hedging and admit and not admit():
+            self._refund_budget()
+            hedging = False
+        if not hedging:
+            result = primary.result()
+            self.record(key, time.monotonic() - started_at)
+            return result
+
+        print(f"信息：AI 请求 ({key}) 超过 p{self.percentile} 耗时 {threshold:.1f} 秒仍未返回，发出对冲请求。")
+        hedge = self._start(func, args, kwargs, validate, release)
+        pending = {primary, hedge}
+        errors = {}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # (记录调用方实际等待的时间，使阈值反映尾部情况)
+                    self.record(key, time.monotonic() - started_at)
+                    if future is hedge:
+                        with self.lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                errors[future] = future.exception()
+        raise errors.get(primary) or errors[hedge]
+
+    def snapshot(self):
+        with self.lock:
+            keys = list(self.latencies)
+            stats = {"requests": self.requests, "hedges": self.hedges, "hedge_wins": self.hedge_wins}
+        stats["thresholds"] = {key: self.threshold(key) for key in keys}
+        return stats
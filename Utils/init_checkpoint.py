@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+
+from Utils.util import datetime_to_json
+
+# --- 初始化任务的阶段 ---
+STAGE_CONVERSATION_CHECK = "conversation_check"  # key: 邮件键 (get_email_key), value: 是否为对话
+STAGE_SUMMARY = "summary"  # key: 对话地址, value: {"general_summary", "summary_watermark", "chunk_summaries"}
+STAGE_STYLE = "style"  # key: 对话地址, value: style_profile
+INIT_STAGES = (STAGE_CONVERSATION_CHECK, STAGE_SUMMARY, STAGE_STYLE)
+
+
+class InitCheckpoint:
+    """
+    init_conversation_history 的断点续跑日志 (JSON Lines 追加写入)。
+
+    每完成一项工作 (一封邮件的对话筛选 / 一条对话的总结 / 一条对话的口吻分析) 追加一行:
+        {"stage": ..., "key": ..., "value": ...}
+    重启时读取日志，跳过已完成的项；进程在写入中途被中断时最后一行可能不完整，读取时忽略。
+    初始化全部完成并保存对话历史后删除日志。
+    """
+
+    def __init__(self, checkpoint_path):
+        self.checkpoint_path = checkpoint_path
+        self.lock = threading.Lock()
+        self.completed = {stage: {} for stage in INIT_STAGES}
+        self.load()
+
+    @property
+    def exists(self):
+        return os.path.exists(self.checkpoint_path)
+
+    def load(self):
+        if not self.exists:
+            return
+        skipped = 0
+        with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                    self.completed[entry["stage"]][entry["key"]] = entry["value"]
+                except (ValueError, KeyError, TypeError):
+                    skipped += 1
+        if skipped:
+            print(f"警告：初始化检查点中有 {skipped} 行无法解析 (可能是中断时未写完)，已忽略。")
+
+    def count(self, stage):
+        return len(self.completed[stage])
+
+    def get(self, stage, key, default=None):
+        return self.completed[stage].get(key, default)
+
+    def has(self, stage, key):
+        return key in self.completed[stage]
+
+    def record_many(self, stage, items):
+        """
+        Args:
+            items: (key, value) 的可迭代对象。
+        """
+        lines = []
+        with self.lock:
+            for key, value in items:
+                self.completed[stage][key] = value
+                lines.append(json.dumps({"stage": stage, "key": key, "value": value},
+                                        ensure_ascii=False, default=datetime_to_json) + "\n")
+            if not lines:
+                return
+            try:
+                with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+                    f.writelines(lines)
+            except IOError as e:
+                print(f"错误：写入初始化检查点 {self.checkpoint_path} 失败: {e}")
+
+    def record(self, stage, key, value):
+        self.record_many(stage, [(key, value)])
+
+    def clear(self):
+        with self.lock:
+            self.completed = {stage: {} for stage in INIT_STAGES}
+            try:
+                if self.exists:
+                    os.remove(self.checkpoint_path)
+            except OSError as e:
+                print(f"警告：删除初始化检查点 {self.checkpoint_path} 失败: {e}")
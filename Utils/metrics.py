@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+
+def get_percentile(sorted_samples, percentile):
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(len(sorted_samples) * percentile / 100))
+    return sorted_samples[index]
+
+
+class MetricsRegistry:
+    """
+    轻量的进程内指标：计数器、计时器 (耗时直方图) 与瞬时值 (gauge)。
+
+    - 计数器与计时器同时按 "本周期" 与 "累计" 两个范围统计；周期结束时 end_cycle() 生成结构化报告并清空本周期数据。
+    - 计时器保留最近 sample_limit 个样本用于计算百分位 (本周期与累计各一份)。
+    - 所有方法线程安全；enabled 为 False 时全部为空操作。
+    """
+
+    def __init__(self, enabled=True, sample_limit=1000):
+        self.enabled = enabled
+        self.sample_limit = sample_limit
+        self.lock = threading.Lock()
+
+        self.cycle_id = 0
+        self.cycle_started_at = None
+        self.cycle_wall_started_at = None
+        self.cycle_counters = {}
+        self.cycle_timers = {}
+        self.total_counters = {}
+        self.total_timers = {}
+        self.gauges = {}
+        self.last_report = None
+
+    # --- 记录 ---
+    def incr(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.cycle_counters[name] = self.cycle_counters.get(name, 0) + value
+            self.total_counters[name] = self.total_counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[name] = value
+
+    def _observe(self, timers, name, seconds):
+        timer = timers.get(name)
+        if timer is None:
+            timer = timers[name] = {"count": 0, "total": 0.0, "max": 0.0, "samples": deque(maxlen=self.sample_limit)}
+        timer["count"] += 1
+        timer["total"] += seconds
+        timer["max"] = max(timer["max"], seconds)
+        timer["samples"].append(seconds)
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            self._observe(self.cycle_timers, name, seconds)
+            self._observe(self.total_timers, name, seconds)
+
+    def timer(self, name):
+        """with METRICS.timer("stage.xxx"): ... 记录代码块的耗时 (异常时同样记录)。"""
+        if not self.enabled:
+            return nullcontext()
+        return self._timer(name)
+
+    @contextmanager
+    def _timer(self, name):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started_at)
+
+    def persist(self, file_path):
+        """with METRICS.persist(path): 写入文件 —— 记录写入耗时 (persist.<文件名>) 与写入字节数 (bytes_written)。"""
+        if not self.enabled:
+            return nullcontext()
+        return self._persist(file_path)
+
+    @contextmanager
+    def _persist(self, file_path):
+        with self._timer("persist." + os.path.basename(file_path)):
+            yield
+        try:
+            self.incr("bytes_written", os.path.getsize(file_path))
+        except OSError:
+            pass
+
+    # --- 汇总 ---
+    @staticmethod
+    def _summarize_timers(timers):
+        summary = {}
+        for name, timer in sorted(timers.items()):
+            samples = sorted(timer["samples"])
+            summary[name] = {
+                "count": timer["count"],
+                "total_seconds": round(timer["total"], 4),
+                "p50_seconds": round(get_percentile(samples, 50), 4),
+                "p95_seconds": round(get_percentile(samples, 95), 4),
+                "max_seconds": round(timer["max"], 4)
+            }
+        return summary
+
+    def start_cycle(self):
+        with self.lock:
+            self.cycle_id += 1
+            self.cycle_started_at = time.perf_counter()
+            self.cycle_wall_started_at = datetime.now(timezone.utc)
+            self.cycle_counters = {}
+            self.cycle_timers = {}
+            return self.cycle_id
+
+    def end_cycle(self, **extra):
+        """
+        结束本周期并返回结构化报告:
+            {"cycle_id", "started_at", "wall_seconds", "counters", "timers": {名称: {count, total_seconds, p50/p95/max}},
+             "gauges", ...extra}
+        """
+        with self.lock:
+            report = {
+                "cycle_id": self.cycle_id,
+                "started_at": self.cycle_wall_started_at.isoformat() if self.cycle_wall_started_at else None,
+                "wall_seconds": round(time.perf_counter() - self.cycle_started_at, 4) if self.cycle_started_at else None,
+                "counters": dict(sorted(self.cycle_counters.items())),
+                "timers": self._summarize_timers(self.cycle_timers),
+                "gauges": dict(self.gauges)
+            }
+            report.update(extra)
+            self.cycle_counters = {}
+            self.cycle_timers = {}
+            self.cycle_started_at = None
+            self.last_report = report
+        return report
+
+    def snapshot(self):
+        """累计指标 (自进程启动以来)。"""
+        with self.lock:
+            return {
+                "counters": dict(sorted(self.total_counters.items())),
+                "timers": self._summarize_timers(self.total_timers),
+                "gauges": dict(self.gauges),
+                "cycle_id": self.cycle_id,
+                "cycle_running": self.cycle_started_at is not None,
+                "cycle_running_seconds": round(time.perf_counter() - self.cycle_started_at, 1)
+                if self.cycle_started_at is not None else None,
+                "last_report": self.last_report
+            }
+
+
+class CycleReportWriter:
+    """将每个周期的报告按 JSON Lines 追加到文件，超过 max_bytes 时轮转 (保留 backup_count 个旧文件)。"""
+
+    def __init__(self, file_path, max_bytes=5 * 1024 * 1024, backup_count=5):
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.logger = None
+
+    def _get_logger(self):
+        if self.logger is None:
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            handler = RotatingFileHandler(self.file_path, maxBytes=self.max_bytes, backupCount=self.backup_count,
+                                          encoding='utf-8')
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger = logging.getLogger(f"cycle_report.{self.file_path}")
+            self.logger.setLevel(logging.INFO)
+            self.logger.propagate = False
+            self.logger.addHandler(handler)
+        return self.logger
+
+    def write(self, report):
+        try:
+            self._get_logger().info(json.dumps(report, ensure_ascii=False, default=str))
+        except Exception as e:
+            print(f"警告：写入周期报告 {self.file_path} 失败: {e}")
+
+
+# 进程内共享的指标 (mail_AutoProcess 与 AI_Handler 共用同一个实例)
+METRICS = MetricsRegistry()
@@ -0,0 +1,132 @@
+import queue
+import threading
+import time
+
+# 数据流结束标记
+END_OF_STREAM = object()
+
+
+class StreamPipeline:
+    """
+    有界队列连接的流式流水线：生产者线程 -> 若干处理线程 -> 消费者 (调用方线程按小批次取出)。
+
+    - 每个阶段在独立线程中运行，队列满时上游阻塞 (背压)，内存占用与队列长度成正比，与邮件总数无关。
+    - 任一阶段出错时整条流水线停止，错误在消费者一侧重新抛出。
+    - 消费者中途退出 (异常或提前结束) 时调用 stop()，上游线程在下一次放入队列时退出。
+    """
+
+    def __init__(self, producer, stages=(), queue_size=64, poll_seconds=0.5):
+        """
+        Args:
+            producer: producer(emit)，逐条调用 emit(item) 产生数据；emit 返回 False 表示流水线已停止。
+            stages: 处理函数列表，item -> item (返回 None 表示丢弃)。
+            queue_size: 每个阶段之间队列的最大长度。
+        """
+        self.poll_seconds = poll_seconds
+        self.stop_event = threading.Event()
+        self.errors = []
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+        self.threads = [threading.Thread(target=self._run_producer, args=(producer, self.queues[0]), daemon=True)]
+        for index, stage in enumerate(stages):
+            self.threads.append(threading.Thread(
+                target=self._run_stage, args=(stage, self.queues[index], self.queues[index + 1]), daemon=True
+            ))
+
+    # --- 阶段线程 ---
+    def _put(self, out_queue, item):
+        while not self.stop_event.is_set():
+            try:
+                out_queue.put(item, timeout=self.poll_seconds)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fail(self, error):
+        self.errors.append(error)
+        self.stop_event.set()
+
+    def _run_producer(self, producer, out_queue):
+        try:
+            producer(lambda item: self._put(out_queue, item))
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(out_queue, END_OF_STREAM)
+
+    def _run_stage(self, stage, in_queue, out_queue):
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    item = in_queue.get(timeout=self.poll_seconds)
+                except queue.Empty:
+                    continue
+                if item is END_OF_STREAM:
+                    break
+                result = stage(item)
+                if result is not None and not self._put(out_queue, result):
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(out_queue, END_OF_STREAM)
+
+    # --- 消费者 ---
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def close(self):
+        """停止流水线并等待各阶段线程退出 (生产者可能正在进行一次网络请求，需等待其返回)。"""
+        self.stop()
+        for thread in self.threads:
+            if thread.is_alive():
+                thread.join()
+
+    def depths(self):
+        """各阶段队列当前的长度 (用于观测)。"""
+        return [q.qsize() for q in self.queues]
+
+    def iter_batches(self, batch_size, max_wait_seconds):
+        """
+        按小批次取出最终阶段的结果：凑满 batch_size，或批次中第一条数据已等待 max_wait_seconds 时产出。
+        数据流结束或有阶段出错时先产出已取出的剩余数据，之后抛出该错误；仍在队列中的数据被丢弃 (由调用方重新获取)。
+        """
+        output = self.queues[-1]
+        batch = []
+        batch_started_at = None
+        try:
+            while True:
+                timeout = self.poll_seconds
+                if batch:
+                    timeout = max(0.0, min(timeout, batch_started_at + max_wait_seconds - time.monotonic()))
+                try:
+                    item = output.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                    if self.stop_event.is_set() and not batch:
+                        break
+
+                if item is END_OF_STREAM:
+                    break
+                if item is not None:
+                    if not batch:
+                        batch_started_at = time.monotonic()
+                    batch.append(item)
+
+                if batch and (len(batch) >= batch_size or time.monotonic() - batch_started_at >= max_wait_seconds):
+                    yield batch
+                    batch = []
+
+            # (已取出的数据照常产出，即使有阶段出错；错误在之后抛出)
+            if batch:
+                yield batch
+        finally:
+            self.close()
+
+        if self.errors:
+            raise self.errors[0]
@@ -0,0 +1,97 @@
+import time
+
+
+class AdaptivePollScheduler:
+    """
+    根据观测到的来信速率自适应调整邮箱轮询间隔。
+
+    - 每个周期记录新抓取的邮件数，按指数加权平均估计来信速率 (封/秒)。
+    - 有新邮件时，间隔取 target_emails_per_cycle / 来信速率 (来信越密集，间隔越短)；
+      来信加速时至少按 backoff_factor 缩短一次。
+    - 没有新邮件时，间隔按 backoff_factor 指数退避 (安静时段减少无用的登录与搜索)。
+    - 工作队列仍有积压时，间隔不超过 backlog_interval，尽快处理遗留工作。
+    - 间隔始终限制在 [min_interval, max_interval] 内；间隔从上一周期开始时计算，
+      周期本身耗时超过间隔时，下一周期在上一周期结束后立即开始 (不会重叠)。
+    """
+
+    def __init__(self, base_interval=60, min_interval=15, max_interval=900, backoff_factor=1.5,
+                 target_emails_per_cycle=10, rate_alpha=0.3, backlog_interval=None, enabled=True):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.target_emails_per_cycle = target_emails_per_cycle
+        self.rate_alpha = rate_alpha
+        self.backlog_interval = backlog_interval if backlog_interval is not None else min_interval
+        self.enabled = enabled
+
+        self.interval = base_interval
+        self.rate = 0.0  # 封/秒
+        self.last_poll_at = None
+        self.cycle_arrivals = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            base_interval=config.get("BASE_INTERVAL_SECONDS", 60),
+            min_interval=config.get("MIN_INTERVAL_SECONDS", 15),
+            max_interval=config.get("MAX_INTERVAL_SECONDS", 900),
+            backoff_factor=config.get("BACKOFF_FACTOR", 1.5),
+            target_emails_per_cycle=config.get("TARGET_EMAILS_PER_CYCLE", 10),
+            rate_alpha=config.get("RATE_ALPHA", 0.3),
+            backlog_interval=config.get("BACKLOG_INTERVAL_SECONDS"),
+            enabled=config.get("ENABLED", False)
+        )
+
+    def _clamp(self, seconds):
+        return min(self.max_interval, max(self.min_interval, seconds))
+
+    def start_cycle(self, now=None):
+        """周期开始时调用 (抓取之前)。返回本周期距上一周期开始的秒数 (首个周期为 None)。"""
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.last_poll_at if self.last_poll_at is not None else None
+        self.last_poll_at = now
+        self.cycle_arrivals = 0
+        return elapsed
+
+    def record_arrivals(self, count):
+        """记录本周期新抓取的邮件数 (可多次调用累加)。"""
+        self.cycle_arrivals += count
+
+    def finish_cycle(self, elapsed, backlog=0, failed=False):
+        """
+        周期结束时调用，更新来信速率并计算下一次的轮询间隔。
+
+        Args:
+            elapsed: 本周期与上一周期开始时间的间隔 (start_cycle 的返回值)。
+            backlog: 周期结束时工作队列中积压的工作数。
+            failed: 本周期是否因异常中断 (中断时不更新速率与间隔)。
+        Returns:
+            float: 下一次轮询间隔 (秒，从本周期开始时计算)。
+        """
+        if not self.enabled:
+            return self.base_interval
+        if failed:
+            return self.interval
+
+        observed_rate = self.cycle_arrivals / elapsed if elapsed else 0.0
+        if elapsed:
+            self.rate = self.rate_alpha * observed_rate + (1 - self.rate_alpha) * self.rate
+
+        if self.cycle_arrivals > 0:
+            # (来信加速时按本周期的速率快速收缩，且至少按退避系数缩短一次；来信减少后随平均速率放宽)
+            interval = self.target_emails_per_cycle / max(self.rate, observed_rate)
+            if observed_rate >= self.rate:
+                interval = min(interval, self.interval / self.backoff_factor)
+            interval = self._clamp(interval)
+        else:
+            interval = self._clamp(self.interval * self.backoff_factor)
+        if backlog:
+            interval = min(interval, self.backlog_interval)
+        self.interval = interval
+        return interval
+
+    def wait_seconds(self, cycle_seconds):
+        """扣除本周期自身耗时后，距离下一周期开始还需等待的秒数。"""
+        interval = self.interval if self.enabled else self.base_interval
+        return max(0.0, interval - cycle_seconds)
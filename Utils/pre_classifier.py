@@ -0,0 +1,278 @@
+import json
+import math
+import os
+import re
+import zlib
+
+# --- 特征哈希参数 ---
+HASH_BUCKETS = 1 << 18
+URL_PATTERN = re.compile(r'https?://\S+|www\.\S+')
+EMAIL_PATTERN = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+')
+DIGIT_PATTERN = re.compile(r'\d+')
+# 拉丁字母单词 / 连续的 CJK 字符 (中日韩统一表意文字、平假名、片假名)
+WORD_PATTERN = re.compile(r'[a-z0-9_]+|[぀-ヿ㐀-鿿]+')
+
+
+def normalize_text(text):
+    """
+    将邮件文本归一化，去掉与分类无关、每封邮件都不同的部分 (链接、邮箱地址、数字)。
+    """
+    if not text:
+        return ""
+    text = text.lower()
+    text = URL_PATTERN.sub(' <url> ', text)
+    text = EMAIL_PATTERN.sub(' <mail> ', text)
+    text = DIGIT_PATTERN.sub('0', text)
+    return text
+
+
+def extract_ngrams(text, word_bigrams=True):
+    """
+    从归一化后的文本中提取 n-gram：
+    - 拉丁文本：单词 unigram (+ word_bigrams 为 True 时的相邻单词 bigram)
+    - CJK 文本：字符 bigram (没有空格分词，用字符二元组近似)
+    """
+    grams = []
+    previous_word = None
+    for token in WORD_PATTERN.findall(text):
+        if token[0] >= '぀':
+            # CJK 连续片段
+            previous_word = None
+            if len(token) == 1:
+                grams.append(token)
+            else:
+                grams.extend(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            grams.append(token)
+            if word_bigrams and previous_word:
+                grams.append(previous_word + ' ' + token)
+            previous_word = token
+    return grams
+
+
+def hash_features(subject, body, body_limit=2000):
+    """
+    将主题与正文转换为哈希特征桶集合 (二值特征)。
+    主题特征加前缀，与正文特征分开计数。
+
+    Returns:
+        set: 特征桶编号的集合。
+    """
+    features = set()
+    for gram in extract_ngrams(normalize_text(subject)):
+        features.add(zlib.crc32(('s:' + gram).encode('utf-8')) % HASH_BUCKETS)
+    for gram in extract_ngrams(normalize_text((body or "")[:body_limit])):
+        features.add(zlib.crc32(('b:' + gram).encode('utf-8')) % HASH_BUCKETS)
+    return features
+
+
+class HashedNaiveBayes:
+    """
+    基于哈希 n-gram 特征的多项式朴素贝叶斯分类器。
+    只保存计数，因此天然支持增量训练：新样本到来时累加计数即可。
+    """
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.class_doc_counts = {}  # label -> 文档数
+        self.class_feature_totals = {}  # label -> 特征总数
+        self.feature_counts = {}  # label -> {bucket: count}
+
+    @property
+    def total_docs(self):
+        return sum(self.class_doc_counts.values())
+
+    def learn(self, label, features):
+        label = str(label)
+        self.class_doc_counts[label] = self.class_doc_counts.get(label, 0) + 1
+        self.class_feature_totals[label] = self.class_feature_totals.get(label, 0) + len(features)
+        counts = self.feature_counts.setdefault(label, {})
+        for bucket in features:
+            counts[bucket] = counts.get(bucket, 0) + 1
+
+    def predict(self, features):
+        """
+        Returns:
+            tuple: (label, confidence)。模型为空时返回 (None, 0.0)。
+        """
+        total_docs = self.total_docs
+        if total_docs == 0 or not features:
+            return None, 0.0
+
+        log_scores = {}
+        for label, doc_count in self.class_doc_counts.items():
+            counts = self.feature_counts.get(label, {})
+            denominator = math.log(self.class_feature_totals.get(label, 0) + self.alpha * HASH_BUCKETS)
+            score = math.log(doc_count / total_docs)
+            for bucket in features:
+                score += math.log(counts.get(bucket, 0) + self.alpha) - denominator
+            log_scores[label] = score
+
+        # softmax 得到后验概率
+        best_label = max(log_scores, key=log_scores.get)
+        best_score = log_scores[best_label]
+        normalizer = sum(math.exp(s - best_score) for s in log_scores.values())
+        return best_label, 1.0 / normalizer
+
+    def to_dict(self):
+        return {
+            "alpha": self.alpha,
+            "class_doc_counts": self.class_doc_counts,
+            "class_feature_totals": self.class_feature_totals,
+            "feature_counts": {
+                label: {str(bucket): count for bucket, count in counts.items()}
+                for label, counts in self.feature_counts.items()
+            }
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        model = cls(alpha=data.get("alpha", 1.0))
+        model.class_doc_counts = dict(data.get("class_doc_counts", {}))
+        model.class_feature_totals = dict(data.get("class_feature_totals", {}))
+        model.feature_counts = {
+            label: {int(bucket): count for bucket, count in counts.items()}
+            for label, counts in data.get("feature_counts", {}).items()
+        }
+        return model
+
+
+class LocalPreClassifier:
+    """
+    基于 mail_judgement_record.json 训练的本地预分类器。
+
+    包含两个模型:
+    - score: 预测邮件评分 (对应 classification 记录)
+    - conversation: 预测是否为对话型邮件 (对应 conversation_check 记录)
+
+    trained_record_count 记录已消费的判断记录条数 (水位线)，
+    每次只对水位线之后新增的记录做增量训练。
+    """
+
+    # 由本地模型或近似重复索引做出的判断不参与训练，避免自我强化
+    LOCAL_JUDGMENT_TYPES = ("local_classification", "local_conversation_check", "near_duplicate")
+
+    def __init__(self, model_path, confidence_threshold=0.97, min_samples=200):
+        self.model_path = model_path
+        self.confidence_threshold = confidence_threshold
+        self.min_samples = min_samples
+        self.score_model = HashedNaiveBayes()
+        self.conversation_model = HashedNaiveBayes()
+        self.trained_record_count = 0
+        self.caught_up = False
+        self.load()
+
+    # --- 持久化 ---
+    def load(self):
+        try:
+            if os.path.exists(self.model_path) and os.path.getsize(self.model_path) > 0:
+                with open(self.model_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.score_model = HashedNaiveBayes.from_dict(data.get("score_model", {}))
+                self.conversation_model = HashedNaiveBayes.from_dict(data.get("conversation_model", {}))
+                self.trained_record_count = data.get("trained_record_count", 0)
+        except Exception as e:
+            print(f"警告：本地预分类模型 {self.model_path} 读取失败 ({e})，将从判断记录重新训练。")
+            self.reset()
+
+    def save(self):
+        try:
+            with open(self.model_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "trained_record_count": self.trained_record_count,
+                    "score_model": self.score_model.to_dict(),
+                    "conversation_model": self.conversation_model.to_dict()
+                }, f, ensure_ascii=False)
+        except IOError as e:
+            print(f"错误：写入本地预分类模型 {self.model_path} 失败: {e}")
+
+    def reset(self):
+        self.score_model = HashedNaiveBayes()
+        self.conversation_model = HashedNaiveBayes()
+        self.trained_record_count = 0
+
+    # --- 训练 ---
+    def learn_from_judgment_records(self, all_records):
+        """
+        增量训练：只消费 all_records 中水位线之后的记录。
+        若记录文件被清空或截断 (长度小于水位线)，则从头重新训练。
+
+        Returns:
+            int: 本次新学习的样本数。
+        """
+        if len(all_records) < self.trained_record_count:
+            print("提示：判断记录条数少于模型水位线，本地预分类模型将重新训练。")
+            self.reset()
+
+        learned = 0
+        for record in all_records[self.trained_record_count:]:
+            if not isinstance(record, dict):
+                continue
+            judgment_type = record.get("judgment_type")
+            if judgment_type in self.LOCAL_JUDGMENT_TYPES:
+                continue
+
+            features = hash_features(record.get("subject", ""), record.get("body", ""))
+            if not features:
+                continue
+
+            if judgment_type == "classification":
+                summary = str(record.get("summary", ""))
+                if summary.startswith("AI处理失败") or record.get("score") is None:
+                    continue
+                self.score_model.learn(int(record["score"]), features)
+                learned += 1
+
+            elif judgment_type == "conversation_check":
+                if record.get("ai_error") or "is_conversation_judgment" not in record:
+                    continue
+                self.conversation_model.learn(bool(record["is_conversation_judgment"]), features)
+                learned += 1
+
+        self.trained_record_count = len(all_records)
+        self.caught_up = True
+        if learned:
+            self.save()
+        return learned
+
+    def catch_up(self, judgment_record_path):
+        """启动后首次使用时，从判断记录文件补齐水位线之后的训练。"""
+        if self.caught_up:
+            return
+        try:
+            if os.path.exists(judgment_record_path) and os.path.getsize(judgment_record_path) > 0:
+                with open(judgment_record_path, 'r', encoding='utf-8') as f:
+                    records = json.load(f)
+                if isinstance(records, list):
+                    learned = self.learn_from_judgment_records(records)
+                    if learned:
+                        print(f"信息：本地预分类模型已从判断记录增量学习 {learned} 条样本。")
+        except Exception as e:
+            print(f"警告：读取判断记录以训练本地预分类模型失败 ({e})。")
+        self.caught_up = True
+
+    # --- 预测 ---
+    def _predict(self, model, email_data):
+        if model.total_docs < self.min_samples:
+            return None, 0.0
+        features = hash_features(email_data.get("subject", ""), email_data.get("body", ""))
+        label, confidence = model.predict(features)
+        if label is None or confidence < self.confidence_threshold:
+            return None, confidence
+        return label, confidence
+
+    def predict_score(self, email_data):
+        """
+        Returns:
+            tuple: (score 或 None, confidence)。置信度不足时 score 为 None，需交由 AI。
+        """
+        label, confidence = self._predict(self.score_model, email_data)
+        return (int(label) if label is not None else None), confidence
+
+    def predict_conversation(self, email_data):
+        """
+        Returns:
+            tuple: (True/False 或 None, confidence)。置信度不足时返回 None，需交由 AI。
+        """
+        label, confidence = self._predict(self.conversation_model, email_data)
+        return (label == "True" if label is not None else None), confidence
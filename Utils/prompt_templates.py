@@ -0,0 +1,91 @@
+import hashlib
+
+from Utils.ai_backend import STAGE_CLASSIFICATION, STAGE_SUMMARY, STAGE_CONVERSATION, STAGE_HISTORY_SUMMARY, \
+    STAGE_STYLE_PROFILE, STAGE_CONVERSATION_PROFILE
+
+# --- 各 Prompt 的编译规则 ---
+# 配置节 -> (AI 阶段, 任务键, 每次调用变化的输入部分模板)
+PROMPT_SPECS = {
+    "CLASSIFICATION": (STAGE_CLASSIFICATION, "CLASSIFY_TASK",
+                       "邮件主题：{subject}\n邮件正文（仅前1000字）：{body}"),
+    "SUMMARY": (STAGE_SUMMARY, "SUMMARY_TASK",
+                "邮件主题：{subject}\n邮件正文（仅前1000字）：{body}"),
+    "CONVERSATION": (STAGE_CONVERSATION, "CONVO_TASK",
+                     "邮件主题：{subject}\n邮件正文（仅前1000字）：{body}"),
+    "HISTORY_SUMMARY": (STAGE_HISTORY_SUMMARY, "SUMMARY_TASK",
+                        "以下是按时间顺序排列的对话摘要:\n{digest}"),
+    "HISTORY_UPDATE": (STAGE_HISTORY_SUMMARY, "SUMMARY_TASK",
+                       "【旧的总结】:\n{old_summary}\n\n【新增的对话摘要 (按时间顺序)】:\n{digest}"),
+    "CREATE_STYLE_PROFILE": (STAGE_STYLE_PROFILE, "SUMMARY_TASK",
+                             "以下是[我]发送的邮件正文 (按时间顺序):\n{style_digest}"),
+    "UPDATE_STYLE_PROFILE": (STAGE_STYLE_PROFILE, "SUMMARY_TASK",
+                             "【旧的风格分析】:\n{old_style_profile}\n\n【最新的邮件正文 (按时间顺序)】:\n{style_digest}"),
+    "HISTORY_CHUNK_SUMMARY": (STAGE_HISTORY_SUMMARY, "SUMMARY_TASK",
+                              "【第 {index}/{total} 阶段】({time_range})\n以下是该阶段按时间顺序排列的对话摘要:\n{digest}"),
+    "HISTORY_REDUCE": (STAGE_HISTORY_SUMMARY, "SUMMARY_TASK",
+                       "以下是按时间顺序排列的各阶段总结:\n{digest}"),
+    "CONVERSATION_PROFILE": (STAGE_CONVERSATION_PROFILE, "SUMMARY_TASK",
+                             "【一、总体总结 (操作: {summary_mode})】\n"
+                             "【旧的总结】:\n{old_summary}\n\n【对话摘要 (按时间顺序)】:\n{digest}\n\n"
+                             "【二、口吻分析 (操作: {style_mode})】\n"
+                             "【旧的风格分析】:\n{old_style_profile}\n\n"
+                             "【[我]发送的邮件正文 (按时间顺序)】:\n{style_digest}"),
+}
+
+
+class PromptTemplate:
+    """
+    编译后的 Prompt 模板。
+
+    prefix: 系统提示 + 任务说明 (+ 评分表) + 回复格式说明，加载时拼接一次，所有调用完全相同。
+    input_template: 每封邮件 / 每条对话变化的部分，由 render() 填充。
+
+    静态部分放在 prompt 开头，使相同前缀的调用能命中服务端的隐式前缀缓存。
+    """
+
+    def __init__(self, name, stage, prefix, input_template):
+        self.name = name
+        self.stage = stage
+        self.prefix = prefix
+        self.input_template = input_template
+        # (前缀内容的指纹，用于区分不同版本的 prompt)
+        self.prefix_key = hashlib.sha256(prefix.encode('utf-8')).hexdigest()[:16]
+
+    def render(self, **fields):
+        """返回变化部分的文本。"""
+        return self.input_template.format(**fields)
+
+    def full_prompt(self, **fields):
+        """返回完整的 prompt (前缀 + 变化部分)。"""
+        return self.prefix + "\n\n" + self.render(**fields)
+
+
+def compile_prompt_templates(prompt_config, confidence_stages=()):
+    """
+    将 Prompt_config.json 的内容编译为 {配置节名: PromptTemplate}。
+    CLASSIFICATION 的评分表 (SCORES) 在此格式化并写入前缀，不再在每次调用时重建。
+    阶段在 confidence_stages 中 (启用了模型路由) 时，将该节的 CONFIDENCE_INSTRUCTION 追加到回复格式说明之后；
+    其他情况下 Prompt 与回复格式保持不变。
+    配置中缺失的节会被跳过，由调用方决定如何处理。
+    """
+    templates = {}
+    for name, (stage, task_key, input_template) in PROMPT_SPECS.items():
+        section = prompt_config.get(name)
+        if not isinstance(section, dict):
+            print(f"警告：Prompt 配置中缺少 '{name}' 节。")
+            continue
+
+        task = section.get(task_key, "")
+        if "SCORES" in section:
+            # 将评分映射转换为 AI 可读的字符串格式
+            scores_str = "\n".join([f"- {k}: {v}分" for k, v in section["SCORES"].items()])
+            task = task.format(scores=scores_str)
+
+        # (口吻分析的配置使用 RESPONSE_INSTRUCTION 键，其他节使用 RESPONSE_FORMAT_INSTRUCTION)
+        response_instruction = section.get("RESPONSE_FORMAT_INSTRUCTION", section.get("RESPONSE_INSTRUCTION", ""))
+        confidence_instruction = section.get("CONFIDENCE_INSTRUCTION", "") if stage in confidence_stages else ""
+
+        prefix = "\n\n".join(part for part in (section.get("SYSTEM_PROMPT", ""), task, response_instruction,
+                                                 confidence_instruction) if part)
+        templates[name] = PromptTemplate(name, stage, prefix, input_template)
+    return templates
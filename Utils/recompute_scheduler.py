@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta, timezone
+
+# --- 派生产物 (对话字典中的键) ---
+ARTIFACT_SUMMARY = "general_summary"
+ARTIFACT_STYLE = "style_profile"
+
+# 立即触发重算的原因 (不参与合并等待)
+IMMEDIATE_REASONS = ("new_conversation",)
+
+
+class RecomputeScheduler:
+    """
+    对话派生产物 (总体总结 / 口吻分析) 的防抖合并重算调度器。
+
+    每条对话在 "pending_recompute" 键下记录各产物的过期状态:
+        {"general_summary": {"count": 3, "since": "...", "reasons": {"received": 2, "sent": 1}}, ...}
+    只有当累计变更数达到 change_threshold，或最早的未处理变更已等待超过 window_seconds 时，
+    该产物才会被判定为需要重算。状态随对话历史一起保存，因此跨周期、跨重启都能继续合并。
+    """
+
+    def __init__(self, window_seconds=21600, change_threshold=5, enabled=True):
+        self.window = timedelta(seconds=window_seconds)
+        self.change_threshold = change_threshold
+        self.enabled = enabled
+        # 最早的待重算时间 (None 表示未知，需要检查对话历史)
+        self.next_due_time = None
+
+    @staticmethod
+    def now():
+        return datetime.now(timezone.utc)
+
+    def mark_stale(self, conversation, artifact, reason, count=1, now=None):
+        """记录某条对话的某个派生产物因 reason 而过期。"""
+        now = now or self.now()
+        pending = conversation.setdefault("pending_recompute", {})
+        entry = pending.get(artifact)
+        if not entry:
+            entry = pending[artifact] = {"count": 0, "since": now.isoformat(), "reasons": {}}
+        entry["count"] += count
+        entry["reasons"][reason] = entry["reasons"].get(reason, 0) + count
+
+        # 新的过期状态可能比已知的最早到期时间更早
+        due_time = now if reason in IMMEDIATE_REASONS else now + self.window
+        if self.next_due_time is not None and due_time < self.next_due_time:
+            self.next_due_time = due_time
+
+    def _due_time(self, entry):
+        if not self.enabled or entry.get("count", 0) >= self.change_threshold:
+            return None  # 立即到期
+        if any(reason in entry.get("reasons", {}) for reason in IMMEDIATE_REASONS):
+            return None
+        try:
+            since = datetime.fromisoformat(entry["since"])
+        except (KeyError, ValueError, TypeError):
+            return None
+        return since + self.window
+
+    def collect_due(self, all_memory, now=None):
+        """
+        找出所有需要重算的派生产物，并更新 next_due_time。
+
+        Returns:
+            dict: {artifact: set(address)}
+        """
+        now = now or self.now()
+        due = {ARTIFACT_SUMMARY: set(), ARTIFACT_STYLE: set()}
+        next_due_time = None
+
+        for address, conversation in all_memory.items():
+            if not isinstance(conversation, dict):
+                continue
+            for artifact, entry in conversation.get("pending_recompute", {}).items():
+                if artifact not in due or not isinstance(entry, dict):
+                    continue
+                due_time = self._due_time(entry)
+                if due_time is None or due_time <= now:
+                    due[artifact].add(address)
+                elif next_due_time is None or due_time < next_due_time:
+                    next_due_time = due_time
+
+        # 没有剩余的待重算产物时，设为一个窗口之后 (期间新到的变更会通过 mark_stale 提前)
+        self.next_due_time = next_due_time or now + self.window
+        return due
+
+    def has_due_work(self, now=None):
+        """没有新邮件的周期用于判断是否需要读取对话历史检查到期的重算。"""
+        if self.next_due_time is None:
+            return True
+        return (now or self.now()) >= self.next_due_time
+
+    @staticmethod
+    def clear(conversation, artifact):
+        """重算完成后清除对应产物的过期状态。"""
+        pending = conversation.get("pending_recompute")
+        if not pending:
+            return
+        pending.pop(artifact, None)
+        if not pending:
+            conversation.pop("pending_recompute", None)
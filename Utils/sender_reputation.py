@@ -0,0 +1,164 @@
+import json
+import math
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+from Utils.metrics import METRICS
+
+# --- 查询结果的状态 ---
+STATE_CONFIDENT = "confident"  # 观测充分且稳定，直接使用本地评分
+STATE_RESAMPLE = "resample"  # 观测充分，但被抽中重新交由 AI 评分 (检测漂移)
+STATE_LEARNING = "learning"  # 观测不足、波动过大或长期未出现，交由 AI 评分
+
+
+class SenderReputation:
+    """
+    发件人 / 发件域名的评分信誉库。
+
+    每个发件人 (完整地址) 和每个域名记录:
+        {"count": 观测次数, "mean": 指数加权平均分, "var": 指数加权方差, "last_seen": ISO 时间}
+    - 观测次数达到 min_observations、标准差不超过 max_stddev 且在 stale_days 内出现过时视为可信，
+      可信的发件人不再交由 AI 评分；以 resample_rate 的概率抽样重新评分，以发现评分漂移。
+    - 前几次观测按算术平均计入 (权重 1/count)，之后按 alpha 指数加权，近期评分影响更大。
+    - 没有发件人记录的邮件可使用可信的域名信誉 (门槛更高)，域名下各发件人评分差异大时自然不可信。
+    """
+
+    def __init__(self, file_path, alpha=0.2, min_observations=3, max_stddev=0.75, resample_rate=0.05,
+                 stale_days=180, domain_enabled=True, domain_min_observations=10, domain_max_stddev=0.5,
+                 enabled=True, seed=None):
+        self.file_path = file_path
+        self.alpha = alpha
+        self.min_observations = min_observations
+        self.max_stddev = max_stddev
+        self.resample_rate = resample_rate
+        self.stale_age = timedelta(days=stale_days) if stale_days else None
+        self.domain_enabled = domain_enabled
+        self.domain_min_observations = domain_min_observations
+        self.domain_max_stddev = domain_max_stddev
+        self.enabled = enabled
+        self.random = random.Random(seed)
+
+        self.senders = {}
+        self.domains = {}
+        if enabled:
+            self.load()
+
+    @classmethod
+    def from_config(cls, file_path, config):
+        domain_config = config.get("DOMAIN", {})
+        return cls(
+            file_path,
+            alpha=config.get("ALPHA", 0.2),
+            min_observations=config.get("MIN_OBSERVATIONS", 3),
+            max_stddev=config.get("MAX_STDDEV", 0.75),
+            resample_rate=config.get("RESAMPLE_RATE", 0.05),
+            stale_days=config.get("STALE_DAYS", 180),
+            domain_enabled=domain_config.get("ENABLED", True),
+            domain_min_observations=domain_config.get("MIN_OBSERVATIONS", 10),
+            domain_max_stddev=domain_config.get("MAX_STDDEV", 0.5),
+            enabled=config.get("ENABLED", False)
+        )
+
+    # --- 持久化 ---
+    def load(self):
+        try:
+            if os.path.exists(self.file_path) and os.path.getsize(self.file_path) > 0:
+                with open(self.file_path, 'r', encoding='utf-8') as f:
+                    content = json.load(f)
+                self.senders = content.get("SENDERS", {})
+                self.domains = content.get("DOMAINS", {})
+        except Exception as e:
+            print(f"WARNING: 读取发件人信誉库失败 ({e})，将重新积累观测。")
+            self.senders, self.domains = {}, {}
+
+    def save(self):
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            with METRICS.persist(self.file_path), open(self.file_path, 'w', encoding='utf-8') as f:
+                json.dump({"SENDERS": self.senders, "DOMAINS": self.domains}, f, indent=4, ensure_ascii=False)
+        except IOError as e:
+            print(f"错误：写入发件人信誉库 {self.file_path} 失败: {e}")
+
+    # --- 查询 ---
+    def _is_confident(self, entry, min_observations, max_stddev, now):
+        if entry.get("count", 0) < min_observations or math.sqrt(entry.get("var", 0.0)) > max_stddev:
+            return False
+        if self.stale_age is not None:
+            try:
+                if now - datetime.fromisoformat(entry["last_seen"]) > self.stale_age:
+                    return False
+            except (KeyError, ValueError, TypeError):
+                return False
+        return True
+
+    def _decide(self, entry, min_observations, max_stddev):
+        if not self._is_confident(entry, min_observations, max_stddev, datetime.now(timezone.utc)):
+            return STATE_LEARNING, None
+        if self.should_resample():
+            return STATE_RESAMPLE, None
+        return STATE_CONFIDENT, int(round(entry["mean"]))
+
+    def should_resample(self):
+        """按 resample_rate 抽样，被抽中的本地评分重新交由 AI (信誉库未启用时从不抽样)。"""
+        return self.enabled and bool(self.resample_rate) and self.random.random() < self.resample_rate
+
+    def lookup_sender(self, sender_name, sender_root):
+        """
+        Returns:
+            (state, score): 没有该发件人的记录时为 (None, None)；仅 STATE_CONFIDENT 时 score 不为 None。
+        """
+        entry = self.senders.get(f"{sender_name}@{sender_root}") if self.enabled else None
+        if entry is None:
+            return None, None
+        return self._decide(entry, self.min_observations, self.max_stddev)
+
+    def lookup_domain(self, sender_root):
+        """
+        没有发件人记录时按域名信誉查询，返回值同 lookup_sender。
+        发件域名本身没有记录时依次使用上级域名 (至少两级) 的记录，例如 notify.eu.example.com -> example.com。
+        """
+        if not (self.enabled and self.domain_enabled):
+            return None, None
+        labels = (sender_root or "").lower().split(".")
+        for start in range(max(1, len(labels) - 1)):
+            entry = self.domains.get(".".join(labels[start:]))
+            if entry is not None:
+                return self._decide(entry, self.domain_min_observations, self.domain_max_stddev)
+        return None, None
+
+    def get_mean(self, sender_name, sender_root):
+        entry = self.senders.get(f"{sender_name}@{sender_root}")
+        return entry["mean"] if entry else None
+
+    # --- 更新 ---
+    def _update(self, table, key, score, now, prior=None):
+        entry = table.get(key)
+        if entry is None:
+            if prior is None:
+                table[key] = {"count": 1, "mean": float(score), "var": 0.0, "last_seen": now}
+                return
+            # (旧版评分表中已有的评分作为一次观测)
+            entry = table[key] = {"count": 1, "mean": float(prior), "var": 0.0, "last_seen": now}
+
+        entry["count"] += 1
+        weight = max(self.alpha, 1.0 / entry["count"])
+        diff = score - entry["mean"]
+        increment = weight * diff
+        entry["mean"] += increment
+        entry["var"] = (1 - weight) * (entry["var"] + diff * increment)
+        entry["last_seen"] = now
+
+    def observe(self, sender_name, sender_root, score, prior=None):
+        """
+        记录一次评分观测 (发件人与其域名各一次)。
+        prior: 发件人尚无记录时，评分表中已有的旧评分 (可选)。
+        """
+        if not self.enabled:
+            return
+        now = datetime.now(timezone.utc).isoformat()
+        self._update(self.senders, f"{sender_name}@{sender_root}", score, now, prior)
+        if self.domain_enabled:
+            self._update(self.domains, (sender_root or "").lower(), score, now)
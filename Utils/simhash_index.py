@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+
+from Utils.pre_classifier import normalize_text, extract_ngrams
+
+FINGERPRINT_BITS = 64
+
+
+def simhash(subject, body, body_limit=4000):
+    """
+    计算主题 + 正文的 64 位 SimHash 指纹。
+    文本先经过 normalize_text 归一化 (链接、邮箱地址、数字被统一替换)，
+    因此只在姓名、数字、链接上不同的模板邮件会得到相同或极相近的指纹。
+
+    Returns:
+        tuple: (fingerprint, feature_count)。特征过少时指纹不可靠，由调用方决定是否使用。
+    """
+    text = normalize_text(subject) + "\n" + normalize_text((body or "")[:body_limit])
+    weights = {}
+    # 只使用单词 unigram：模板中被替换的一个词只影响一个特征，而不是三个
+    for gram in extract_ngrams(text, word_bigrams=False):
+        weights[gram] = weights.get(gram, 0) + 1
+
+    vector = [0] * FINGERPRINT_BITS
+    for gram, weight in weights.items():
+        h = int.from_bytes(hashlib.blake2b(gram.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(FINGERPRINT_BITS):
+            if h >> bit & 1:
+                vector[bit] += weight
+            else:
+                vector[bit] -= weight
+
+    fingerprint = 0
+    for bit in range(FINGERPRINT_BITS):
+        if vector[bit] > 0:
+            fingerprint |= 1 << bit
+    return fingerprint, len(weights)
+
+
+class NearDuplicateIndex:
+    """
+    SimHash 近似重复索引。
+
+    使用鸽巢原理做分块索引：将 64 位指纹切成 (max_distance + 1) 块，
+    汉明距离不超过 max_distance 的两个指纹至少有一块完全相同。
+    查询时只需检查各块命中的候选，复杂度与索引总量无关。
+
+    条目以 JSON Lines 追加写入，相同指纹的后写条目覆盖先写条目。
+    """
+
+    def __init__(self, index_path, max_distance=3, min_features=8):
+        self.index_path = index_path
+        self.max_distance = max_distance
+        self.min_features = min_features
+        self.block_count = max_distance + 1
+        self.block_bits = FINGERPRINT_BITS // self.block_count
+        self.entries = {}  # fingerprint -> entry
+        self.tables = [{} for _ in range(self.block_count)]  # 每块: block_value -> set(fingerprint)
+        self.load()
+
+    def _blocks(self, fingerprint):
+        for i in range(self.block_count):
+            # 最后一块包含除不尽的剩余位，保证 64 位全部被覆盖
+            width = self.block_bits if i < self.block_count - 1 else FINGERPRINT_BITS - i * self.block_bits
+            yield i, (fingerprint >> (i * self.block_bits)) & ((1 << width) - 1)
+
+    def _insert(self, fingerprint, entry):
+        if fingerprint in self.entries:
+            self.entries[fingerprint].update(entry)
+            return
+        self.entries[fingerprint] = entry
+        for i, block in self._blocks(fingerprint):
+            self.tables[i].setdefault(block, set()).add(fingerprint)
+
+    # --- 持久化 ---
+    def load(self):
+        if not (os.path.exists(self.index_path) and os.path.getsize(self.index_path) > 0):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    entry = json.loads(line)
+                    self._insert(int(entry.pop("fingerprint"), 16), entry)
+        except Exception as e:
+            print(f"警告：近似重复索引 {self.index_path} 读取失败 ({e})，已加载 {len(self.entries)} 条。")
+
+    def _append(self, lines):
+        try:
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.writelines(lines)
+        except IOError as e:
+            print(f"错误：写入近似重复索引 {self.index_path} 失败: {e}")
+
+    # --- 维护 ---
+    def add_records(self, records):
+        """
+        将判断记录加入索引。记录需包含 subject/body，以及 score 和/或 summary。
+        summary 为 AI 失败信息的记录会被忽略。
+
+        Returns:
+            int: 写入索引的条目数。
+        """
+        lines = []
+        for record in records:
+            summary = record.get("summary")
+            if str(summary).startswith("AI处理失败"):
+                continue
+
+            entry = {}
+            if record.get("score") is not None:
+                entry["score"] = int(record["score"])
+            if summary:
+                entry["summary"] = summary
+            if not entry:
+                continue
+
+            fingerprint, feature_count = simhash(record.get("subject", ""), record.get("body", ""))
+            if feature_count < self.min_features:
+                continue
+
+            self._insert(fingerprint, entry)
+            lines.append(json.dumps({"fingerprint": format(fingerprint, '016x'), **entry}, ensure_ascii=False) + "\n")
+
+        if lines:
+            self._append(lines)
+        return len(lines)
+
+    # --- 查询 ---
+    def lookup(self, subject, body):
+        """
+        查找汉明距离不超过 max_distance 的最近已判断邮件。
+
+        Returns:
+            tuple: (entry 或 None, distance)
+        """
+        fingerprint, feature_count = simhash(subject, body)
+        if feature_count < self.min_features or not self.entries:
+            return None, None
+
+        best_entry, best_distance = None, None
+        seen = set()
+        for i, block in self._blocks(fingerprint):
+            for candidate in self.tables[i].get(block, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = bin(candidate ^ fingerprint).count('1')
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best_entry, best_distance = self.entries[candidate], distance
+                    if distance == 0:
+                        return best_entry, 0
+        return best_entry, best_distance
@@ -0,0 +1,155 @@
+import json
+import re
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def get_prometheus_name(prefix, name, suffix=""):
+    """指标名转换为 Prometheus 允许的字符: "imap.fetch" -> "mail_helper_imap_fetch_seconds"。"""
+    return re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}_{name}{suffix}")
+
+
+def render_prometheus(snapshot, gauges=None, prefix="mail_helper"):
+    """
+    将 MetricsRegistry.snapshot() 的累计指标渲染为 Prometheus 文本格式。
+    - 计数器 -> <name>_total (counter)
+    - 计时器 -> <name>_seconds (summary: quantile 0.5/0.95, _sum, _count)
+    - gauge (snapshot 中的与额外传入的) -> <name> (gauge)
+    """
+    lines = []
+
+    for name, value in snapshot.get("counters", {}).items():
+        metric = get_prometheus_name(prefix, name, "_total")
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+
+    for name, timer in snapshot.get("timers", {}).items():
+        metric = get_prometheus_name(prefix, name, "_seconds")
+        lines.append(f"# TYPE {metric} summary")
+        lines.append(f'{metric}{{quantile="0.5"}} {timer["p50_seconds"]}')
+        lines.append(f'{metric}{{quantile="0.95"}} {timer["p95_seconds"]}')
+        lines.append(f"{metric}_sum {timer['total_seconds']}")
+        lines.append(f"{metric}_count {timer['count']}")
+
+    all_gauges = dict(snapshot.get("gauges", {}))
+    all_gauges.update(gauges or {})
+    for name, value in sorted(all_gauges.items()):
+        if value is None:
+            continue
+        metric = get_prometheus_name(prefix, name)
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {float(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+class StatusServer:
+    """
+    守护进程的本地状态接口 (标准库 http.server，默认只监听 127.0.0.1)。
+
+    - GET  /metrics  Prometheus 文本格式的指标
+    - GET  /health   存活检查 (JSON)，进程在运行即返回 200
+    - GET  /ready    就绪检查 (JSON)，status_provider 返回 ready 为 False 时返回 503 (例如周期卡住、上一周期失败)
+    - POST /stop     设置 stop_event，停止自动处理循环 (替代控制台输入)
+    - POST /<action> 调用 actions 中注册的控制操作，例如 /profile?cycles=3
+
+    服务在后台守护线程中运行，不影响处理循环；处理函数中的异常只返回 500，不会中断服务。
+    """
+
+    def __init__(self, host, port, metrics_provider, status_provider, stop_event, actions=None):
+        """
+        Args:
+            metrics_provider: 无参函数，返回 Prometheus 文本。
+            status_provider: 无参函数，返回状态字典 (须包含 "ready" 键)。
+            stop_event: threading.Event，收到 /stop 时设置。
+            actions: {路径: 函数}，函数接收查询参数字典 ({名称: 值})，返回 JSON 可序列化的结果。
+        """
+        self.host = host
+        self.port = port
+        self.metrics_provider = metrics_provider
+        self.status_provider = status_provider
+        self.stop_event = stop_event
+        self.actions = actions or {}
+        self.httpd = None
+        self.thread = None
+
+    @classmethod
+    def from_config(cls, config, metrics_provider, status_provider, stop_event, actions=None):
+        return cls(
+            host=config.get("HOST", "127.0.0.1"),
+            port=config.get("PORT", 9465),
+            metrics_provider=metrics_provider,
+            status_provider=status_provider,
+            stop_event=stop_event,
+            actions=actions
+        )
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, code, body, content_type="application/json; charset=utf-8"):
+                data = body.encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_json(self, code, payload):
+                self._send(code, json.dumps(payload, ensure_ascii=False, default=str))
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                try:
+                    if path == "/metrics":
+                        self._send(200, server.metrics_provider(), PROMETHEUS_CONTENT_TYPE)
+                    elif path == "/health":
+                        self._send_json(200, {"status": "alive", "stopping": server.stop_event.is_set()})
+                    elif path == "/ready":
+                        status = server.status_provider()
+                        self._send_json(200 if status.get("ready") else 503, status)
+                    else:
+                        self._send_json(404, {"error": "not found"})
+                except Exception as e:
+                    self._send_json(500, {"error": str(e)})
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                if url.path == "/stop":
+                    print("信息：状态接口收到停止请求。")
+                    server.stop_event.set()
+                    self._send_json(202, {"status": "stopping"})
+                elif url.path in server.actions:
+                    params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                    try:
+                        self._send_json(200, server.actions[url.path](params))
+                    except (TypeError, ValueError) as e:
+                        self._send_json(400, {"error": str(e)})
+                    except Exception as e:
+                        self._send_json(500, {"error": str(e)})
+                else:
+                    self._send_json(404, {"error": "not found"})
+
+            def log_message(self, format, *args):
+                # 不在控制台输出每一次请求 (监控系统会频繁抓取)
+                pass
+
+        return Handler
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return f"http://{self.host}:{self.httpd.server_address[1]}"
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
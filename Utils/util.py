@@ -1,3 +1,4 @@
+import json
 import re
 from datetime import datetime, timezone
 from email.utils import getaddresses
@@ -12,6 +13,17 @@ def datetime_to_json(obj):
     raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
 
+def get_email_key(email_data):
+    """
+    邮件的稳定标识 (用于检查点、向量索引等)。
+    IMAP 编号在收件箱与发件箱之间、以及删除邮件后可能被复用，因此附加类型与发送时间。
+    """
+    sent_time = email_data.get("sent_time")
+    if isinstance(sent_time, datetime):
+        sent_time = sent_time.isoformat()
+    return f"{email_data.get('type')}:{email_data.get('id')}:{sent_time}"
+
+
 def get_sortable_time(email_data):
     """
     一个健壮的排序键，
@@ -112,6 +124,47 @@ def extract_text_from_html(html_string):
         return html_string  # 失败时返回原始 HTML，交给 AI 处理
 
 
+def get_importance_from_headers(msg):
+    """
+    从 X-Priority / Importance / Priority 头部读取发件人标记的重要性。
+
+    Returns:
+        str: "high" / "low" / "normal"
+    """
+    x_priority = str(msg.get('X-Priority') or '').strip()
+    if x_priority[:1] in ('1', '2'):
+        return "high"
+    if x_priority[:1] in ('4', '5'):
+        return "low"
+
+    importance = str(msg.get('Importance') or '').strip().lower()
+    priority = str(msg.get('Priority') or '').strip().lower()
+    if importance == 'high' or priority == 'urgent':
+        return "high"
+    if importance == 'low' or priority == 'non-urgent':
+        return "low"
+    return "normal"
+
+
+def get_headers_from_msg(msg, header_names):
+    """
+    读取规则引擎需要的邮件头部 (List-Unsubscribe、Precedence、Auto-Submitted 等)。
+    同名头部出现多次时只取第一个 (最上方)：Authentication-Results 由己方的收信服务器最后添加，
+    位于最上方的才可信，其下方的可能由上游或发件人伪造；也避免把不同中转的结果拼在一起匹配。
+    头部内容不截断 (只在解析时用于规则判断，不写入存储)。
+
+    Returns:
+        dict: 头部名 (小写) -> 头部内容，只包含邮件中存在的头部。
+    """
+    headers = {}
+    for name in header_names:
+        value = msg.get(name)
+        if value is None:
+            continue
+        headers[name.lower()] = str(value).strip()
+    return headers
+
+
 def get_address_list_from_header(headers):
     """
         从邮件头部字段 (To, Cc) 中解析并提取所有邮箱地址。
@@ -175,4 +228,153 @@ def archive_email_to_memory(email, all_memory, processed_ids_this_run):
     if email_id:
         processed_ids_this_run.add(email_id)  # 标记此ID在本次运行中已处理
 
-    return 1  # 成功添加 1 封
\ No newline at end of file
+    return 1  # 成功添加 1 封
+
+# --- 邮件正文精简 (用于构造 AI Prompt 前) ---
+# 回复/转发分隔行：出现后其后的内容均为引用的历史邮件
+# (回复头必须包含日期 (数字) 或邮箱地址，避免把正文中的 "the customer wrote:" 之类的句子当作引用开始)
+QUOTE_HEADER_PATTERNS = [
+    re.compile(r'^\s*On\s.{0,200}(?:\d|@).{0,200}\swrote:\s*$', re.IGNORECASE),  # On Mon, Jan 1, 2024, Bob <bob@x.com> wrote:
+    re.compile(r'^\s*<?[\w.+-]+@[\w-]+(?:\.[\w-]+)+>?\s+wrote:\s*$', re.IGNORECASE),  # (折行后的) bob@x.com> wrote:
+    re.compile(r'^\s*.{0,200}(?:\d|@).{0,200}(?:写道|寫道)[:：]\s*$'),  # 在 2024年1月1日，Bob 写道：
+    re.compile(r'^\s*.{0,200}(?:\d|@).{0,200}(?:のメッセージ|さんは書きました)[:：]\s*$'),
+    re.compile(r'^\s*-{2,}\s*(?:Original Message|原始邮件|原始郵件|元のメッセージ)\s*-{2,}\s*$', re.IGNORECASE),
+    re.compile(r'^\s*-{2,}\s*(?:Forwarded message|转发的邮件|轉寄的郵件|転送されたメッセージ)\s*-{2,}\s*$', re.IGNORECASE),
+]
+# Outlook 的引用分隔线 (只有紧跟 From:/Sent: 等头部时才视为引用开始)
+OUTLOOK_SEPARATOR_PATTERN = re.compile(r'^\s*_{10,}\s*$')
+OUTLOOK_FIELD_PATTERN = re.compile(r'^\s*(?:From|Sent|发件人|寄件者|差出人|发送时间|送信日時)\s*[:：]', re.IGNORECASE)
+# Outlook 风格的引用头部: From: 之后紧跟 Sent:/Date: 与 Subject:
+OUTLOOK_HEADER_PATTERN = re.compile(
+    r'^\s*(?:From|发件人|寄件者|差出人)\s*[:：].*\n(?:.*\n){0,3}?\s*(?:Sent|Date|发送时间|日期|送信日時)\s*[:：]',
+    re.IGNORECASE | re.MULTILINE
+)
+# 签名分隔行 (RFC 3676 的 "-- ")：只有其后的内容不超过 SIGNATURE_MAX_LINES 行时才视为签名，
+# 避免正文中间用作分隔的 "--" 行把之后的正文一并去掉
+SIGNATURE_DELIMITER_PATTERN = re.compile(r'^--\s*$')
+SIGNATURE_MAX_LINES = 10
+# 移动端的默认签名
+MOBILE_SIGNATURE_PATTERN = re.compile(
+    r'^\s*(?:Sent from my \w+|Get Outlook for \w+|发自我的\s*\w+|从我的\s*\w+\s*发送|\w+から送信)\s*$', re.IGNORECASE
+)
+# 免责声明/法律声明段落的关键字
+DISCLAIMER_PATTERN = re.compile(
+    r'confidentiality notice|this (?:e-?mail|message) (?:and any attachments )?(?:is|are|may be) (?:confidential|intended)'
+    r'|if you are not the intended recipient|免责声明|保密声明|本邮件(?:及其附件)?(?:含有|包含)?(?:保密|机密)'
+    r'|この(?:電子)?メール(?:には|は).{0,20}(?:機密|秘密)',
+    re.IGNORECASE
+)
+
+
+def reduce_email_body(body):
+    """
+    在截断并放入 AI Prompt 之前精简邮件正文：
+    去除引用的历史邮件 (带日期或地址的 "On … wrote:" 等回复头、转发分隔行、Outlook 头部之后的内容，
+    以及位于正文末尾的 ">" 引用块)、签名以及免责声明段落。正文中间的 ">" 行 (行内回复、命令行输出等) 保留。
+    若去除引用后正文为空 (例如纯转发邮件)，则保留被引用的内容，只去掉分隔行与 ">" 前缀。
+
+    Args:
+        body (str): 原始邮件正文。
+
+    Returns:
+        str: 精简后的正文。
+    """
+    if not body:
+        return body or ""
+
+    text = body.replace('\r\n', '\n').replace('\r', '\n')
+
+    # 1. 找到引用开始的位置 (回复头 / 转发分隔行 / Outlook 头部)
+    lines = text.split('\n')
+    cut_index = None
+    for index, line in enumerate(lines):
+        if any(pattern.match(line) for pattern in QUOTE_HEADER_PATTERNS):
+            # 回复头折行时 ("On … Bob <" + "bob@x.com> wrote:")，从上一行开始截断
+            cut_index = index - 1 if index and re.match(r'^\s*On\s', lines[index - 1], re.IGNORECASE) else index
+            break
+        if OUTLOOK_SEPARATOR_PATTERN.match(line):
+            next_line = next((following for following in lines[index + 1:index + 4] if following.strip()), "")
+            if OUTLOOK_FIELD_PATTERN.match(next_line):
+                cut_index = index
+                break
+    outlook_match = OUTLOOK_HEADER_PATTERN.search(text)
+    if outlook_match:
+        outlook_index = text.count('\n', 0, outlook_match.start())
+        if cut_index is None or outlook_index < cut_index:
+            cut_index = outlook_index
+
+    own_lines = lines if cut_index is None else lines[:cut_index]
+
+    # 2. 去除签名 (最后一个签名分隔行之后的内容，或移动端默认签名及其之后的内容)
+    signature_index = next((index for index, line in enumerate(own_lines) if MOBILE_SIGNATURE_PATTERN.match(line)),
+                           len(own_lines))
+    for index in range(signature_index - 1, -1, -1):
+        if SIGNATURE_DELIMITER_PATTERN.match(own_lines[index]):
+            if sum(1 for line in own_lines[index + 1:signature_index] if line.strip()) <= SIGNATURE_MAX_LINES:
+                signature_index = index
+            break
+    own_lines = own_lines[:signature_index]
+
+    # 3. 去除正文末尾的 ">" 引用块 (底部引用的历史邮件)
+    end = len(own_lines)
+    while end > 0 and (not own_lines[end - 1].strip() or own_lines[end - 1].lstrip().startswith('>')):
+        end -= 1
+    own_lines = own_lines[:end]
+
+    reduced = '\n'.join(own_lines).strip()
+    if not reduced:
+        # 纯转发/纯引用: 保留被引用的正文
+        quoted_lines = lines if cut_index is None else lines[cut_index + 1:]
+        reduced = '\n'.join(line.lstrip().lstrip('>').strip() for line in quoted_lines).strip()
+
+    # 4. 去除免责声明段落
+    paragraphs = re.split(r'\n\s*\n', reduced)
+    paragraphs = [p for p in paragraphs if not DISCLAIMER_PATTERN.search(p)] or paragraphs
+
+    # 5. 合并多余空行
+    return re.sub(r'\n{3,}', '\n\n', '\n\n'.join(p.strip() for p in paragraphs if p.strip()))
+
+
+# --- 流式读取 JSON 数组文件 ---
+def iter_json_array(file_path, read_size=1 << 20):
+    """
+    逐个产出 JSON 数组文件 (如 inbox_data.json) 中的元素 (邮件字典)，不把整个文件读入内存。
+    文件为空时不产出任何元素；格式错误时抛出 ValueError。
+    (元素为裸数字时可能在读取边界处被截断，本项目的数据文件中元素均为对象)
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = f.read(read_size)
+        position = 0
+        started = False
+        eof = False
+        while True:
+            # 跳过空白、数组起始符与分隔符
+            while True:
+                while position < len(buffer) and buffer[position] in ' \t\r\n,' + ('' if started else '['):
+                    if buffer[position] == '[':
+                        started = True
+                    position += 1
+                if position < len(buffer) or eof:
+                    break
+                buffer, position = f.read(read_size), 0
+                eof = not buffer
+
+            if position >= len(buffer) or buffer[position] == ']':
+                return
+            if not started:
+                raise ValueError(f"{file_path} 不是 JSON 数组")
+
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                    break
+                except json.JSONDecodeError:
+                    # 元素跨越了读取边界，继续读入
+                    chunk = f.read(read_size)
+                    if not chunk:
+                        raise
+                    buffer = buffer[position:] + chunk
+                    position = 0
+            yield item
+            position = end
@@ -0,0 +1,177 @@
+import json
+import os
+from datetime import datetime, timezone
+
+from Utils.util import datetime_to_json
+from Utils.metrics import METRICS
+
+# --- 工作类型 ---
+KIND_RECEIVED = "received"  # 待分类/总结的收信 (原始格式，进入 email_classification)
+KIND_SENT = "sent"  # 待总结的发信 (进入 email_classification)
+KIND_CONVERSATION = "conversation"  # 待对话筛选的收信 (已格式化，直接进入 maintain_conversation_history)
+WORK_KINDS = (KIND_RECEIVED, KIND_SENT, KIND_CONVERSATION)
+
+
+def new_work_batch():
+    """各阶段收集推迟工作用的结构: {kind: [email, ...]}"""
+    return {kind: [] for kind in WORK_KINDS}
+
+
+class PriorityRules:
+    """
+    根据廉价信号估计邮件的 AI 处理优先级 (数值越大越先处理)，不调用 AI。
+
+    - 已知发件人评分 (评分表 SENDER_INFO_LIST 的域名层级索引)，未知发件人取 unknown_sender_score
+    - 发件人属于已知对话伙伴 (known_addresses) 时加分
+    - 邮件头部的重要性标记 (X-Priority / Importance / Priority) 为 high 时加分，为 low 时减分
+    - 主题命中紧急关键词时加分；发件人为 no-reply 类地址时减分
+    - 发信统一使用 sent_priority (对话记忆依赖发信，但不像安全警告那样紧急)
+    """
+
+    def __init__(self, unknown_sender_score=3, known_address_bonus=2.0, urgent_keyword_bonus=3.0,
+                 header_priority_bonus=2.0, no_reply_penalty=1.0, sent_priority=4.0, urgent_keywords=(),
+                 no_reply_patterns=()):
+        self.unknown_sender_score = unknown_sender_score
+        self.known_address_bonus = known_address_bonus
+        self.urgent_keyword_bonus = urgent_keyword_bonus
+        self.header_priority_bonus = header_priority_bonus
+        self.no_reply_penalty = no_reply_penalty
+        self.sent_priority = sent_priority
+        self.urgent_keywords = [keyword.lower() for keyword in urgent_keywords]
+        self.no_reply_patterns = [pattern.lower() for pattern in no_reply_patterns]
+
+    @classmethod
+    def from_config(cls, config, no_reply_patterns=()):
+        return cls(
+            unknown_sender_score=config.get("UNKNOWN_SENDER_SCORE", 3),
+            known_address_bonus=config.get("KNOWN_ADDRESS_BONUS", 2.0),
+            urgent_keyword_bonus=config.get("URGENT_KEYWORD_BONUS", 3.0),
+            header_priority_bonus=config.get("HEADER_PRIORITY_BONUS", 2.0),
+            no_reply_penalty=config.get("NO_REPLY_PENALTY", 1.0),
+            sent_priority=config.get("SENT_PRIORITY", 4.0),
+            urgent_keywords=config.get("URGENT_KEYWORDS", []),
+            no_reply_patterns=no_reply_patterns
+        )
+
+    def estimate(self, email, score_index, known_addresses):
+        """score_index: 评分表编译出的 DomainScoreIndex"""
+        if email.get("type") == "sent":
+            return self.sent_priority
+
+        if "sender_name" in email:
+            sender_name = email.get("sender_name", "")
+            sender_root = email.get("sender_root", "")
+            address = f"{sender_name}@{sender_root}"
+        else:
+            # (已格式化的收信只有 sender 字段)
+            address = email.get("sender", "")
+            sender_name, _, sender_root = address.partition("@")
+
+        score = score_index.lookup(sender_name, sender_root)
+        priority = float(score if score is not None else self.unknown_sender_score)
+
+        if address in known_addresses:
+            priority += self.known_address_bonus
+
+        importance = email.get("importance")
+        if importance == "high":
+            priority += self.header_priority_bonus
+        elif importance == "low":
+            priority -= self.header_priority_bonus
+
+        subject = str(email.get("subject") or "").lower()
+        if any(keyword in subject for keyword in self.urgent_keywords):
+            priority += self.urgent_keyword_bonus
+
+        if any(pattern in sender_name.lower() for pattern in self.no_reply_patterns):
+            priority -= self.no_reply_penalty
+
+        return priority
+
+
+class AIWorkQueue:
+    """
+    持久化的 AI 工作优先队列。
+
+    每个周期先将新抓取的邮件入队并立即落盘，再按优先级 (越大越先) 列出处理，处理完成后才从队列中移除；
+    本周期因时间预算耗尽或熔断未完成的工作重新入队，周期结束时覆盖写入，留待下一周期。
+    处理出错或中途崩溃时队列中仍保留这些工作，之后不会丢失 (最多重复处理)。
+
+    等待过的工作每等待一个周期获得 aging_bonus 的额外优先级，避免低优先级邮件被长期饿死。
+    """
+
+    def __init__(self, queue_path, aging_bonus=0.5):
+        self.queue_path = queue_path
+        self.aging_bonus = aging_bonus
+        # {"kind", "priority", "cycles_waited", "enqueued_at", "email"}
+        self.items = []
+        # 本周期取出的工作: id(email) -> (email, 已等待的周期数)，重新入队时累加
+        # (同时持有邮件引用，保证对象标识在本周期内不会被复用)
+        self.taken_cycles = {}
+        self.load()
+
+    def __len__(self):
+        return len(self.items)
+
+    # --- 持久化 ---
+    def load(self):
+        try:
+            if os.path.exists(self.queue_path) and os.path.getsize(self.queue_path) > 0:
+                with open(self.queue_path, 'r', encoding='utf-8') as f:
+                    content = json.load(f)
+                self.items = [item for item in content.get("items", [])
+                              if isinstance(item, dict) and item.get("kind") in WORK_KINDS]
+        except Exception as e:
+            print(f"WARNING: 读取 AI 工作队列失败 ({e})，将忽略上一周期遗留的工作。")
+            self.items = []
+
+    def save(self):
+        try:
+            with METRICS.persist(self.queue_path), open(self.queue_path, 'w', encoding='utf-8') as f:
+                json.dump({"items": self.items}, f, indent=4, ensure_ascii=False, default=datetime_to_json)
+        except IOError as e:
+            print(f"错误：写入 AI 工作队列 {self.queue_path} 失败: {e}")
+
+    # --- 入队 / 出队 ---
+    def push(self, kind, emails, priority_func):
+        """
+        Args:
+            kind: 工作类型 (WORK_KINDS 之一)
+            emails: 邮件字典列表
+            priority_func: email -> 基础优先级
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        for email in emails:
+            taken = self.taken_cycles.pop(id(email), None)
+            cycles_waited = taken[1] if taken else None
+            self.items.append({
+                "kind": kind,
+                "priority": priority_func(email),
+                "cycles_waited": cycles_waited + 1 if cycles_waited is not None else 0,
+                "enqueued_at": now,
+                "email": email
+            })
+
+    def effective_priority(self, item):
+        return item.get("priority", 0) + self.aging_bonus * item.get("cycles_waited", 0)
+
+    def peek_all(self):
+        """
+        按有效优先级从高到低列出全部工作 (同优先级保持入队顺序)。
+        工作仍保留在队列中，处理完成后由 remove 移除，处理出错或中途崩溃时不会丢失。
+
+        Returns:
+            dict: {kind: [email, ...]}
+        """
+        batch = new_work_batch()
+        self.taken_cycles = {}
+        for item in sorted(self.items, key=self.effective_priority, reverse=True):
+            email = item["email"]
+            self.taken_cycles[id(email)] = (email, item.get("cycles_waited", 0))
+            batch[item["kind"]].append(email)
+        return batch
+
+    def remove(self, emails):
+        """从队列中移除指定的邮件 (按对象标识)。"""
+        removed_ids = {id(email) for email in emails}
+        self.items = [item for item in self.items if id(item["email"]) not in removed_ids]
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 与 AI_Replay / Benchmark 相同，将项目根目录加入搜索路径，使 Utils 等包可以直接导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from Utils.ai_backend import AIBackendError, OfflineBackend, STAGE_CLASSIFICATION, STAGE_CONVERSATION, \
+    STAGE_CONVERSATION_PROFILE, create_backend
+
+
+def test_create_backend_offline():
+    backend = create_backend({"TYPE": "offline", "OFFLINE": {"SEED": 7}}, api_key=None)
+    assert isinstance(backend, OfflineBackend)
+    assert backend.name == "offline"
+
+
+def test_offline_backend_is_deterministic():
+    prompt = '请给出 JSON: {"score": 1-5, "summary": "..."}'
+    first = OfflineBackend().generate(prompt, "any-model")
+    second = OfflineBackend().generate(prompt, "other-model")
+    assert first == second
+    assert OfflineBackend().generate(prompt + " ", "any-model") != first
+
+
+def test_offline_backend_stage_detection():
+    assert OfflineBackend.detect_stage('{"score": 3}') == STAGE_CLASSIFICATION
+    assert OfflineBackend.detect_stage('{"is_conversation": true}') == STAGE_CONVERSATION
+    assert OfflineBackend.detect_stage('{"general_summary": "", "style_profile": {}}') == STAGE_CONVERSATION_PROFILE
+
+    response = json.loads(OfflineBackend().generate("x", "m", stage=STAGE_CLASSIFICATION))
+    assert 1 <= response["score"] <= 5
+    assert 0.5 <= response["confidence"] <= 0.99
+
+
+def test_offline_backend_prefix_is_part_of_prompt():
+    """前缀与变化部分拼接后生成响应，与直接传入完整 prompt 的结果一致。"""
+    backend = OfflineBackend()
+    joined = backend.join_prompt("body", "prefix")
+    assert backend.generate("body", "m", prefix="prefix") == backend.generate(joined, "m")
+
+
+def test_offline_backend_injects_errors():
+    backend = OfflineBackend(rate_limit_rate=1.0, retry_after=2.5)
+    with pytest.raises(AIBackendError) as error:
+        backend.generate("x", "m")
+    assert error.value.status_code == 429
+    assert error.value.retry_after == 2.5
+
+    with pytest.raises(AIBackendError) as error:
+        OfflineBackend(error_rate=1.0).generate("x", "m")
+    assert error.value.status_code == 500
+
+
+def test_offline_backend_error_sequence_is_reproducible():
+    def outcomes(seed):
+        backend = OfflineBackend(error_rate=0.5, seed=seed)
+        result = []
+        for _ in range(20):
+            try:
+                backend.generate("x", "m")
+                result.append(True)
+            except AIBackendError:
+                result.append(False)
+        return result, backend.call_count
+
+    assert outcomes(3) == outcomes(3)
+    assert outcomes(3)[1] == 20
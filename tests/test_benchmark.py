@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+from Benchmark.synthetic_mailbox import generate_raw_message, generate_sent_email, get_corpus_size, iter_raw_messages
+
+
+def test_corpus_size():
+    assert get_corpus_size("1k") == 1000
+    assert get_corpus_size("250") == 250
+
+
+def test_synthetic_messages_are_reproducible():
+    """同一 (index, seed) 总是生成相同的字节，与生成顺序无关。"""
+    assert generate_raw_message(7, seed=1) == generate_raw_message(7, seed=1)
+    assert generate_raw_message(7, seed=1) != generate_raw_message(7, seed=2)
+    assert list(iter_raw_messages(5, seed=3))[4][1] == generate_raw_message(4, seed=3, contact_count=50)
+    assert generate_sent_email(3) == generate_sent_email(3)
+
+
+@pytest.fixture
+def run_benchmark():
+    # run_benchmark 会导入 mail_AutoProcess (依赖 pytz)；与命令行用法相同，需将 Auto_process 加入搜索路径
+    pytest.importorskip("pytz")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Auto_process"))
+    from Benchmark import run_benchmark
+    return run_benchmark
+
+
+def make_report(**per_item_us):
+    return {"results": {name: {"items": 10, "seconds": 0.0, "per_item_us": value}
+                        for name, value in per_item_us.items()}}
+
+
+def test_compare_with_baseline_flags_regressions(run_benchmark):
+    baseline = make_report(parse=100.0, archive=100.0, persist=100.0)
+    report = make_report(parse=125.0, archive=115.0, persist=50.0)
+    assert run_benchmark.compare_with_baseline(report, baseline, threshold=0.2) == ["parse"]
+
+
+def test_compare_with_baseline_skips_missing_entries(run_benchmark):
+    baseline = make_report(parse=100.0, archive=0)
+    report = make_report(parse=90.0, archive=500.0, html=10.0, empty=None)
+    assert run_benchmark.compare_with_baseline(report, baseline, threshold=0.2) == []
@@ -0,0 +1,60 @@
+from Utils.domain_index import DomainScoreIndex
+
+SCORE_LIST = {
+    "example.com": {"notify": 4, "boss": 5},
+    "eu.example.com": {"notify": 2},
+    "bounce.example.com": {"*": 0, "postmaster": 3},
+    "shop.org": {"*": 1},
+    "invalid.net": "not a dict"
+}
+
+
+def test_exact_match():
+    index = DomainScoreIndex.from_score_list(SCORE_LIST)
+    assert index.lookup("boss", "example.com") == 5
+    assert index.lookup("notify", "eu.example.com") == 2
+
+
+def test_unknown_sender_returns_none():
+    index = DomainScoreIndex.from_score_list(SCORE_LIST)
+    assert index.lookup("someone", "example.com") is None
+    assert index.lookup("boss", "other.com") is None
+    assert index.lookup("boss", "com") is None
+    assert index.lookup("x", "invalid.net") is None
+
+
+def test_subdomain_inherits_sender_name():
+    index = DomainScoreIndex.from_score_list(SCORE_LIST)
+    assert index.lookup("boss", "mail.example.com") == 5
+    # 最深 (最具体) 的规则生效
+    assert index.lookup("notify", "news.eu.example.com") == 2
+
+
+def test_inheritance_can_be_disabled():
+    index = DomainScoreIndex.from_score_list(SCORE_LIST, inherit_sender_names=False)
+    assert index.lookup("boss", "mail.example.com") is None
+    assert index.lookup("boss", "example.com") == 5
+
+
+def test_wildcard_covers_domain_and_subdomains():
+    index = DomainScoreIndex.from_score_list(SCORE_LIST, inherit_sender_names=False)
+    assert index.lookup("anyone", "bounce.example.com") == 0
+    assert index.lookup("anyone", "a.b.bounce.example.com") == 0
+    assert index.lookup("anyone", "shop.org") == 1
+
+
+def test_exact_name_beats_wildcard_at_same_level():
+    index = DomainScoreIndex.from_score_list(SCORE_LIST)
+    assert index.lookup("postmaster", "bounce.example.com") == 3
+    assert index.lookup("postmaster", "eu.bounce.example.com") == 3
+
+
+def test_deeper_wildcard_beats_inherited_name():
+    """notify@bounce.example.com：上层继承的 notify (4) 不如更具体的 *@bounce.example.com (0)。"""
+    index = DomainScoreIndex.from_score_list(SCORE_LIST)
+    assert index.lookup("notify", "bounce.example.com") == 0
+
+
+def test_domain_is_case_insensitive():
+    index = DomainScoreIndex.from_score_list(SCORE_LIST)
+    assert index.lookup("boss", "Example.COM.") == 5
@@ -0,0 +1,111 @@
+import json
+import os
+from email import message_from_string
+
+import pytest
+
+from Utils.header_rules import ACTION_INVALID, ACTION_NO_CONVERSATION, HeaderRuleEngine
+from Utils.util import get_headers_from_msg
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Configs", "Setup",
+                           "mail_config.json")
+
+
+@pytest.fixture
+def engine():
+    """与 mail_AutoProcess 相同，使用默认配置中的规则并追加 no-reply 规则。"""
+    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+        email_config = json.load(f)["EMAIL_CONFIG"]
+    return HeaderRuleEngine.from_config(email_config["HEADER_RULES"], email_config["NO_REPLY_PATTERNS"])
+
+
+def make_email(sender_name="alice", **headers):
+    return {"sender_name": sender_name, "sender_root": "example.com", "headers": headers}
+
+
+def test_no_rule_matches(engine):
+    assert engine.evaluate(make_email()) is None
+    assert engine.evaluate({"sender_name": "alice"}) is None
+
+
+def test_first_rule_in_config_order_wins_across_headers(engine):
+    """auto_reply 与 dmarc_fail 针对不同头部，同时命中时以配置中靠前的 dmarc_fail 为准。"""
+    email = make_email(**{"auto-submitted": "auto-replied", "authentication-results": "mx; dmarc=fail"})
+    assert engine.evaluate(email)["name"] == "dmarc_fail"
+
+
+def test_first_rule_in_config_order_wins_within_header(engine):
+    assert engine.evaluate(make_email(**{"auto-submitted": "auto-replied"}))["name"] == "auto_reply"
+    assert engine.evaluate(make_email(**{"auto-submitted": "auto-generated"}))["name"] == "auto_generated"
+    # auto-submitted: no 表示人工发送，不命中
+    assert engine.evaluate(make_email(**{"auto-submitted": "no"})) is None
+
+
+def test_header_rule_beats_later_sender_rule(engine):
+    email = make_email("noreply", **{"list-unsubscribe": "<mailto:u@example.com>"})
+    assert engine.evaluate(email)["name"] == "list_unsubscribe"
+    assert engine.evaluate(make_email("noreply"))["name"] == "no_reply_sender"
+
+
+def test_pattern_list_and_presence_rules(engine):
+    assert engine.evaluate(make_email(**{"x-mailer": "SendGrid v3"}))["action"] == ACTION_NO_CONVERSATION
+    assert engine.evaluate(make_email(**{"x-mailer": "Thunderbird"})) is None
+    assert engine.evaluate(make_email(**{"list-unsubscribe": ""}))["name"] == "list_unsubscribe"
+
+
+def test_spf_and_dkim_must_both_fail(engine):
+    assert engine.evaluate(make_email(**{"authentication-results": "spf=fail dkim=pass"})) is None
+    rule = engine.evaluate(make_email(**{"authentication-results": "dkim=fail; spf=fail"}))
+    assert rule["name"] == "spf_dkim_fail"
+    assert rule["action"] == ACTION_INVALID and rule["score"] == 0
+
+
+def test_formatted_email_uses_sender_field(engine):
+    assert engine.evaluate({"sender": "no-reply@example.com"})["name"] == "no_reply_sender"
+
+
+def test_match_uses_triage_from_parsing(engine):
+    """解析时已判断过的邮件按 triage 名称取回规则，不再读取头部。"""
+    assert engine.match({"triage": "auto_reply", "sender_name": "alice"})["name"] == "auto_reply"
+    assert engine.match({"triage": None, "sender_name": "noreply"}) is None
+    assert engine.match({"sender_name": "noreply"})["name"] == "no_reply_sender"
+
+
+def test_listed_sender_only_affected_by_override_rules(engine):
+    """评分表中已有评分的发件人只受 OVERRIDE_SCORE_LIST 的规则 (认证失败) 影响。"""
+    bulk = {"triage": "list_unsubscribe"}
+    spoofed = {"triage": "dmarc_fail"}
+    assert engine.excludes_conversation(bulk)
+    assert not engine.excludes_conversation(bulk, listed=True)
+    assert engine.excludes_conversation(spoofed, listed=True)
+    assert not engine.excludes_conversation({"triage": None})
+
+
+def test_valid_rule_never_excludes_conversation():
+    engine = HeaderRuleEngine([{"NAME": "vip", "SENDER": True, "PATTERN": "^ceo$", "ACTION": "valid", "SCORE": 5}])
+    assert engine.evaluate({"sender_name": "ceo"})["score"] == 5
+    assert not engine.excludes_conversation({"sender_name": "ceo"})
+
+
+def test_invalid_rule_config_is_rejected():
+    with pytest.raises(ValueError):
+        HeaderRuleEngine([{"NAME": "bad", "HEADER": "X-Test", "ACTION": "drop"}])
+    with pytest.raises(ValueError):
+        HeaderRuleEngine([{"NAME": "no_field", "PATTERN": "x"}])
+
+
+def test_disabled_engine_keeps_no_reply_rule():
+    engine = HeaderRuleEngine.from_config({"ENABLED": False, "RULES": [{"HEADER": "Precedence"}]}, ["noreply"])
+    assert engine.header_names == []
+    assert engine.evaluate(make_email("noreply"))["name"] == "no_reply_sender"
+
+
+def test_get_headers_reads_topmost_occurrence_only():
+    """同名头部只取最上方 (己方收信服务器添加) 的一个，下方伪造的结果不参与匹配。"""
+    msg = message_from_string(
+        "Authentication-Results: mx.example.com; dmarc=pass\n"
+        "Authentication-Results: forged; dmarc=fail\n"
+        "Subject: hi\n\nbody"
+    )
+    headers = get_headers_from_msg(msg, ["Authentication-Results", "Precedence"])
+    assert headers == {"authentication-results": "mx.example.com; dmarc=pass"}
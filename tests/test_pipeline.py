@@ -0,0 +1,77 @@
+import pytest
+
+from Utils.pipeline import StreamPipeline
+
+
+def make_producer(count, fail_after=None):
+    def producer(emit):
+        for item in range(count):
+            if fail_after is not None and item == fail_after:
+                raise RuntimeError("producer failed")
+            if not emit(item):
+                return
+    return producer
+
+
+def collect(pipeline, batch_size=3, max_wait_seconds=0.05):
+    batches = []
+    pipeline.start()
+    try:
+        for batch in pipeline.iter_batches(batch_size, max_wait_seconds):
+            batches.append(batch)
+    finally:
+        pipeline.close()
+    return batches
+
+
+def test_all_items_flow_through_stages_in_order():
+    pipeline = StreamPipeline(make_producer(10), [lambda x: x * 10, lambda x: x + 1], queue_size=2,
+                              poll_seconds=0.01)
+    batches = collect(pipeline)
+    assert [item for batch in batches for item in batch] == [x * 10 + 1 for x in range(10)]
+    assert all(len(batch) <= 3 for batch in batches)
+
+
+def test_stage_can_drop_items():
+    pipeline = StreamPipeline(make_producer(10), [lambda x: x if x % 2 else None], poll_seconds=0.01)
+    assert [item for batch in collect(pipeline) for item in batch] == [1, 3, 5, 7, 9]
+
+
+def test_stage_error_is_raised_after_processed_items():
+    """阶段出错时，出错之前已处理完的数据先全部产出 (由调用方持久化)，之后才抛出错误。"""
+    def stage(item):
+        if item == 5:
+            raise ValueError("bad item")
+        return item
+
+    pipeline = StreamPipeline(make_producer(10), [stage], poll_seconds=0.01)
+    received = []
+    pipeline.start()
+    with pytest.raises(ValueError, match="bad item"):
+        for batch in pipeline.iter_batches(batch_size=3, max_wait_seconds=0.05):
+            received.extend(batch)
+    assert received == [0, 1, 2, 3, 4]
+    assert not any(thread.is_alive() for thread in pipeline.threads)
+
+
+def test_producer_error_is_raised_after_emitted_items():
+    """生产者出错时错误一定抛出；尚未流到末端的数据被丢弃 (由调用方下一周期重新获取)，产出的只是已取出的前缀。"""
+    pipeline = StreamPipeline(make_producer(10, fail_after=4), [lambda x: x], poll_seconds=0.01)
+    received = []
+    pipeline.start()
+    with pytest.raises(RuntimeError, match="producer failed"):
+        for batch in pipeline.iter_batches(batch_size=100, max_wait_seconds=0.05):
+            received.extend(batch)
+    assert received == list(range(len(received)))
+    assert len(received) <= 4
+
+
+def test_consumer_exit_stops_upstream_threads():
+    """消费者提前退出时，被背压阻塞的上游线程随之退出。"""
+    pipeline = StreamPipeline(make_producer(1000), [lambda x: x], queue_size=1, poll_seconds=0.01)
+    pipeline.start()
+    for batch in pipeline.iter_batches(batch_size=2, max_wait_seconds=0.05):
+        assert batch == [0, 1]
+        break
+    pipeline.close()
+    assert not any(thread.is_alive() for thread in pipeline.threads)
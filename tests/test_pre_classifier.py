@@ -0,0 +1,75 @@
+from Utils.pre_classifier import HashedNaiveBayes, LocalPreClassifier, hash_features, normalize_text
+
+
+def make_records(count):
+    """交替生成两类明显可分的 classification 记录。"""
+    records = []
+    for i in range(count):
+        if i % 2 == 0:
+            records.append({"judgment_type": "classification", "subject": f"Weekly newsletter {i}",
+                            "body": "unsubscribe from our promotion sale discount", "score": 1, "summary": "广告"})
+        else:
+            records.append({"judgment_type": "classification", "subject": f"Meeting about project {i}",
+                            "body": "please review the contract draft before friday", "score": 5, "summary": "工作"})
+    return records
+
+
+def test_normalize_text_removes_variable_parts():
+    text = normalize_text("Order 12345 from a.b@example.com see https://example.com/x")
+    assert "12345" not in text
+    assert "<mail>" in text and "<url>" in text
+
+
+def test_hash_features_separates_subject_and_body():
+    assert hash_features("hello", "") != hash_features("", "hello")
+
+
+def test_naive_bayes_predicts_learned_label():
+    model = HashedNaiveBayes()
+    for _ in range(5):
+        model.learn(1, hash_features("sale", "discount coupon"))
+        model.learn(5, hash_features("meeting", "project deadline"))
+    label, confidence = model.predict(hash_features("sale", "coupon"))
+    assert label == "1"
+    assert confidence > 0.5
+
+
+def test_naive_bayes_round_trip():
+    model = HashedNaiveBayes()
+    model.learn(True, hash_features("hi", "how are you"))
+    restored = HashedNaiveBayes.from_dict(model.to_dict())
+    assert restored.predict(hash_features("hi", "how are you")) == model.predict(hash_features("hi", "how are you"))
+
+
+def test_pre_classifier_needs_min_samples(tmp_path):
+    classifier = LocalPreClassifier(str(tmp_path / "model.json"), confidence_threshold=0.9, min_samples=50)
+    classifier.learn_from_judgment_records(make_records(10))
+    assert classifier.predict_score({"subject": "Weekly newsletter", "body": "promotion sale"}) == (None, 0.0)
+
+
+def test_pre_classifier_learns_incrementally(tmp_path):
+    model_path = str(tmp_path / "model.json")
+    classifier = LocalPreClassifier(model_path, confidence_threshold=0.9, min_samples=20)
+    records = make_records(20)
+    assert classifier.learn_from_judgment_records(records) == 20
+
+    # 水位线之后新增的记录才被学习，本地判断不参与训练
+    records.append({"judgment_type": "local_classification", "subject": "x", "body": "y", "score": 1})
+    records.extend(make_records(2))
+    assert classifier.learn_from_judgment_records(records) == 2
+
+    score, confidence = classifier.predict_score({"subject": "Weekly newsletter", "body": "promotion sale discount"})
+    assert score == 1
+    assert confidence >= 0.9
+
+    # 重新加载后保留训练结果与水位线
+    reloaded = LocalPreClassifier(model_path, confidence_threshold=0.9, min_samples=20)
+    assert reloaded.trained_record_count == len(records)
+    assert reloaded.predict_score({"subject": "Meeting", "body": "review the contract"})[0] == 5
+
+
+def test_pre_classifier_retrains_after_truncation(tmp_path):
+    classifier = LocalPreClassifier(str(tmp_path / "model.json"), min_samples=1)
+    classifier.learn_from_judgment_records(make_records(10))
+    assert classifier.learn_from_judgment_records(make_records(4)) == 4
+    assert classifier.score_model.total_docs == 4
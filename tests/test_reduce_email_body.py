@@ -0,0 +1,90 @@
+from Utils.util import reduce_email_body
+
+
+def test_empty_body():
+    assert reduce_email_body("") == ""
+    assert reduce_email_body(None) == ""
+
+
+def test_reply_header_with_date_cuts_quoted_history():
+    body = ("Sounds good, see you then.\n\n"
+            "On Mon, Jan 1, 2024 at 10:00 AM Bob <bob@example.com> wrote:\n"
+            "> Can we meet tomorrow?\n")
+    assert reduce_email_body(body) == "Sounds good, see you then."
+
+
+def test_wrapped_reply_header_is_cut_from_first_line():
+    body = ("Thanks!\n\n"
+            "On Mon, Jan 1, 2024 at 10:00 AM Bob Smith <\n"
+            "bob@example.com> wrote:\n"
+            "> original\n")
+    assert reduce_email_body(body) == "Thanks!"
+
+
+def test_sentence_ending_with_wrote_is_kept():
+    body = "The customer wrote:\nthe invoice total is wrong.\nPlease check it."
+    assert reduce_email_body(body) == body
+
+
+def test_chinese_reply_header():
+    body = "好的，收到。\n\n在 2024年1月1日 10:00，张三 <zhang@example.com> 写道：\n> 请确认\n"
+    assert reduce_email_body(body) == "好的，收到。"
+
+
+def test_underscore_line_without_outlook_fields_is_kept():
+    body = "Please sign here:\n____________________\nName and date below."
+    assert reduce_email_body(body) == body
+
+
+def test_outlook_separator_and_header():
+    body = ("See attached.\n\n"
+            "________________________________\n"
+            "From: Alice <alice@example.com>\n"
+            "Sent: Monday, January 1, 2024 10:00 AM\n"
+            "Subject: Report\n\n"
+            "Old content")
+    assert reduce_email_body(body) == "See attached."
+
+
+def test_signature_delimiter_at_end_is_removed():
+    body = "Let me know.\n\n-- \nBob Smith\nSales Manager\n+1 555 0100"
+    assert reduce_email_body(body) == "Let me know."
+
+
+def test_dash_line_mid_body_keeps_following_content():
+    """正文中间用作分隔的 "--" 行之后还有大段正文时，不应被当作签名。"""
+    own_text = [f"Step {i}: check item {i}." for i in range(12)]
+    body = "Here is the plan.\n--\n" + "\n".join(own_text) + "\n\n-- \nBob"
+    reduced = reduce_email_body(body)
+    assert reduced.startswith("Here is the plan.\n--\nStep 0")
+    assert "Step 11: check item 11." in reduced
+    assert not reduced.endswith("Bob")
+
+
+def test_last_signature_delimiter_wins():
+    body = "Option A\n--\nOption B\n\nThanks\n-- \nBob"
+    assert reduce_email_body(body) == "Option A\n--\nOption B\n\nThanks"
+
+
+def test_mobile_signature():
+    assert reduce_email_body("On my way.\n\nSent from my iPhone") == "On my way."
+
+
+def test_inline_quote_kept_and_trailing_quote_removed():
+    body = ("> Can you send the file?\n"
+            "Yes, attached.\n\n"
+            "> Thanks\n"
+            "> Bob\n")
+    assert reduce_email_body(body) == "> Can you send the file?\nYes, attached."
+
+
+def test_pure_forward_keeps_quoted_content():
+    body = ("---------- Forwarded message ---------\n"
+            "> Meeting moved to 3pm.\n")
+    assert reduce_email_body(body) == "Meeting moved to 3pm."
+
+
+def test_disclaimer_paragraph_removed():
+    body = ("Please review the draft.\n\n"
+            "CONFIDENTIALITY NOTICE: This email is confidential. If you are not the intended recipient, delete it.")
+    assert reduce_email_body(body) == "Please review the draft."
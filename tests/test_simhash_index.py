@@ -0,0 +1,75 @@
+import Utils.simhash_index as simhash_index
+from Utils.simhash_index import NearDuplicateIndex, simhash
+
+TEMPLATE_BODY = ("Dear customer, your order {order} has been shipped and will arrive within three business days. "
+                 "Track the package at https://shop.example.com/track/{order} or reply to {mail} with questions.")
+
+
+def make_record(order, score=2):
+    body = TEMPLATE_BODY.format(order=order, mail=f"user{order}@example.com")
+    return {"subject": f"Order {order} shipped", "body": body, "score": score, "summary": "发货通知"}
+
+
+def test_simhash_ignores_numbers_links_and_addresses():
+    first = simhash("Order 1001 shipped", TEMPLATE_BODY.format(order=1001, mail="a@example.com"))
+    second = simhash("Order 2002 shipped", TEMPLATE_BODY.format(order=2002, mail="b@example.org"))
+    assert first == second
+
+
+def test_lookup_finds_template_duplicate(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "index.jsonl"))
+    assert index.add_records([make_record(1001)]) == 1
+
+    record = make_record(3003)
+    entry, distance = index.lookup(record["subject"], record["body"])
+    assert entry == {"score": 2, "summary": "发货通知"}
+    assert distance == 0
+
+
+def test_lookup_ignores_unrelated_mail(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "index.jsonl"))
+    index.add_records([make_record(1001)])
+    entry, distance = index.lookup(
+        "Quarterly budget review",
+        "Hi team, attached are the revised numbers for the quarterly budget. Please comment before the meeting."
+    )
+    assert entry is None and distance is None
+
+
+def test_lookup_respects_hamming_distance(tmp_path, monkeypatch):
+    """每一块都翻转一位 (距离分布在不同分块中) 时，距离恰好为 max_distance 仍能命中，超出则不命中。"""
+    index = NearDuplicateIndex(str(tmp_path / "index.jsonl"), max_distance=3)
+    base = 0x0123456789abcdef
+    index._insert(base, {"score": 4})
+
+    within = base ^ (1 << 0) ^ (1 << 20) ^ (1 << 40)
+    monkeypatch.setattr(simhash_index, "simhash", lambda subject, body: (within, 20))
+    assert index.lookup("", "") == ({"score": 4}, 3)
+
+    beyond = within ^ (1 << 60)
+    monkeypatch.setattr(simhash_index, "simhash", lambda subject, body: (beyond, 20))
+    assert index.lookup("", "") == (None, None)
+
+
+def test_lookup_prefers_closest_entry(tmp_path, monkeypatch):
+    index = NearDuplicateIndex(str(tmp_path / "index.jsonl"), max_distance=3)
+    base = 0xfedcba9876543210
+    index._insert(base ^ 0b11, {"score": 1})
+    index._insert(base ^ 0b1, {"score": 5})
+    monkeypatch.setattr(simhash_index, "simhash", lambda subject, body: (base, 20))
+    assert index.lookup("", "") == ({"score": 5}, 1)
+
+
+def test_short_text_and_failed_records_are_skipped(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "index.jsonl"))
+    failed = dict(make_record(1001), summary="AI处理失败: timeout")
+    short = {"subject": "hi", "body": "ok", "score": 3}
+    assert index.add_records([failed, short]) == 0
+    assert index.lookup("hi", "ok") == (None, None)
+
+
+def test_index_reloads_from_disk(tmp_path):
+    index_path = str(tmp_path / "index.jsonl")
+    NearDuplicateIndex(index_path).add_records([make_record(1001)])
+    record = make_record(4004)
+    assert NearDuplicateIndex(index_path).lookup(record["subject"], record["body"])[0]["score"] == 2
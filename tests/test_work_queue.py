@@ -0,0 +1,89 @@
+from Utils.domain_index import DomainScoreIndex
+from Utils.work_queue import AIWorkQueue, KIND_RECEIVED, KIND_SENT, PriorityRules
+
+
+def by_priority(email):
+    return email["priority"]
+
+
+def make_email(name, priority):
+    return {"subject": name, "priority": priority}
+
+
+def test_peek_all_orders_by_priority_and_keeps_items(tmp_path):
+    queue = AIWorkQueue(str(tmp_path / "queue.json"))
+    low, high, sent = make_email("low", 1), make_email("high", 5), make_email("sent", 3)
+    queue.push(KIND_RECEIVED, [low, high], by_priority)
+    queue.push(KIND_SENT, [sent], by_priority)
+
+    batch = queue.peek_all()
+    assert batch[KIND_RECEIVED] == [high, low]
+    assert batch[KIND_SENT] == [sent]
+    # 列出后工作仍在队列中，处理完成才移除
+    assert len(queue) == 3
+    assert queue.peek_all()[KIND_RECEIVED] == [high, low]
+
+
+def test_remove_only_removes_given_emails(tmp_path):
+    queue = AIWorkQueue(str(tmp_path / "queue.json"))
+    first, second = make_email("first", 1), make_email("second", 1)
+    queue.push(KIND_RECEIVED, [first, second], by_priority)
+    queue.remove([first])
+    assert queue.peek_all()[KIND_RECEIVED] == [second]
+
+
+def test_same_priority_keeps_enqueue_order(tmp_path):
+    queue = AIWorkQueue(str(tmp_path / "queue.json"))
+    emails = [make_email(str(i), 2) for i in range(5)]
+    queue.push(KIND_RECEIVED, emails, by_priority)
+    assert queue.peek_all()[KIND_RECEIVED] == emails
+
+
+def test_deferred_work_ages_until_it_wins(tmp_path):
+    """每推迟一个周期获得 aging_bonus 的额外优先级，低优先级工作最终会排到新的高优先级工作之前。"""
+    queue = AIWorkQueue(str(tmp_path / "queue.json"), aging_bonus=0.5)
+    old = make_email("old", 1)
+    queue.push(KIND_RECEIVED, [old], by_priority)
+
+    for cycle in range(1, 4):
+        work = queue.peek_all()[KIND_RECEIVED]
+        queue.remove(work)
+        # 本周期未处理完的工作重新入队
+        queue.push(KIND_RECEIVED, [old], by_priority)
+        assert queue.items[-1]["cycles_waited"] == cycle
+
+    assert queue.effective_priority(queue.items[0]) == 2.5
+    new = make_email("new", 2)
+    queue.push(KIND_RECEIVED, [new], by_priority)
+    assert queue.items[-1]["cycles_waited"] == 0
+    assert queue.peek_all()[KIND_RECEIVED] == [old, new]
+
+
+def test_save_and_load_round_trip(tmp_path):
+    queue_path = str(tmp_path / "queue.json")
+    queue = AIWorkQueue(queue_path)
+    queue.push(KIND_RECEIVED, [make_email("a", 1), make_email("b", 4)], by_priority)
+    queue.save()
+
+    reloaded = AIWorkQueue(queue_path)
+    assert [email["subject"] for email in reloaded.peek_all()[KIND_RECEIVED]] == ["b", "a"]
+
+
+def test_corrupt_queue_file_is_ignored(tmp_path):
+    queue_path = tmp_path / "queue.json"
+    queue_path.write_text("{not json", encoding="utf-8")
+    assert len(AIWorkQueue(str(queue_path))) == 0
+
+
+def test_priority_rules_estimate():
+    rules = PriorityRules(unknown_sender_score=3, known_address_bonus=2.0, urgent_keyword_bonus=3.0,
+                          header_priority_bonus=2.0, no_reply_penalty=1.0, sent_priority=4.0,
+                          urgent_keywords=["urgent"], no_reply_patterns=["noreply"])
+    score_index = DomainScoreIndex.from_score_list({"example.com": {"boss": 5, "noreply": 1}})
+
+    assert rules.estimate({"type": "sent"}, score_index, set()) == 4.0
+    assert rules.estimate({"sender_name": "someone", "sender_root": "unknown.org"}, score_index, set()) == 3.0
+    assert rules.estimate({"sender_name": "boss", "sender_root": "example.com", "subject": "URGENT: sign"},
+                          score_index, {"boss@example.com"}) == 10.0
+    # 已格式化的收信只有 sender 字段
+    assert rules.estimate({"sender": "noreply@example.com", "importance": "low"}, score_index, set()) == -2.0